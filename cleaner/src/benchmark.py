@@ -0,0 +1,345 @@
+import argparse
+import time
+import os
+import sys
+import json
+import platform
+import resource
+import tempfile
+import multiprocessing as mp
+import pandas as pd
+
+from collections import Counter
+
+from logzero import logger
+
+from cleaner import Cleaner
+import nltk
+
+from helpers import load_contractions, character_transformer, unicode_remover, character_remover, TextNormalizer, lemmatize, Lemmatizer, save_tfidf
+from synthetic import ReviewGenerator
+from ngrams import count_ngrams
+
+
+CONTRACTION_CASES = [
+    ("i don't know", "i do not know"),
+    ("it’s great, isn't it?", "it has / it is great, is not it?"),
+    ("we can't've waited", "we cannot have waited"),
+    ("'cause they're late", "because they are late"),
+    ("the don'ts of dining", "the don'ts of dining"),
+    ("no contraction here", "no contraction here"),
+]
+
+
+def legacy_contraction_transformer(document, filename):
+    """ Contraction transformer before the compiled expander (opens the mapping file once per review) """
+
+    with open(filename) as contractions:
+        for word in document.split():
+            if word in contractions:
+                document = document.replace(word, contractions[word])
+    return document
+
+
+def bench_contractions(filepath, contraction_filename='assets/contractions.json'):
+    """ Compares per-review latency of the legacy and compiled contraction expansion and checks the output """
+
+    reviews = [review.lower() for review in pd.read_json(filepath, lines=True)['comment']]
+    expander = load_contractions(contraction_filename)
+
+    for document, expected in CONTRACTION_CASES:
+        output = expander.expand(document)
+        assert output == expected, f'{document!r} expanded to {output!r} instead of {expected!r}'
+
+    start = time.perf_counter()
+    for review in reviews:
+        legacy_contraction_transformer(review, contraction_filename)
+    legacy_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    expanded = [expander.expand(review) for review in reviews]
+    elapsed = time.perf_counter() - start
+
+    remaining = sum(expander.pattern.search(review) is not None for review in expanded)
+
+    print(f'reviews={len(reviews)}')
+    print(f'legacy   : {legacy_elapsed / len(reviews) * 1e6:10.1f} us/review')
+    print(f'compiled : {elapsed / len(reviews) * 1e6:10.1f} us/review  speedup=x{legacy_elapsed / elapsed:.1f}')
+    print(f'checks   : {len(CONTRACTION_CASES)} cases passed, {remaining} reviews with unexpanded contractions')
+
+
+def legacy_clean(document, contraction_expander):
+    """ Cleaning before the fused normalizer (five passes over the document) """
+
+    cleaned_document = document.lower()
+    cleaned_document = contraction_expander.expand(cleaned_document)
+    cleaned_document = character_transformer(cleaned_document)
+    cleaned_document = unicode_remover(cleaned_document)
+    cleaned_document = character_remover(cleaned_document)
+    return cleaned_document
+
+
+def bench_cleaning(filepath, contraction_filename='assets/contractions.json'):
+    """ Compares per-review cleaning cost of the five-pass cleaning and the fused normalizer, and checks the output """
+
+    reviews = pd.read_json(filepath, lines=True)['comment']
+    expander = load_contractions(contraction_filename)
+    normalizer = TextNormalizer(expander)
+
+    start = time.perf_counter()
+    legacy = [legacy_clean(review, expander) for review in reviews]
+    legacy_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    fused = [normalizer.normalize(review) for review in reviews]
+    fused_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batch = normalizer.normalize_batch(reviews)
+    batch_elapsed = time.perf_counter() - start
+
+    print(f'reviews={len(reviews)}')
+    print(f'five passes : {legacy_elapsed / len(reviews) * 1e6:10.1f} us/review')
+    print(f'normalize   : {fused_elapsed / len(reviews) * 1e6:10.1f} us/review  speedup=x{legacy_elapsed / fused_elapsed:.1f}')
+    print(f'batch       : {batch_elapsed / len(reviews) * 1e6:10.1f} us/review  speedup=x{legacy_elapsed / batch_elapsed:.1f}')
+    print(f'output_matches={fused == legacy and batch.to_list() == legacy}')
+
+
+def bench_lemmatization(filepath, batch_size=1000):
+    """ Compares per-document tagging and lemmatization with the batched and cached Lemmatizer, and checks the output """
+
+    cleaner = Cleaner()
+    cleaned_reviews = cleaner.clean_batch(pd.read_json(filepath, lines=True)['comment'].to_list())
+    tokenized_reviews = [nltk.word_tokenize(review) for review in cleaned_reviews]
+    stop_words = list(cleaner.lemmatizer.stop_words)
+
+    start = time.perf_counter()
+    legacy = [lemmatize(tokens, stop_words, cleaner.tag_dict) for tokens in tokenized_reviews]
+    legacy_elapsed = time.perf_counter() - start
+
+    lemmatizer = Lemmatizer(stop_words, cleaner.tag_dict)
+    start = time.perf_counter()
+    batched = []
+    for start_batch in range(0, len(tokenized_reviews), batch_size):
+        batched += lemmatizer.lemmatize_batch(tokenized_reviews[start_batch:start_batch + batch_size])
+    elapsed = time.perf_counter() - start
+
+    print(f'reviews={len(tokenized_reviews)}')
+    print(f'per document : {len(tokenized_reviews) / legacy_elapsed:10.1f} reviews/sec')
+    print(f'batched      : {len(tokenized_reviews) / elapsed:10.1f} reviews/sec  speedup=x{legacy_elapsed / elapsed:.1f}')
+    print(f'cache        : {lemmatizer.cache_stats()}')
+    print(f'output_matches={batched == legacy}')
+
+
+def bench_preprocessing(filepath, workers_list, ngram=2):
+    """ Times Cleaner.preprocessing for each number of workers and checks the output against the serial run """
+
+    cleaner = Cleaner()
+    reference = None
+
+    for workers in workers_list:
+        cleaner.set_file(filepath)
+        nb_reviews = len(cleaner.corpus_items())
+
+        start = time.perf_counter()
+        cleaner.preprocessing(ngram=ngram, workers=workers)
+        elapsed = time.perf_counter() - start
+
+        output = (cleaner.tokenized_corpus, cleaner.word_count, cleaner.tokenized_corpus_ngram)
+        if reference is None:
+            reference = output
+        matches = output == reference
+
+        print(f'workers={workers:<3} reviews={nb_reviews:<8} time={elapsed:8.2f}s '
+              f'throughput={nb_reviews / elapsed:10.1f} reviews/sec  output_matches={matches}')
+    print(f'lemma cache: {cleaner.lemma_cache_stats()}')
+
+
+def bench_ngrams(filepath, max_n=3, max_distinct=None):
+    """ 
+    Compares per-review nltk.ngrams tuple lists aggregated with a Counter and the vectorized count_ngrams, and checks the counts
+        - with max_distinct, checks that the kept counts are exact and that no n-gram seen more than max_errors times is missing
+    """
+
+    cleaner = Cleaner()
+    cleaner.set_file(filepath)
+    cleaner.preprocessing()
+    tokenized_reviews = list(cleaner.tokenized_corpus.values())
+
+    start = time.perf_counter()
+    legacy = {n: Counter(' '.join(ngram) for tokens in tokenized_reviews for ngram in nltk.ngrams(tokens, n)) for n in range(1, max_n + 1)}
+    legacy_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    ngram_counts = count_ngrams(cleaner.token_store, max_n, max_distinct=max_distinct)
+    elapsed = time.perf_counter() - start
+
+    print(f'reviews={len(tokenized_reviews)} max_n={max_n} max_distinct={max_distinct}')
+    print(f'nltk.ngrams   : {legacy_elapsed:8.3f}s')
+    print(f'count_ngrams  : {elapsed:8.3f}s  speedup=x{legacy_elapsed / elapsed:.1f}')
+    if max_distinct is None:
+        print(f'output_matches={all(ngram_counts.frequencies(n) == dict(legacy[n]) for n in legacy)}')
+        return
+    for n in legacy:
+        frequencies = ngram_counts.frequencies(n)
+        max_error = ngram_counts.max_errors[n]
+        missing = [phrase for phrase, count in legacy[n].items() if count > max_error and phrase not in frequencies]
+        print(f'n={n} distinct={len(legacy[n])} kept={len(frequencies)} max_error={max_error} '
+              f'exact_counts={all(legacy[n][phrase] == count for phrase, count in frequencies.items())} missing_above_max_error={len(missing)}')
+
+
+SUITE_STAGES = ['clean', 'tokenize', 'preprocessing', 'compute_restaurant_tfidf', 'save_files']
+
+
+def peak_rss_mb(who=resource.RUSAGE_SELF):
+    """ Peak resident set size of the process (or of its terminated children) since it started, in MB """
+
+    peak = resource.getrusage(who).ru_maxrss
+    return round(peak / 2**20 if sys.platform == 'darwin' else peak / 2**10, 1)
+
+
+def stage_result(elapsed, nb_items, unit):
+    return {'seconds': round(elapsed, 3), unit: nb_items, f'{unit}_per_sec': round(nb_items / elapsed, 1) if elapsed > 0 else None,
+            'peak_rss_mb': peak_rss_mb(), 'children_peak_rss_mb': peak_rss_mb(resource.RUSAGE_CHILDREN)}
+
+
+def run_scale(filepath, workers, ngram, chunk_size, stages, results):
+    """ Times the stages of the cleaner on one reviews file (in its own process, so that peak RSS is per scale) """
+
+    cleaner = Cleaner()
+    cleaner.set_file(filepath)
+    items = cleaner.corpus_items()
+    documents = [review for _, review in items]
+    scale_results = {'reviews': len(items), 'restaurants': len(cleaner.restaurant_ids()), 'stages': {}}
+
+    cleaned_documents = None
+    if 'clean' in stages:
+        start = time.perf_counter()
+        cleaned_documents = [cleaner.clean(document) for document in documents]
+        scale_results['stages']['clean'] = stage_result(time.perf_counter() - start, len(documents), 'reviews')
+
+    if 'tokenize' in stages:
+        if cleaned_documents is None:
+            cleaned_documents = cleaner.clean_batch(documents)
+        start = time.perf_counter()
+        for start_chunk in range(0, len(cleaned_documents), chunk_size):
+            cleaner.tokenize_batch(cleaned_documents[start_chunk:start_chunk + chunk_size], ngram)
+        scale_results['stages']['tokenize'] = stage_result(time.perf_counter() - start, len(documents), 'reviews')
+    del cleaned_documents
+
+    # preprocessing without its final TF-IDF, timed apart
+    start = time.perf_counter()
+    for idx, tokens in cleaner.preprocess_items(items, workers, chunk_size):
+        cleaner.store_tokens(idx, tokens)
+    cleaner.build_token_store(ngram)
+    if 'preprocessing' in stages:
+        scale_results['stages']['preprocessing'] = stage_result(time.perf_counter() - start, len(items), 'reviews')
+
+    start = time.perf_counter()
+    cleaner.compute_restaurant_tfidf()
+    if 'compute_restaurant_tfidf' in stages:
+        scale_results['stages']['compute_restaurant_tfidf'] = stage_result(time.perf_counter() - start, len(cleaner.word_frequency), 'restaurants')
+
+    if 'save_files' in stages:
+        with tempfile.TemporaryDirectory() as directory:
+            start = time.perf_counter()
+            failures = cleaner.save_files(directory + '/', save_tfidf, workers=workers)
+            scale_results['stages']['save_files'] = stage_result(time.perf_counter() - start, len(cleaner.word_frequency) - len(failures), 'restaurants')
+
+    scale_results['peak_rss_mb'] = peak_rss_mb()
+    scale_results['children_peak_rss_mb'] = peak_rss_mb(resource.RUSAGE_CHILDREN)
+    results.put(scale_results)
+
+
+def bench_suite(scales, sample_filepath, data_directory, output_filepath, workers=1, ngram=2, chunk_size=1000, stages=SUITE_STAGES, seed=0):
+    """ 
+    Times each stage of the cleaner on synthetic reviews files of each scale and writes the results as JSON
+        - files are generated once per (scale, seed) in data_directory and reused
+        - each scale runs in a new process, peak RSS is reported for the process and for its worker processes
+    """
+
+    try:
+        os.mkdir(data_directory)
+    except OSError:
+        logger.warn("OSError: directory already exists")
+
+    generator = None
+    suite = {'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(), 'platform': platform.platform(),
+             'cpu_count': os.cpu_count(), 'seed': seed, 'workers': workers, 'ngram': ngram, 'chunk_size': chunk_size, 'scales': []}
+
+    for scale in scales:
+        filepath = os.path.join(data_directory, f'synthetic_reviews_{scale}_{seed}.json')
+        if not os.path.exists(filepath):
+            if generator is None:
+                generator = ReviewGenerator(sample_filepath, seed=seed)
+            generator.write(filepath, scale)
+
+        results = mp.Queue()
+        process = mp.Process(target=run_scale, args=(filepath, workers, ngram, chunk_size, stages, results))
+        process.start()
+        scale_results = results.get()
+        process.join()
+
+        scale_results['scale'] = scale
+        suite['scales'].append(scale_results)
+        for stage, result in scale_results['stages'].items():
+            unit = 'reviews' if 'reviews' in result else 'restaurants'
+            print(f'scale={scale:<8} {stage:<25} time={result["seconds"]:9.2f}s  '
+                  f'throughput={result[unit + "_per_sec"]:10.1f} {unit}/sec  peak_rss={result["peak_rss_mb"]:8.1f}MB')
+
+        # Written after each scale so that a long run keeps its finished scales
+        with open(output_filepath, 'w') as output_file:
+            json.dump(suite, output_file, indent=2)
+
+    return suite
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Benchmarks of the cleaner pipeline")
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    parser_preprocessing = subparsers.add_parser('preprocessing', help='throughput of Cleaner.preprocessing per number of workers')
+    parser_preprocessing.add_argument('-f', '--file', type=str, required=True, help='path to the reviews file')
+    parser_preprocessing.add_argument('-w', '--workers', nargs="*", type=int, default=[1, 2, 4], help='numbers of workers to benchmark')
+    parser_preprocessing.add_argument('-n', '--ngram', type=int, default=2, help='ngram argument of preprocessing')
+
+    parser_contractions = subparsers.add_parser('contractions', help='per-review latency of contraction expansion')
+    parser_contractions.add_argument('-f', '--file', type=str, required=True, help='path to the reviews file')
+
+    parser_cleaning = subparsers.add_parser('cleaning', help='per-review latency of Cleaner.clean')
+    parser_cleaning.add_argument('-f', '--file', type=str, required=True, help='path to the reviews file')
+
+    parser_lemmatization = subparsers.add_parser('lemmatization', help='throughput of POS tagging and lemmatization')
+    parser_lemmatization.add_argument('-f', '--file', type=str, required=True, help='path to the reviews file')
+
+    parser_ngrams = subparsers.add_parser('ngrams', help='time of 1..N-gram counting over the corpus')
+    parser_ngrams.add_argument('-f', '--file', type=str, required=True, help='path to the reviews file')
+    parser_ngrams.add_argument('-n', '--ngram', type=int, default=3, help='highest n-gram order')
+    parser_ngrams.add_argument('--max_distinct', type=int, default=None, help='max_distinct argument of count_ngrams')
+
+    parser_suite = subparsers.add_parser('suite', help='time, throughput and peak RSS of each cleaner stage on synthetic reviews')
+    parser_suite.add_argument('--scales', nargs="*", type=int, default=[10000, 100000, 1000000], help='numbers of reviews to generate')
+    parser_suite.add_argument('--sample', type=str, default='../scraper/scraped_data/reviews/reviews_1.json',
+                              help='scraped reviews file whose distributions the synthetic reviews follow')
+    parser_suite.add_argument('--data_directory', type=str, default='./benchmark_data/', help='directory of the generated reviews files')
+    parser_suite.add_argument('-o', '--output', type=str, default='./benchmark_results.json', help='path to the JSON results file')
+    parser_suite.add_argument('-w', '--workers', type=int, default=1, help='number of processes of preprocessing and save_files')
+    parser_suite.add_argument('-n', '--ngram', type=int, default=2, help='ngram argument of preprocessing')
+    parser_suite.add_argument('--stages', nargs="*", type=str, default=SUITE_STAGES, choices=SUITE_STAGES, help='stages to time')
+    parser_suite.add_argument('--seed', type=int, default=0, help='seed of the review generator')
+
+    args = parser.parse_args()
+
+    if args.benchmark == 'preprocessing':
+        bench_preprocessing(args.file, args.workers, args.ngram)
+    elif args.benchmark == 'contractions':
+        bench_contractions(args.file)
+    elif args.benchmark == 'cleaning':
+        bench_cleaning(args.file)
+    elif args.benchmark == 'lemmatization':
+        bench_lemmatization(args.file)
+    elif args.benchmark == 'ngrams':
+        bench_ngrams(args.file, args.ngram, args.max_distinct)
+    elif args.benchmark == 'suite':
+        bench_suite(args.scales, args.sample, args.data_directory, args.output, args.workers, args.ngram, stages=args.stages, seed=args.seed)
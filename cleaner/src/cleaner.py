@@ -3,33 +3,115 @@ import numpy as np
 import nltk
 import json
 import os
+import tempfile
 import logging
 import logzero
 from logzero import logger
 
-from helpers import unicode_remover, character_remover, character_transformer, contraction_transformer, lemmatize
+from helpers import TextNormalizer, Lemmatizer, load_contractions, load_mask, cache_stats_dict
+from tfidf import SparseTfidf, passthrough_analyzer
+from token_cache import TokenCache, config_hash
+from storage import tokenized_filename, tokenized_writer
+from token_store import TokenStoreBuilder
+from ngrams import count_ngrams
+from instrumentation import Instrumentation, Profile, directory_bytes
 
 from nltk.tokenize import word_tokenize
 from nltk.corpus import wordnet
 
-from collections import Counter
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
 from sklearn.feature_extraction.text import TfidfVectorizer
-from PIL import Image
+
+
+# Cleaner instance of a preprocessing worker process, built once by _init_worker
+_worker_cleaner = None
+
+
+def _init_worker(stop_words_filename, debug, lemma_cache_size, instrument=False):
+    """ Loads stop words, tagger and lemmatizer once per worker process """
+
+    global _worker_cleaner
+    _worker_cleaner = Cleaner(stop_words_filename=stop_words_filename, debug=debug, lemma_cache_size=lemma_cache_size,
+                              instrument=instrument)
+
+
+def _preprocess_chunk(chunk):
+    """ 
+    Cleans and tokenizes a chunk of (review_id, review) pairs in a worker process
+        - returns the pid, the lemma cache stats and the instrumentation summary of the worker so far, and the (review_id, tokens) pairs
+    """
+
+    chunk_tokens = _worker_cleaner.preprocess_chunk(chunk)
+    return os.getpid(), _worker_cleaner.lemmatizer.cache_stats(), _worker_cleaner.instrumentation.summary(), chunk_tokens
+
+
+def tokenize_chunk(chunk):
+    """ Cleans and tokenizes a chunk of (review_id, review) pairs in a worker set up by _init_worker, returns the (review_id, tokens) pairs """
+
+    return _worker_cleaner.preprocess_chunk(chunk)
+
+
+# Export callable, directory and decoded mask of an export worker process, set once by _init_export_worker
+_export_settings = None
+
+
+def _init_export_worker(callable_name, directory, mask):
+    """ Receives the export settings and the decoded mask once per worker process """
+
+    global _export_settings
+    _export_settings = (callable_name, directory, mask)
+
+
+def _export_restaurant(restaurant_id, tfidf):
+    callable_name, directory, mask = _export_settings
+    return export_restaurant(callable_name, tfidf, restaurant_id, directory, mask)
+
+
+def export_restaurant(callable_name, tfidf, restaurant_id, directory, mask):
+    """ Saves the file of one restaurant, returns (restaurant_id, None) or (restaurant_id, error message) if it failed """
+
+    try:
+        callable_name(tfidf, restaurant_id, directory, mask)
+    except Exception as error:
+        return restaurant_id, f'{type(error).__name__}: {error}'
+    return restaurant_id, None
+
 
 class Cleaner():
 
-    def __init__(self, stop_words_filename='custom_stop_words.txt', debug=False, early_stop=None):
+    def __init__(self, stop_words_filename='custom_stop_words.txt', debug=False, early_stop=None, lemma_cache_size=100000,
+                 cache_directory=None, cache_max_entries=1000000, cache_max_bytes=2**30, cache_max_age_days=30,
+                 instrument=False, profile_path=None):
         
         assets_directory = 'assets/'
+        self.stop_words_filename = stop_words_filename
         self.init_stop_words(assets_directory + stop_words_filename)
         self.contraction_filename = assets_directory + 'contractions.json'
+        self.contraction_expander = load_contractions(self.contraction_filename)
+        self.normalizer = TextNormalizer(self.contraction_expander)
         self.early_stop = early_stop
+        self.debug = debug
         self.tag_dict = {
             "J": wordnet.ADJ,
             "N": wordnet.NOUN,
             "V": wordnet.VERB,
             "R": wordnet.ADV
         }
+        self.lemma_cache_size = lemma_cache_size
+        self.lemmatizer = Lemmatizer(self.stop_words, self.tag_dict, cache_size=lemma_cache_size)
+        self.worker_cache_stats = []
+
+        # Per-stage timers and counters (no-ops unless instrument), and optional cProfile output of preprocessing
+        self.instrument = instrument
+        self.instrumentation = Instrumentation(enabled=instrument)
+        self.profile_path = profile_path
+
+        # Persistent token cache, only unseen or changed reviews are preprocessed
+        self.token_cache = None
+        if cache_directory is not None:
+            self.token_cache = TokenCache(cache_directory, config_hash(self.stop_words, self.contraction_expander.contractions),
+                                          max_entries=cache_max_entries, max_bytes=cache_max_bytes, max_age_days=cache_max_age_days)
 
         # Set logging level
         logzero.loglevel(logging.WARNING)
@@ -51,45 +133,153 @@ class Cleaner():
     def set_file(self, filepath, index_col='review_id', content_col='comment'):
         """ 
         Sets a new file to be cleaned:
-            - self.tokenized_corpus: dict{int: review_id, list[str]: tokenized review (cleaned + split)}
-            - self.tokenized_corpus_ngram: dict{int: review_id, list[tuple(n * str)]: tokenized review (cleaned + split)}
+            - self.token_store = TokenStore of the tokenized reviews (vocabulary, int32 token ids and offsets, sparse word counts)
+            - self.tokenized_corpus: dict-like view {int: review_id, list[str]: tokenized review (cleaned + split)} of self.token_store
+            - self.tokenized_corpus_ngram: dict-like view {int: review_id, list[tuple(n * str)]: tokenized review (cleaned + split)}
             - self.tokenized_corpus_sentences = dict{int: restaurant_id, str: tokenized review sentence}
-            - self.word_count = dict{int: review_id, dict{str: word, int: count}}
+            - self.word_count = dict-like view {int: review_id, Counter{str: word, int: count}} of self.token_store
             - self.word_count_by_restaurant = dict{int: restaurant_id, dict{str: word, int: count}}
-            - self.df_word_frequency = dict{int: restaurant_id, df(index = review_id, columns = set of vocab per restaurant)}
+            - self.word_frequency = dict{int: restaurant_id, SparseTfidf(rows = review_id, columns = set of vocab per restaurant)}
+            - self.df_word_frequency = dense DataFrame view of self.word_frequency, computed on access
+            - self.restaurant_index = dict{int: restaurant_id, array[int]: review_ids}, built once by index_restaurants
+            - self.skipped_reviews = dict{int: review_id, str: reason why the review is not in the restaurant TF-IDF}
+            - self.corpus_tfidf = SparseTfidf(rows = review_id, columns = vocab of the corpus), only with vocabulary='corpus'
+            - self.restaurant_rows = dict{int: restaurant_id, (int, int): rows of the restaurant in self.corpus_tfidf}
+            - self.ngram_counts = NgramCounts of the corpus and per restaurant, only after compute_ngrams
 
         Raises:
             TypeError: if filename is not of type str
         """
 
         if isinstance(filepath, str):
-            self.filename = filepath.split('/')[-1]
+            self.reset_outputs(filepath, index_col, content_col)
             json = pd.read_json(filepath, lines=True)
             json.set_index(index_col, inplace = True)
             self.df = json
-            self.index_col = index_col
-            self.content_col = content_col
-            self.tokenized_corpus = {}
-            self.tokenized_corpus_ngram = {}
-            self.tokenized_corpus_sentences = {}
-            self.word_count = {}
-            self.word_count_by_restaurant = {}
-            self.df_word_frequency = {}
         else:
             raise TypeError("Input types accepted: str")
 
         self.corpus = dict(zip(self.df.index, self.df[self.content_col]))
 
 
+    def reset_outputs(self, filepath, index_col, content_col):
+        """ Resets the file name, columns and outputs before cleaning a new file """
+
+        self.filename = filepath.split('/')[-1]
+        self.index_col = index_col
+        self.content_col = content_col
+        self.token_store = None
+        self.token_store_builder = TokenStoreBuilder()
+        self.tokenized_corpus = {}
+        self.tokenized_corpus_ngram = {}
+        self.tokenized_corpus_sentences = {}
+        self.word_count = {}
+        self.word_count_by_restaurant = {}
+        self.word_frequency = {}
+        self.restaurant_index = None
+        self.skipped_reviews = {}
+        self.corpus_tfidf = None
+        self.restaurant_rows = {}
+        self.ngram_counts = None
+        self.partition_directory = None
+
+
+    def stream_file(self, filepath, directory, chunk_size=1000, index_col='review_id', content_col='comment', col='restaurant_id',
+                    vocabulary='restaurant', output_format='json'):
+        """ 
+        Cleans a file chunk by chunk, peak memory is bounded by chunk_size instead of the file size:
+            - each chunk of chunk_size reviews is read, cleaned and tokenized, then dropped
+            - tokenized reviews are written incrementally in output_format (same files as save_tokenized_corpus)
+            - self.word_count_by_restaurant is merged chunk by chunk
+            - tokenized reviews are spilled to one partition file per restaurant, read back one restaurant at a time by compute_restaurant_tfidf
+
+        self.tokenized_corpus, self.word_count and self.tokenized_corpus_ngram are not kept, and n-grams are not counted, in streaming mode.
+
+        Raises:
+            TypeError: if filename is not of type str
+        """
+
+        if not isinstance(filepath, str):
+            raise TypeError("Input types accepted: str")
+        if not isinstance(chunk_size, int) or chunk_size < 1:
+            raise ValueError("chunk_size argument must be strictly positive integer")
+
+        logger.warn(' > STARTING STREAMING PREPROCESSING')
+
+        self.reset_outputs(filepath, index_col, content_col)
+        self.df = None
+        self.corpus = None
+        self.partition_directory = tempfile.TemporaryDirectory(prefix='partitions_')
+
+        try:
+            os.mkdir(directory)
+        except OSError:
+            logger.warn("OSError: directory already exists")
+
+        output_filename = tokenized_filename(self.filename, output_format)
+        logger.warn(f' > Writing {output_filename}')
+        writer = tokenized_writer(directory + output_filename, output_format)
+        stop = False
+
+        with Profile(self.profile_path), self.instrumentation.stage('preprocessing'):
+            try:
+                for chunk_number, df_chunk in enumerate(pd.read_json(filepath, lines=True, chunksize=chunk_size)):
+                    logger.warn(f' > CLEANING AND TOKENAZING CHUNK ({chunk_number})')
+
+                    chunk, restaurant_ids = [], {}
+                    for idx, review, restaurant_id in zip(df_chunk[index_col], df_chunk[content_col], df_chunk[col]):
+                        chunk.append((idx, review))
+                        restaurant_ids[idx] = int(restaurant_id)
+                        if self.early_stop is not None and idx >= self.early_stop:
+                            logger.warn(f' > EARLY STOPPING AT IDX ({idx})')
+                            stop = True
+                            break
+
+                    partitions = {}
+                    chunk_tokens = list(self.preprocess_items(chunk, chunk_size=chunk_size))
+                    for idx, tokenized_review in chunk_tokens:
+                        restaurant_id = restaurant_ids[idx]
+                        self.word_count_by_restaurant.setdefault(restaurant_id, Counter()).update(tokenized_review)
+                        partitions.setdefault(restaurant_id, []).append(json.dumps([int(idx), tokenized_review]) + '\n')
+
+                    with self.instrumentation.stage('write_tokenized'):
+                        writer.write([idx for idx, _ in chunk_tokens], [restaurant_ids[idx] for idx, _ in chunk_tokens],
+                                     [tokenized_review for _, tokenized_review in chunk_tokens])
+
+                    with self.instrumentation.stage('write_partitions'):
+                        for restaurant_id, lines in partitions.items():
+                            with open(self.partition_path(restaurant_id), 'a') as partition:
+                                partition.writelines(lines)
+
+                    if stop:
+                        break
+            finally:
+                writer.close()
+        if self.instrumentation.enabled:
+            self.instrumentation.count('bytes_written', os.path.getsize(directory + output_filename))
+        self.evict_token_cache()
+
+        logger.warn(f' > LEMMA CACHE STATS {self.lemma_cache_stats()}')
+
+        self.compute_restaurant_tfidf(col, vocabulary)
+
+
+    def partition_path(self, restaurant_id):
+        """ Path of the partition file holding the tokenized reviews of a restaurant in streaming mode """
+
+        return os.path.join(self.partition_directory.name, f'{restaurant_id}.jsonl')
+
+
     def clean(self, document):
         """ Cleans document (lower case + removes word contractions, accents, unicode char, and punctuation) """
     
-        cleaned_document = document.lower()
-        cleaned_document = contraction_transformer(cleaned_document, self.contraction_filename)
-        cleaned_document = character_transformer(cleaned_document)
-        cleaned_document = unicode_remover(cleaned_document)
-        cleaned_document = character_remover(cleaned_document)
-        return cleaned_document
+        return self.normalizer.normalize(document)
+
+
+    def clean_batch(self, documents):
+        """ Cleans a list or a pandas Series of documents in one call """
+
+        return self.normalizer.normalize_batch(documents, self.instrumentation)
 
 
     def tokenize(self, document, ngram=1):
@@ -102,8 +292,36 @@ class Cleaner():
                 - opt: ngram (if greater than 1)
         """
 
-        tokenized_document = nltk.word_tokenize(document)
-        tokenized_document = lemmatize(tokenized_document, self.stop_words, self.tag_dict)
+        return self.tokenize_batch([document], ngram)[0]
+
+
+    def tokenize_batch(self, documents, ngram=1):
+        """ Tokenizes a list of documents, POS tagging them in one batch (returns one tokenize output per document) """
+
+        lemmatized_documents = self.lemmatize_batch(documents)
+        with self.instrumentation.stage('word_count_ngrams'):
+            return [self.tokenize_output(tokenized_document, ngram) for tokenized_document in lemmatized_documents]
+
+
+    def lemmatize_batch(self, documents):
+        """ Tokenizes, POS tags and lemmatizes a list of documents in one batch, returns the lemmatized tokens of each document """
+
+        instrumentation = self.instrumentation
+        with instrumentation.stage('word_tokenize'):
+            tokenized_documents = [nltk.word_tokenize(document) for document in documents]
+        with instrumentation.stage('pos_tagging'):
+            tagged_documents = self.lemmatizer.tag_batch(tokenized_documents)
+        with instrumentation.stage('lemmatization'):
+            lemmatized_documents = self.lemmatizer.lemmatize_tagged(tagged_documents)
+        if instrumentation.enabled:
+            instrumentation.count('documents', len(documents))
+            instrumentation.count('tokens', sum(len(tokenized_document) for tokenized_document in lemmatized_documents))
+        return lemmatized_documents
+
+
+    def tokenize_output(self, tokenized_document, ngram=1):
+        """ Builds the output of tokenize (unigram, word count, opt: ngram) from a lemmatized document """
+
         word_count = Counter(tokenized_document)
         if ngram > 1:
             tokenized_ngram = list(nltk.ngrams(tokenized_document, n=ngram))
@@ -112,96 +330,489 @@ class Cleaner():
             return tokenized_document, word_count
 
 
-    def preprocessing(self, ngram=1):
-        """ Prepocesses corpus of documents by cleaning, tokenizing, and word count per document """
+    def preprocess_chunk(self, chunk):
+        """ Cleans and tokenizes a list of (review_id, review) pairs, returns a list of (review_id, tokens) """
 
-        logger.warn(f' > STARTING PREPROCESSING')
+        # Chunks fully read from the token cache
+        if not chunk:
+            return []
+        cleaned_reviews = self.clean_batch([review for _, review in chunk])
+        return list(zip([idx for idx, _ in chunk], self.lemmatize_batch(cleaned_reviews)))
 
-        if not isinstance(ngram, int) or ngram < 1:
-            raise ValueError("ngram argument must be strictly positive integer")
 
-        for idx, review in self.corpus.items():
-            if idx % 1000 == 0:
-                logger.warn(f' > CLEANING AND TOKENAZING REVIEW ({idx})')
+    def lemma_cache_stats(self):
+        """ Returns the lemma cache stats of this cleaner summed with the final stats of each worker process """
+
+        all_stats = [self.lemmatizer.cache_stats()] + self.worker_cache_stats
+        return cache_stats_dict(hits=sum(stats['hits'] for stats in all_stats),
+                                misses=sum(stats['misses'] for stats in all_stats),
+                                size=sum(stats['size'] for stats in all_stats),
+                                max_size=sum(stats['max_size'] for stats in all_stats))
 
-            cleaned_review = self.clean(review)
-            
-            if ngram > 1:
-                self.tokenized_corpus[idx], self.word_count[idx], self.tokenized_corpus_ngram[idx] = self.tokenize(cleaned_review, ngram)
-            else:
-                self.tokenized_corpus[idx], self.word_count[idx] = self.tokenize(cleaned_review, ngram)
 
+    def corpus_items(self):
+        """ Returns the (review_id, review) pairs to preprocess, truncated after early_stop """
+
+        items = []
+        for idx, review in self.corpus.items():
+            items.append((idx, review))
             if self.early_stop is not None and idx >= self.early_stop:
                 logger.warn(f' > EARLY STOPPING AT IDX ({idx})')
                 break
+        return items
+
+
+    def preprocess_items(self, items, workers=1, chunk_size=1000):
+        """ 
+        Cleans and tokenizes (review_id, review) pairs, yields the (review_id, tokens) pairs in the same order, chunk by chunk
+            - only one chunk of chunk_size reviews is held at a time (2 per worker on the pool), never the whole corpus
+            - with workers > 1, chunks are processed on a pool of worker processes
+            - with a token cache, only unseen or changed reviews are processed, the others are read from the cache
+        """
+
+        chunks = [items[start:start + chunk_size] for start in range(0, len(items), chunk_size)]
+        if workers == 1 or not chunks:
+            for chunk in chunks:
+                logger.warn(f' > CLEANING AND TOKENAZING REVIEW ({chunk[0][0]})')
+                cached_tokens, keys, chunk_to_process = self.read_token_cache(chunk)
+                yield from self.merge_chunk(chunk, cached_tokens, keys, self.preprocess_chunk(chunk_to_process))
+            return
+
+        logger.warn(f' > CLEANING AND TOKENAZING {len(items)} REVIEWS IN {len(chunks)} CHUNKS ON {workers} WORKERS')
+
+        # At most 2 chunks per worker in flight, consumed in the order of items
+        pool_cache_stats, pool_summaries = {}, {}
+        in_flight = deque()
+
+        def next_done():
+            chunk, cached_tokens, keys, future = in_flight.popleft()
+            pid, cache_stats, summary, chunk_tokens = future.result()
+            pool_cache_stats[pid] = cache_stats
+            pool_summaries[pid] = summary
+            return self.merge_chunk(chunk, cached_tokens, keys, chunk_tokens)
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(self.stop_words_filename, self.debug, self.lemma_cache_size, self.instrument)) as executor:
+            for chunk_number, chunk in enumerate(chunks):
+                # Reviews found in the token cache are left out of the chunk sent to the pool
+                cached_tokens, keys, chunk_to_process = self.read_token_cache(chunk)
+                in_flight.append((chunk, cached_tokens, keys, executor.submit(_preprocess_chunk, chunk_to_process)))
+                if len(in_flight) == 2 * workers:
+                    logger.warn(f' > STORING TOKENIZED CHUNK ({chunk_number + 1 - len(in_flight)})')
+                    yield from next_done()
+            while in_flight:
+                logger.warn(f' > STORING TOKENIZED CHUNK ({len(chunks) - len(in_flight)})')
+                yield from next_done()
+        self.worker_cache_stats += pool_cache_stats.values()
+        # Worker summaries are cumulative, so only the last one of each worker is added
+        for summary in pool_summaries.values():
+            self.instrumentation.add(summary)
+
+
+    def read_token_cache(self, chunk):
+        """ Returns the cached tokens and cache keys of the reviews of chunk, and the reviews left to process """
+
+        if self.token_cache is None:
+            return {}, {}, chunk
+        with self.instrumentation.stage('token_cache'):
+            keys = {idx: self.token_cache.key(review) for idx, review in chunk}
+            found = self.token_cache.get_many(keys.values())
+            cached_tokens = {idx: found[key] for idx, key in keys.items() if key in found}
+            chunk_to_process = [(idx, review) for idx, review in chunk if idx not in cached_tokens]
+        self.instrumentation.count('cached_documents', len(cached_tokens))
+        logger.warn(f' > TOKEN CACHE: {len(cached_tokens)} REVIEWS CACHED, {len(chunk_to_process)} TO PREPROCESS')
+        return cached_tokens, keys, chunk_to_process
+
+
+    def merge_chunk(self, chunk, cached_tokens, keys, chunk_tokens):
+        """ Saves the processed reviews of chunk in the token cache, returns the (review_id, tokens) pairs of chunk in its order """
+
+        if self.token_cache is not None and chunk_tokens:
+            with self.instrumentation.stage('token_cache'):
+                self.token_cache.put_many([(keys[idx], tokens) for idx, tokens in chunk_tokens])
+        processed = dict(chunk_tokens)
+        return [(idx, processed[idx] if idx in processed else cached_tokens[idx]) for idx, _ in chunk]
+
+
+    def evict_token_cache(self):
+        """ Evicts old and least recently used entries of the token cache, once per run (a full scan of the cache) """
+
+        if self.token_cache is not None:
+            with self.instrumentation.stage('token_cache'):
+                self.token_cache.evict()
+
+
+    def store_tokens(self, idx, tokens):
+        """ Appends the tokens of one review to the token store being built (see build_token_store) """
+
+        self.token_store_builder.append(idx, tokens)
+
+    def build_token_store(self, ngram=1):
+        """ 
+        Builds self.token_store from the stored tokens, and the dict-like views on it:
+            - self.tokenized_corpus, self.word_count and, if ngram > 1, self.tokenized_corpus_ngram
+        """
+
+        with self.instrumentation.stage('token_store'):
+            self.token_store = self.token_store_builder.build()
+            self.token_store_builder = TokenStoreBuilder()
+            self.tokenized_corpus = self.token_store.tokens()
+            self.word_count = self.token_store.word_counts()
+            self.tokenized_corpus_ngram = self.token_store.ngrams(ngram) if ngram > 1 else {}
+
+
+    def preprocessing(self, ngram=1, workers=1, chunk_size=1000, vocabulary='restaurant'):
+        """ 
+        Prepocesses corpus of documents by cleaning, tokenizing, and word count per document
+
+        With workers > 1, the corpus is split into chunks of chunk_size reviews which are
+        cleaned and tokenized on a pool of worker processes. Results are identical to the serial path.
+        With a token cache (cache_directory), only unseen or changed reviews are cleaned and tokenized.
+        vocabulary is passed to compute_restaurant_tfidf.
+        """
+
+        logger.warn(f' > STARTING PREPROCESSING')
+
+        if not isinstance(ngram, int) or ngram < 1:
+            raise ValueError("ngram argument must be strictly positive integer")
+        if not isinstance(workers, int) or workers < 1:
+            raise ValueError("workers argument must be strictly positive integer")
+        if not isinstance(chunk_size, int) or chunk_size < 1:
+            raise ValueError("chunk_size argument must be strictly positive integer")
+
+        # Tokens go to the token store as each chunk is done, word counts and n-grams are derived from it afterwards
+        with Profile(self.profile_path), self.instrumentation.stage('preprocessing'):
+            for idx, tokens in self.preprocess_items(self.corpus_items(), workers, chunk_size):
+                self.store_tokens(idx, tokens)
+            self.build_token_store(ngram)
+        self.evict_token_cache()
+
+        logger.warn(f' > LEMMA CACHE STATS {self.lemma_cache_stats()}')
+        if self.token_cache is not None:
+            logger.warn(f' > TOKEN CACHE STATS {self.token_cache.stats()}')
+
+        self.compute_restaurant_tfidf(vocabulary=vocabulary)
+
+    def compute_ngrams(self, max_n=2, min_count=2, top_k=None, col='restaurant_id', max_distinct=None):
+        """ 
+        Counts the 1..max_n-grams of the token store over the corpus and per restaurant (self.ngram_counts), see ngrams.count_ngrams
+            - phrases seen less than min_count times in the corpus are dropped, then only the top_k most frequent are kept per order
+            - max_distinct bounds the memory of counting to max_distinct phrases per order, rare phrases may then be missing
+            - e.g. self.ngram_counts.group_frequencies(restaurant_id, 2, 20) gives the 20 most frequent bigrams of a restaurant
+        """
+
+        if not isinstance(max_n, int) or max_n < 1:
+            raise ValueError("max_n argument must be strictly positive integer")
+
+        logger.warn(f' > COUNTING 1 TO {max_n}-GRAMS')
+        restaurant_ids = self.df[col].reindex(self.token_store.review_ids).to_numpy(dtype=float)
+        groups = np.where(np.isnan(restaurant_ids), -1, restaurant_ids).astype(np.int64)
+        with self.instrumentation.stage('ngram_counts'):
+            self.ngram_counts = count_ngrams(self.token_store, max_n, min_count=min_count, top_k=top_k, groups=groups,
+                                             max_distinct=max_distinct)
+        return self.ngram_counts
 
-        self.compute_restaurant_tfidf()
 
-    def group_by_restaurant(self, restaurant_id):
-        """ Sets tokenized corpus per restaurant and computes associated word count """
+    def save_ngram_counts(self, directory, k=None):
+        """ Saves the k most frequent n-grams of the corpus (ngram_counts.json) and of each restaurant (ngram_counts_by_group.json) """
+
+        try:
+            os.mkdir(directory)
+        except OSError:
+            logger.warn("OSError: directory already exists")
+
+        logger.warn(f' > WRITING {directory}ngram_counts.json')
+        self.ngram_counts.save(directory + 'ngram_counts', k)
+
+
+    def index_restaurants(self, col='restaurant_id'):
+        """ 
+        Builds self.restaurant_index (restaurant_id -> review_ids) in one pass over the DataFrame
+            - reviews without restaurant id are recorded in self.skipped_reviews
+        """
+
+        review_ids = self.df.index.values
+        groups = self.df.groupby(col, sort=False).indices
+        self.restaurant_index = {int(restaurant_id): review_ids[positions] for restaurant_id, positions in groups.items()}
+
+        for review_id in review_ids[self.df[col].isna().values]:
+            self.skipped_reviews[int(review_id)] = f'no {col}'
+        return self.restaurant_index
+
+
+    def restaurant_reviews(self, restaurant_id, col='restaurant_id'):
+        """ 
+        Yields the (review_id, tokenized review) pairs of a restaurant
+            - reviews that were not preprocessed (e.g. early stop) are recorded in self.skipped_reviews
+            - in streaming mode, they are read from the partition file of the restaurant
+        """
+
+        if self.partition_directory is not None:
+            with open(self.partition_path(restaurant_id)) as partition:
+                for line in partition:
+                    review_id, tokenized_review = json.loads(line)
+                    yield review_id, tokenized_review
+            return
+
+        if self.restaurant_index is None:
+            self.index_restaurants(col)
+
+        for review_id in self.restaurant_index.get(restaurant_id, []):
+            if review_id not in self.tokenized_corpus:
+                self.skipped_reviews[int(review_id)] = 'not preprocessed'
+                continue
+            yield review_id, self.tokenized_corpus[review_id]
+
+
+    def group_by_restaurant(self, restaurant_id, col='restaurant_id'):
+        """ 
+        Sets tokenized corpus per restaurant and computes associated word count
+            - in streaming mode, word count comes from the counters merged chunk by chunk
+        """
 
-        review_ids = self.df[self.df['restaurant_id'] == restaurant_id].index.values
-        restaurant_counter = Counter()
         restaurant_corpus, tokenized_reviews = [], []
+        for review_id, tokenized_review in self.restaurant_reviews(restaurant_id, col):
+            restaurant_corpus.append(" ".join(tokenized_review))
+            tokenized_reviews.append(review_id)
+
+        if self.partition_directory is not None:
+            return self.word_count_by_restaurant[restaurant_id], restaurant_corpus, tokenized_reviews
+        return self.token_store.term_counts(tokenized_reviews), restaurant_corpus, tokenized_reviews
 
-        for review_id in review_ids:
-            try:
-                restaurant_counter.update(self.word_count[review_id])
-                restaurant_corpus.append(" ".join(self.tokenized_corpus[review_id]))
-                tokenized_reviews.append(review_id)
-            except:
-                pass
-        return restaurant_counter, restaurant_corpus, tokenized_reviews
 
+    def restaurant_ids(self, col='restaurant_id'):
+        """ Returns the restaurant ids of the file being cleaned """
 
-    def compute_restaurant_tfidf(self, col='restaurant_id'):
-        """ Computes TF-IDF Matrix of reviews per restaurant """
+        if self.partition_directory is not None:
+            return list(self.word_count_by_restaurant)
+        if self.restaurant_index is None:
+            self.index_restaurants(col)
+        return list(self.restaurant_index)
+
+
+    def compute_restaurant_tfidf(self, col='restaurant_id', vocabulary='restaurant'):
+        """ 
+        Computes TF-IDF Matrix of reviews per restaurant
+            - vocabulary='restaurant': one vocabulary and IDF fitted per restaurant
+            - vocabulary='corpus': one vocabulary and IDF fitted over all reviews, see compute_corpus_tfidf
 
-        restaurant_list = [int(element) for element in self.df[col].unique()]
+        Raises:
+            ValueError: if vocabulary is neither 'restaurant' nor 'corpus'
+        """
+
+        if vocabulary == 'corpus':
+            return self.compute_corpus_tfidf(col)
+        if vocabulary != 'restaurant':
+            raise ValueError("vocabulary argument must be 'restaurant' or 'corpus'")
+
+        restaurant_list = self.restaurant_ids(col)
+        instrumentation = self.instrumentation
+        instrumentation.count('restaurants', len(restaurant_list))
         
         for restaurant_idx in restaurant_list:
+            with instrumentation.stage('tfidf_grouping'):
+                self.word_count_by_restaurant[restaurant_idx], restaurant_corpus, tokenized_reviews = self.group_by_restaurant(restaurant_idx, col)
+            # In streaming mode the restaurant corpus is dropped once vectorized
+            if self.partition_directory is None:
+                self.tokenized_corpus_sentences[restaurant_idx] = restaurant_corpus
             try:
-                self.word_count_by_restaurant[restaurant_idx], self.tokenized_corpus_sentences[restaurant_idx], tokenized_reviews = self.group_by_restaurant(restaurant_idx)
-                vectorizer = TfidfVectorizer(stop_words='english')
-                vect_corpus = vectorizer.fit_transform(self.tokenized_corpus_sentences[restaurant_idx])
-                feature_names = np.array(vectorizer.get_feature_names())
-                self.df_word_frequency[restaurant_idx] = pd.DataFrame(data=vect_corpus.todense(), index=tokenized_reviews, columns=feature_names)
-            except:
-                pass
+                with instrumentation.stage('tfidf_fit'):
+                    vectorizer = TfidfVectorizer(stop_words='english')
+                    vect_corpus = vectorizer.fit_transform(restaurant_corpus)
+            except ValueError as error:
+                logger.warn(f' > NO TF-IDF FOR RESTAURANT ({restaurant_idx}): {error}')
+                continue
+            feature_names = vectorizer.get_feature_names_out()
+            self.word_frequency[restaurant_idx] = SparseTfidf(vect_corpus, tokenized_reviews, feature_names)
+
+        if self.skipped_reviews:
+            logger.warn(f' > SKIPPED {len(self.skipped_reviews)} REVIEWS: {dict(Counter(self.skipped_reviews.values()))}')
+
+
+    def compute_corpus_tfidf(self, col='restaurant_id'):
+        """ 
+        Computes one TF-IDF Matrix over all reviews, so that restaurants share the same columns:
+            - reviews are grouped by restaurant, and the tokenized reviews are vectorized in one pass (no re-tokenization)
+            - same features as restaurant mode: English stop words and words of less than 2 characters are dropped (see passthrough_analyzer)
+            - self.word_frequency holds the row block of each restaurant (aligned columns)
+            - self.tokenized_corpus_sentences is not filled in this mode
+        """
+
+        streaming = self.partition_directory is not None
+        review_ids = []
+
+        def documents():
+            for restaurant_idx in self.restaurant_ids(col):
+                start = len(review_ids)
+                for review_id, tokenized_review in self.restaurant_reviews(restaurant_idx, col):
+                    review_ids.append(review_id)
+                    yield tokenized_review
+                self.restaurant_rows[restaurant_idx] = (start, len(review_ids))
+                if not streaming:
+                    self.word_count_by_restaurant[restaurant_idx] = self.token_store.term_counts(review_ids[start:])
+
+        # Grouping is lazy (documents is consumed by fit_transform), so both are timed as tfidf_fit
+        try:
+            with self.instrumentation.stage('tfidf_fit'):
+                vectorizer = TfidfVectorizer(analyzer=passthrough_analyzer)
+                vect_corpus = vectorizer.fit_transform(documents())
+        except ValueError as error:
+            logger.warn(f' > NO TF-IDF FOR CORPUS: {error}')
+            return
+        self.instrumentation.count('restaurants', len(self.restaurant_rows))
+
+        feature_names = vectorizer.get_feature_names_out().tolist()
+        self.corpus_tfidf = SparseTfidf(vect_corpus, review_ids, feature_names)
+        for restaurant_idx, (start, end) in self.restaurant_rows.items():
+            if end > start:
+                self.word_frequency[restaurant_idx] = SparseTfidf(self.corpus_tfidf.matrix[start:end], review_ids[start:end], feature_names)
+
+        if self.skipped_reviews:
+            logger.warn(f' > SKIPPED {len(self.skipped_reviews)} REVIEWS: {dict(Counter(self.skipped_reviews.values()))}')
+
+
+    @property
+    def df_word_frequency(self):
+        """ Dense DataFrame view of the TF-IDF matrices (memory scales with reviews x vocabulary) """
+
+        return {restaurant_id: tfidf.to_dataframe() for restaurant_id, tfidf in self.word_frequency.items()}
             
 
-    def save_tokenized_corpus(self, directory):
-        """ Saves tokenized corpus in json file """
+    def save_tokenized_corpus(self, directory, output_format='json', col='restaurant_id', row_group_size=10000):
+        """ 
+        Saves tokenized corpus:
+            - output_format='json': json file {review_id: tokens}
+            - output_format='parquet': parquet file with columns review_id, restaurant_id, tokens (list<string>), sorted by restaurant,
+              in row groups of about row_group_size reviews that never split a restaurant
+        """
         
         try:
             os.mkdir(directory)
         except OSError:
             logger.warn("OSError: directory already exists")
-            
-        with open((directory + 'tokenized_' + self.filename), 'w') as tokenized_reviews:
-            logger.warn(f' > Writing tokenized_{self.filename}')
-            json.dump(self.tokenized_corpus, tokenized_reviews)
+
+        with self.instrumentation.stage('save_tokenized_corpus'):
+            self.write_tokenized_corpus(directory, output_format, col, row_group_size)
+        if self.instrumentation.enabled:
+            self.instrumentation.count('bytes_written', os.path.getsize(directory + tokenized_filename(self.filename, output_format)))
+
+
+    def write_tokenized_corpus(self, directory, output_format, col, row_group_size=10000):
+        """ Writes the tokenized corpus file of save_tokenized_corpus """
+
+        output_filename = tokenized_filename(self.filename, output_format)
+        logger.warn(f' > Writing {output_filename}')
+
+        # Reviews are decoded from the token store one at a time, the json output is the same as json.dump of a dict
+        if output_format == 'json':
+            writer = tokenized_writer(directory + output_filename, output_format)
+            try:
+                writer.write(self.tokenized_corpus.keys(), None, self.tokenized_corpus.values())
+            finally:
+                writer.close()
+            return
+
+        review_ids = list(self.tokenized_corpus)
+        restaurant_ids = self.df[col].reindex(review_ids).values
+        # Sorted by restaurant and written in row groups cut between restaurants (one row group per write), so that the
+        # min/max statistics of each row group let readers filtering on restaurant_id skip the other row groups
+        order = np.argsort(restaurant_ids, kind='stable')
+        restaurant_starts = np.flatnonzero(np.diff(pd.factorize(restaurant_ids[order])[0])) + 1
+        cuts = [0]
+        for start in restaurant_starts:
+            if start - cuts[-1] >= row_group_size:
+                cuts.append(start)
+        cuts.append(len(order))
+
+        writer = tokenized_writer(directory + output_filename, output_format)
+        try:
+            for start, end in zip(cuts[:-1], cuts[1:]):
+                positions = order[start:end]
+                writer.write([review_ids[position] for position in positions],
+                             [None if pd.isna(restaurant_ids[position]) else int(restaurant_ids[position]) for position in positions],
+                             [self.tokenized_corpus[review_ids[position]] for position in positions])
+        finally:
+            writer.close()
+
+
+    def save_token_store(self, directory):
+        """ 
+        Saves self.token_store in directory/token_store_<file name>/, to be opened without deserializing by TokenStore.load
+            - arrays are saved as .npy files and memory-mapped by TokenStore.load
+        """
+
+        path = os.path.join(directory, 'token_store_' + os.path.splitext(self.filename)[0])
+        logger.warn(f' > WRITING {path}')
+        with self.instrumentation.stage('save_token_store'):
+            self.token_store.save(path)
+        return path
+
+
+    def save_corpus_tfidf(self, directory):
+        """ Saves the corpus TF-IDF Matrix (vocabulary='corpus') and the rows of each restaurant """
+
+        try:
+            os.mkdir(directory)
+        except OSError:
+            logger.warn("OSError: directory already exists")
+
+        logger.warn(f' > WRITING {directory}corpus_word_freq.npz')
+        with self.instrumentation.stage('save_corpus_tfidf'):
+            self.corpus_tfidf.save(directory + 'corpus_word_freq')
+            with open(directory + 'corpus_word_freq_restaurants.json', 'w') as restaurant_rows:
+                json.dump({restaurant_id: list(rows) for restaurant_id, rows in self.restaurant_rows.items()}, restaurant_rows)
+        if self.instrumentation.enabled:
+            self.instrumentation.count('bytes_written', os.path.getsize(directory + 'corpus_word_freq.npz') +
+                                       os.path.getsize(directory + 'corpus_word_freq_restaurants.json'))
 
 
-    def save_files(self, directory, callable_name, restaurant_ids='all', mask_path=None):
-        """ Saves files (Wordclouds or TF-IDF) for corpora """
+    def save_files(self, directory, callable_name, restaurant_ids='all', mask_path=None, workers=1):
+        """ 
+        Saves files (Wordclouds or TF-IDF) for corpora
+            - with workers > 1, restaurants are exported on a pool of worker processes, the mask is decoded once and sent once per worker
+            - returns dict{int: restaurant_id, str: error message} of the restaurants whose file could not be saved
+        """
         
         logger.warn(f' > SAVING {callable_name.__name__[5:]} FILES ')
 
+        if not isinstance(workers, int) or workers < 1:
+            raise ValueError("workers argument must be strictly positive integer")
+
         try:
             os.mkdir(directory)
         except OSError:
             logger.warn("OSError: directory already exists")
         
-        try:
-            mask = np.array(Image.open(mask_path))
-        except:
-            mask = None
+        mask = None
+        if mask_path is not None:
+            try:
+                mask = load_mask(mask_path)
+            except OSError as error:
+                logger.warn(f' > MASK NOT LOADED ({mask_path}): {error}')
 
         if restaurant_ids == 'all':
-            for restaurant_id, df in self.df_word_frequency.items():
-                callable_name(df, restaurant_id, directory, mask)
+            restaurant_ids = list(self.word_frequency)
         else:
-            for restaurant_id in list(restaurant_ids):
-                df = self.df_word_frequency[restaurant_id]
-                callable_name(df, restaurant_id, directory, mask)
\ No newline at end of file
+            restaurant_ids = list(restaurant_ids)
+        tfidfs = [self.word_frequency[restaurant_id] for restaurant_id in restaurant_ids]
+
+        # Files may be overwritten, so bytes written are only an estimate (growth of the directory)
+        instrumentation = self.instrumentation
+        directory_size = directory_bytes(directory) if instrumentation.enabled else 0
+
+        with instrumentation.stage(f'export:{callable_name.__name__}'):
+            if workers == 1:
+                results = [export_restaurant(callable_name, tfidf, restaurant_id, directory, mask)
+                           for restaurant_id, tfidf in zip(restaurant_ids, tfidfs)]
+            else:
+                with ProcessPoolExecutor(max_workers=workers, initializer=_init_export_worker,
+                                         initargs=(callable_name, directory, mask)) as executor:
+                    results = list(executor.map(_export_restaurant, restaurant_ids, tfidfs))
+
+        failures = {restaurant_id: error for restaurant_id, error in results if error is not None}
+        if instrumentation.enabled:
+            instrumentation.count('bytes_written', max(0, directory_bytes(directory) - directory_size))
+            instrumentation.count('failed_exports', len(failures))
+        for restaurant_id, error in failures.items():
+            logger.warn(f' > FAILED TO SAVE RESTAURANT ({restaurant_id}): {error}')
+        return failures
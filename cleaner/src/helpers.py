@@ -1,8 +1,16 @@
 
+import os
 import nltk
 import json
+import numpy as np
+import pandas as pd
+import re
+import functools
 
+from nltk.tag import PerceptronTagger
 from wordcloud import WordCloud
+from PIL import Image
+from storage import write_tfidf_parquet
 from collections import Counter
 
 import logging
@@ -11,11 +19,18 @@ from logzero import logger
 
 logzero.loglevel(logging.WARNING)
 
+WITH_ACCENT = ['é', 'è', 'à', "ê", "\u2019"]
+WITHOUT_ACCENT = ['e', 'e', 'a', "e", "'"]
+ACCENT_TABLE = str.maketrans({before:after for before, after in zip(WITH_ACCENT, WITHOUT_ACCENT)})
+
+CHARACTERS_TO_REMOVE = ["@", "/", "#", ".", ",", "!", "?", 
+                        "(", ")", "-", "_","’","'", "\"", 
+                        ":", "\n", "\t", "\r"]
+REMOVE_TABLE = str.maketrans({initial: " " for initial in CHARACTERS_TO_REMOVE})
+
+
 def character_transformer(document):
-    with_accent = ['é', 'è', 'à', "ê", "\u2019"]
-    without_accent = ['e', 'e', 'a', "e", "'"]
-    transformation_dict = {before:after for before, after in zip(with_accent, without_accent)}
-    return document.translate(str.maketrans(transformation_dict))
+    return document.translate(ACCENT_TABLE)
 
 
 def unicode_remover(document):
@@ -24,24 +39,91 @@ def unicode_remover(document):
 
 
 def character_remover(document):
-    characters_to_remove = ["@", "/", "#", ".", ",", "!", "?", 
-                            "(", ")", "-", "_","’","'", "\"", 
-                            ":", "\n", "\t", "\r"]
-    transformation_dict = {initial: " " for initial in characters_to_remove}
-    return document.translate(str.maketrans(transformation_dict))
+    return document.translate(REMOVE_TABLE)
 
 
-def contraction_transformer(document, filename):
-    with open(filename) as contractions:
-        for word in document.split():
-            if word in contractions:
-                document = document.replace(word, contractions[word])
-    return document
+class CharacterTable(dict):
+    """ 
+    Translate table equivalent to character_transformer, unicode_remover and character_remover applied in a row 
+        - filled lazily: the mapping of a character is computed on first lookup and cached
+    """
+
+    def __missing__(self, ordinal):
+        character = character_remover(unicode_remover(character_transformer(chr(ordinal))))
+        self[ordinal] = character
+        return character
+
+
+class ContractionExpander():
+    """ Expands contracted words (e.g. "don't" -> "do not") in a single regex pass over the document """
+
+    def __init__(self, contractions):
+        self.contractions = {contraction.lower(): expansion for contraction, expansion in contractions.items()}
+
+        # Longest contractions first so "can't've" is not matched as "can't", straight and curly apostrophes accepted
+        alternatives = sorted(self.contractions, key=len, reverse=True)
+        alternatives = [re.escape(contraction).replace("'", "['\u2019]") for contraction in alternatives]
+        self.pattern = re.compile("(?<![\\w'\u2019])(" + "|".join(alternatives) + ")(?![\\w'\u2019])")
+
+    def replace(self, match):
+        return self.contractions[match.group(0).replace("\u2019", "'")]
 
+    def expand(self, document):
+        if "'" not in document and "\u2019" not in document:
+            return document
+        return self.pattern.sub(self.replace, document)
 
-def lemmatize(tokenized_document, stop_words, tag_dict):
-    lemmatizer = nltk.WordNetLemmatizer()
-    tokens_with_tags = nltk.pos_tag(tokenized_document)
+
+@functools.lru_cache(maxsize=None)
+def load_contractions(filename):
+    """ Loads the contractions mapping once per file and compiles it into a ContractionExpander """
+
+    with open(filename) as contractions_file:
+        return ContractionExpander(json.load(contractions_file))
+
+
+def contraction_transformer(document, filename):
+    return load_contractions(filename).expand(document)
+
+
+class TextNormalizer():
+    """ Lower cases, expands contractions, then folds accents, unicode characters and punctuation in one translate pass """
+
+    def __init__(self, contraction_expander):
+        self.contraction_expander = contraction_expander
+        self.table = CharacterTable()
+        for ordinal in list(range(128)) + [ord(character) for character in WITH_ACCENT]:
+            self.table[ordinal]
+
+    def normalize(self, document):
+        return self.contraction_expander.expand(document.lower()).translate(self.table)
+
+    def normalize_batch(self, documents, instrumentation=None):
+        """ 
+        Normalizes a list or a pandas Series of documents (a Series keeps its index)
+            - with an enabled instrumentation, contraction expansion and character folding run as two timed passes
+        """
+
+        expand, table = self.contraction_expander.expand, self.table
+        if instrumentation is not None and instrumentation.enabled:
+            with instrumentation.stage('contraction_expansion'):
+                expanded = [expand(document.lower()) for document in documents]
+            with instrumentation.stage('character_folding'):
+                normalized = [document.translate(table) for document in expanded]
+        else:
+            normalized = [expand(document.lower()).translate(table) for document in documents]
+        if isinstance(documents, pd.Series):
+            return pd.Series(normalized, index=documents.index, name=documents.name)
+        return normalized
+
+
+def lemmatize(tokenized_document, stop_words, tag_dict, lemmatizer=None, tagger=None):
+    if lemmatizer is None:
+        lemmatizer = nltk.WordNetLemmatizer()
+    if tagger is None:
+        tokens_with_tags = nltk.pos_tag(tokenized_document)
+    else:
+        tokens_with_tags = tagger.tag(tokenized_document)
     lemmatized = []
     for token, tag in tokens_with_tags:
         if token not in stop_words:
@@ -50,12 +132,64 @@ def lemmatize(tokenized_document, stop_words, tag_dict):
     return lemmatized
 
 
-def save_wordcloud(df, idx, directory, mask):
+class Lemmatizer():
+    """ 
+    POS tags documents in batches and lemmatizes their tokens, skipping stop words
+        - lemmas are memoized per (token, wordnet tag) in a bounded LRU cache shared by every document of the run
+    """
+
+    def __init__(self, stop_words, tag_dict, cache_size=100000):
+        self.stop_words = frozenset(stop_words)
+        self.tag_dict = tag_dict
+        self.tagger = PerceptronTagger()
+        self.wordnet_lemmatizer = nltk.WordNetLemmatizer()
+        self.lemma = functools.lru_cache(maxsize=cache_size)(self.wordnet_lemmatizer.lemmatize)
+
+    def lemmatize(self, tokenized_document):
+        return self.lemmatize_batch([tokenized_document])[0]
+
+    def lemmatize_batch(self, tokenized_documents):
+        return self.lemmatize_tagged(self.tag_batch(tokenized_documents))
+
+    def tag_batch(self, tokenized_documents):
+        """ POS tags a list of tokenized documents """
+        return self.tagger.tag_sents(tokenized_documents)
+
+    def lemmatize_tagged(self, tagged_documents):
+        """ Lemmatizes POS tagged documents (outputs of tag_batch), skipping stop words """
+
+        stop_words, tag_dict, lemma = self.stop_words, self.tag_dict, self.lemma
+        lemmatized_documents = []
+        for tokens_with_tags in tagged_documents:
+            lemmatized_documents.append([lemma(token, tag_dict.get(tag[0], "n"))
+                                         for token, tag in tokens_with_tags if token not in stop_words])
+        return lemmatized_documents
+
+    def cache_stats(self):
+        """ Returns hits, misses, hit rate and size of the lemma cache """
+
+        info = self.lemma.cache_info()
+        return cache_stats_dict(info.hits, info.misses, info.currsize, info.maxsize)
+
+
+def cache_stats_dict(hits, misses, size, max_size):
+    lookups = hits + misses
+    return {'hits': hits, 'misses': misses, 'hit_rate': hits / lookups if lookups else 0.0,
+            'size': size, 'max_size': max_size}
+
+
+@functools.lru_cache(maxsize=None)
+def load_mask(mask_path):
+    """ Decodes the word cloud mask image once per path """
+
+    return np.array(Image.open(mask_path))
+
+
+def save_wordcloud(tfidf, idx, directory, mask):
     filename = directory + str(idx) + "_word_cloud.png"
     logger.warn(f' > WRITING {filename}')
 
-    df_mean = df.mean().sort_values(ascending=False).to_frame(name='tfidf mean')
-    dict_words_tfidf = df_mean[df_mean['tfidf mean'] != 0].to_dict()['tfidf mean']
+    dict_words_tfidf = tfidf.term_means()
 
     wordcloud = WordCloud(height=600, width=800, background_color="white",
         colormap='Blues', max_words=100, mask=mask,
@@ -64,8 +198,24 @@ def save_wordcloud(df, idx, directory, mask):
     wordcloud.to_file(filename)     
 
 
-def save_tfidf(df, restaurant_id, directory, mask):
+def save_tfidf(tfidf, restaurant_id, directory, mask):
+    filename = directory + str(restaurant_id) + "_word_freq"
+    logger.warn(f' > WRITING {filename}.npz')
+
+    tfidf.save(filename)
+
+
+def save_tfidf_parquet(tfidf, restaurant_id, directory, mask):
+    partition_directory = directory + "restaurant_id=" + str(restaurant_id) + "/"
+    filename = partition_directory + "part-0.parquet"
+    logger.warn(f' > WRITING {filename}')
+
+    os.makedirs(partition_directory, exist_ok=True)
+    write_tfidf_parquet(tfidf, filename)
+
+
+def save_tfidf_csv(tfidf, restaurant_id, directory, mask):
     filename = directory + str(restaurant_id) + "_word_freq.csv"
     logger.warn(f' > WRITING {filename}')
 
-    df.to_csv(filename, index_label='review_id')
\ No newline at end of file
+    tfidf.to_dataframe().to_csv(filename, index_label='review_id')
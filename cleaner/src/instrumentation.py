@@ -0,0 +1,107 @@
+import os
+import json
+import time
+import cProfile
+import pstats
+import io
+from collections import defaultdict
+from contextlib import nullcontext
+
+from logzero import logger
+
+
+class StageTimer():
+    """ Context manager adding its wall time to one stage of an Instrumentation """
+
+    def __init__(self, instrumentation, name):
+        self.instrumentation = instrumentation
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.instrumentation.seconds[self.name] += time.perf_counter() - self.start
+        self.instrumentation.calls[self.name] += 1
+        return False
+
+
+class Instrumentation():
+    """
+    Cumulative wall time and number of calls per stage, and counters (documents, tokens, restaurants, bytes written...)
+        - stages are timed per batch, never per token
+        - when disabled, stage() returns a shared no-op context manager and count() returns at once
+        - summaries of worker processes are added with add()
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.seconds = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.counters = defaultdict(int)
+        self.null_stage = nullcontext()
+
+    def stage(self, name):
+        if not self.enabled:
+            return self.null_stage
+        return StageTimer(self, name)
+
+    def count(self, name, value=1):
+        if self.enabled:
+            self.counters[name] += value
+
+    def add(self, summary):
+        """ Adds the summary of another Instrumentation (e.g. of a worker process) """
+
+        for name, stage in summary['stages'].items():
+            self.seconds[name] += stage['seconds']
+            self.calls[name] += stage['calls']
+        for name, value in summary['counters'].items():
+            self.counters[name] += value
+
+    def summary(self):
+        return {'stages': {name: {'seconds': round(self.seconds[name], 6), 'calls': self.calls[name]}
+                           for name in sorted(self.seconds, key=self.seconds.get, reverse=True)},
+                'counters': dict(self.counters)}
+
+    def save(self, path):
+        with open(path, 'w') as summary_file:
+            json.dump(self.summary(), summary_file, indent=2)
+
+
+def directory_bytes(directory):
+    """ Total size of the files of a directory and its sub-directories """
+
+    total = 0
+    for entry in os.scandir(directory):
+        if entry.is_dir(follow_symlinks=False):
+            total += directory_bytes(entry.path)
+        elif entry.is_file(follow_symlinks=False):
+            total += entry.stat().st_size
+    return total
+
+
+class Profile():
+    """ Optional cProfile hook : profiles the block if path is set, dumps the stats to path and logs the top functions """
+
+    def __init__(self, path=None, top=20):
+        self.path = path
+        self.top = top
+        self.profiler = None
+
+    def __enter__(self):
+        if self.path is not None:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.profiler.dump_stats(self.path)
+            stream = io.StringIO()
+            pstats.Stats(self.profiler, stream=stream).sort_stats('cumulative').print_stats(self.top)
+            logger.warn(f' > PROFILE SAVED TO {self.path}\n{stream.getvalue()}')
+            self.profiler = None
+        return False
@@ -1,6 +1,9 @@
+import sys
 import argparse
+from logzero import logger
 from cleaner import Cleaner
-from helpers import save_wordcloud, save_tfidf
+from helpers import save_wordcloud, save_tfidf, save_tfidf_parquet
+from storage import OUTPUT_FORMATS
 
 if __name__ == "__main__":
 
@@ -8,19 +11,77 @@ if __name__ == "__main__":
     parser.add_argument('-f', '--files', nargs="*", type=str, help='path to the files to be cleaned')
     parser.add_argument('-d', '--debug', help="prints intermediary logs", action="store_true")
     parser.add_argument('-s', '--early_stop', type=int, default=-1, help='Caps the number of reviews to be processed')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='Number of processes used to clean and tokenize reviews, and to save files')
+    parser.add_argument('-c', '--chunk_size', type=int, default=-1, help='Streams the files by chunks of chunk_size reviews')
+    parser.add_argument('-v', '--vocabulary', type=str, default='restaurant', choices=['restaurant', 'corpus'],
+                        help='Fits the TF-IDF vocabulary per restaurant or once over all reviews')
+    parser.add_argument('-o', '--output_format', type=str, default='json', choices=OUTPUT_FORMATS,
+                        help='Format of the tokenized reviews and TF-IDF files (parquet: columnar, partitioned by restaurant)')
+    parser.add_argument('--cache_directory', type=str, default=None,
+                        help='Directory of the persistent token cache, only new or changed reviews are cleaned again')
+    # N-gram options default to None so that they can be told apart from unset ones in streaming mode
+    parser.add_argument('-n', '--ngram', type=int, default=None, help='Counts the 1 to ngram-grams of the corpus and of each restaurant (default: 2)')
+    parser.add_argument('--ngram_min_count', type=int, default=None,
+                        help='Drops the n-grams seen less than ngram_min_count times in the corpus (default: 2)')
+    parser.add_argument('--ngram_top_k', type=int, default=None, help='Keeps only the ngram_top_k most frequent n-grams of each order')
+    parser.add_argument('--ngram_max_distinct', type=int, default=None,
+                        help='Bounds the memory of n-gram counting to ngram_max_distinct n-grams per order (rare n-grams may be missing)')
+    parser.add_argument('--instrument', action="store_true", help='Times each preprocessing stage and counts documents, tokens and bytes written')
+    parser.add_argument('--summary', type=str, default='./cleaned_data/instrumentation.json',
+                        help='Path of the JSON summary of the stage timings and counters (with --instrument)')
+    parser.add_argument('--profile', type=str, default=None, help='Profiles preprocessing with cProfile and saves the stats to this path')
     args = parser.parse_args()
 
+    ngram_options = [args.ngram, args.ngram_min_count, args.ngram_top_k, args.ngram_max_distinct]
+    if args.chunk_size != -1 and any(option is not None for option in ngram_options):
+        parser.error('n-grams are not counted in streaming mode, -n/--ngram, --ngram_min_count, --ngram_top_k and '
+                     '--ngram_max_distinct cannot be used with -c/--chunk_size')
+    if args.ngram is None:
+        args.ngram = 2
+    if args.ngram_min_count is None:
+        args.ngram_min_count = 2
+
     filenames = args.files
 
     if args.early_stop == -1:
         args.early_stop = None
 
-    cleaner = Cleaner(debug=args.debug, early_stop=args.early_stop)
+    cleaner = Cleaner(debug=args.debug, early_stop=args.early_stop, cache_directory=args.cache_directory,
+                      instrument=args.instrument, profile_path=args.profile)
+
+    # Export failures of each file and kind of file, logs are disabled without --debug so they are printed at the end
+    failures = {}
 
     for file in filenames:
-        cleaner.set_file(file)
-        cleaner.preprocessing(ngram=2)
+        if args.chunk_size == -1:
+            cleaner.set_file(file)
+            cleaner.preprocessing(ngram=args.ngram, workers=args.workers, vocabulary=args.vocabulary)
+            cleaner.save_tokenized_corpus('./cleaned_data/', output_format=args.output_format)
+            cleaner.save_token_store('./cleaned_data/')
+            cleaner.compute_ngrams(args.ngram, min_count=args.ngram_min_count, top_k=args.ngram_top_k, max_distinct=args.ngram_max_distinct)
+            cleaner.save_ngram_counts('./cleaned_data/restaurant_ngrams/')
+        else:
+            cleaner.stream_file(file, './cleaned_data/', chunk_size=args.chunk_size, vocabulary=args.vocabulary,
+                                output_format=args.output_format)
+
+        failures[(file, 'wordcloud')] = cleaner.save_files('./cleaned_data/restaurant_wordclouds/', save_wordcloud,
+                                                           mask_path='assets/capgemini.jpg', workers=args.workers)
+        if args.output_format == 'parquet':
+            failures[(file, 'tfidf_parquet')] = cleaner.save_files('./cleaned_data/restaurant_tfidf_parquet/', save_tfidf_parquet,
+                                                                   workers=args.workers)
+        elif args.vocabulary == 'corpus':
+            cleaner.save_corpus_tfidf('./cleaned_data/restaurant_word_frequencies/')
+        else:
+            failures[(file, 'tfidf')] = cleaner.save_files('./cleaned_data/restaurant_word_frequencies/', save_tfidf, workers=args.workers)
+
+    if args.instrument:
+        cleaner.instrumentation.save(args.summary)
+        logger.warn(f' > INSTRUMENTATION SUMMARY SAVED TO {args.summary}')
 
-        cleaner.save_tokenized_corpus('./cleaned_data/')
-        cleaner.save_files('./cleaned_data/restaurant_wordclouds/', save_wordcloud, mask_path='assets/capgemini.jpg')
-        cleaner.save_files('./cleaned_data/restaurant_word_frequencies/', save_tfidf)
\ No newline at end of file
+    failures = {key: file_failures for key, file_failures in failures.items() if file_failures}
+    if failures:
+        for (file, kind), file_failures in failures.items():
+            print(f'{len(file_failures)} {kind} files of {file} could not be saved:', file=sys.stderr)
+            for restaurant_id, error in sorted(file_failures.items()):
+                print(f'    restaurant {restaurant_id}: {error}', file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,212 @@
+import json
+import numpy as np
+
+from scipy import sparse
+
+
+class NgramCounts():
+    """
+    Counts of the 1..N-grams of a TokenStore, each n-gram being encoded as one int64 (word ids as digits in base vocabulary size):
+        - self.codes: dict{int: n, int64 array: sorted codes of the kept n-grams}
+        - self.counts: dict{int: n, int64 array: count of each kept n-gram over the corpus}
+        - self.group_labels: array of the group (e.g. restaurant_id) of each row of self.group_counts, None without groups
+        - self.group_counts: dict{int: n, scipy csr matrix (rows = groups, columns = kept n-grams)}
+        - self.max_errors: dict{int: n, int: count above which every n-gram is guaranteed to be kept}, 0 when counting was exact
+    """
+
+    def __init__(self, vocabulary, codes, counts, group_labels=None, group_counts=None, max_errors=None):
+        self.vocabulary = vocabulary
+        self.words = np.array(vocabulary, dtype=object)
+        self.codes = codes
+        self.counts = counts
+        self.group_labels = group_labels
+        self.group_counts = group_counts or {}
+        self.max_errors = max_errors or {n: 0 for n in codes}
+
+
+    def phrases(self, n, codes):
+        """ Decodes n-gram codes into phrases (words joined by a space) """
+
+        size = len(self.vocabulary)
+        ids = np.empty((len(codes), n), dtype=np.int64)
+        rest = np.asarray(codes, dtype=np.int64)
+        for position in range(n - 1, -1, -1):
+            rest, ids[:, position] = np.divmod(rest, size)
+        return [' '.join(words) for words in self.words[ids].tolist()]
+
+
+    def most_common(self, n, k=None):
+        """ Returns the k most frequent n-grams as a list of (phrase, count), all kept n-grams if k is None """
+
+        order = np.argsort(-self.counts[n], kind='stable')[:k]
+        return list(zip(self.phrases(n, self.codes[n][order]), self.counts[n][order].tolist()))
+
+
+    def frequencies(self, n, k=None):
+        """ Returns dict{str: phrase, int: count} of the k most frequent n-grams """
+
+        return dict(self.most_common(n, k))
+
+
+    def group_frequencies(self, group, n, k=None):
+        """ Returns dict{str: phrase, int: count} of the k most frequent n-grams of one group (e.g. a restaurant) """
+
+        if self.group_labels is None:
+            raise KeyError(group)
+        row = np.searchsorted(self.group_labels, group)
+        if row >= len(self.group_labels) or self.group_labels[row] != group:
+            raise KeyError(group)
+        matrix = self.group_counts[n]
+        start, end = matrix.indptr[row], matrix.indptr[row + 1]
+        columns, counts = matrix.indices[start:end], matrix.data[start:end]
+        order = np.argsort(-counts, kind='stable')[:k]
+        return dict(zip(self.phrases(n, self.codes[n][columns[order]]), counts[order].tolist()))
+
+
+    def save(self, filename, k=None):
+        """
+        Saves the k most frequent n-grams of each order:
+            - filename + '.json': {n: {phrase: count}}
+            - filename + '_by_group.json': {group: {n: {phrase: count}}}, with groups
+        """
+
+        with open(filename + '.json', 'w') as ngrams_file:
+            json.dump({n: self.frequencies(n, k) for n in self.codes}, ngrams_file)
+        if self.group_labels is not None:
+            with open(filename + '_by_group.json', 'w') as ngrams_file:
+                json.dump({int(group): {n: self.group_frequencies(group, n, k) for n in self.codes} for group in self.group_labels},
+                          ngrams_file)
+
+
+def chunk_codes(token_store, start_row, end_row, max_n):
+    """
+    Yields (n, codes, valid) for n in 1..max_n over the reviews start_row:end_row of a token store
+        - codes[i] encodes the n words starting at the i-th token of the chunk
+        - valid[i] is False when these n words cross the end of a review
+    """
+
+    offsets = token_store.offsets[start_row:end_row + 1]
+    tokens = np.asarray(token_store.token_ids[offsets[0]:offsets[-1]], dtype=np.int64)
+    remaining = np.repeat(offsets[1:], np.diff(offsets)) - np.arange(offsets[0], offsets[-1])
+    size = len(token_store.vocabulary)
+
+    codes = tokens
+    for n in range(1, max_n + 1):
+        if n > 1:
+            codes = codes[:-1] * size + tokens[n - 1:]
+        yield n, codes, remaining[:len(codes)] >= n
+
+
+def merge_counts(codes, counts, new_codes, new_counts):
+    """ Adds the counts of (new_codes, new_counts) to the sorted (codes, counts) """
+
+    merged, inverse = np.unique(np.concatenate([codes, new_codes]), return_inverse=True)
+    return merged, np.bincount(inverse, weights=np.concatenate([counts, new_counts]), minlength=len(merged)).astype(np.int64)
+
+
+def decrement(codes, counts, max_distinct):
+    """
+    Misra-Gries step keeping at most max_distinct n-grams: subtracts the count of the (max_distinct + 1)-th most frequent one
+    from all counts and drops the n-grams left at 0, returns the codes, counts and subtracted count
+        - the subtracted counts sum to at most (number of n-grams) / (max_distinct + 1), so any n-gram seen more often is never dropped
+    """
+
+    if len(codes) <= max_distinct:
+        return codes, counts, 0
+    threshold = np.partition(counts, len(counts) - max_distinct - 1)[len(counts) - max_distinct - 1]
+    keep = counts > threshold
+    return codes[keep], counts[keep] - threshold, int(threshold)
+
+
+def lookup(codes, chunk):
+    """ Column of each code of chunk in the sorted codes, and whether it is there """
+
+    columns = np.minimum(np.searchsorted(codes, chunk), len(codes) - 1)
+    return columns, codes[columns] == chunk
+
+
+def prune(codes, counts, min_count=1, top_k=None):
+    """ Keeps the n-grams seen at least min_count times, then the top_k most frequent ones (codes stay sorted) """
+
+    keep = counts >= min_count
+    codes, counts = codes[keep], counts[keep]
+    if top_k is not None and len(codes) > top_k:
+        kept = np.sort(np.argsort(-counts, kind='stable')[:top_k])
+        codes, counts = codes[kept], counts[kept]
+    return codes, counts
+
+
+def count_ngrams(token_store, max_n=2, min_n=1, min_count=1, top_k=None, groups=None, chunk_size=100000, max_distinct=None):
+    """
+    Counts the min_n..max_n-grams of all reviews of a token store in vectorized passes over its token id arrays
+        - n-grams never cross two reviews, and are encoded exactly as int64 (the vocabulary size to the power max_n must fit)
+        - reviews are processed by chunks of chunk_size; without max_distinct, the merged counts hold every distinct n-gram
+          of the corpus, so memory grows with the corpus (about 16 bytes per distinct n-gram and order)
+        - max_distinct: at most max_distinct n-grams per order are kept between chunks (Misra-Gries, see decrement), memory is then
+          bounded by the chunk and max_distinct; the kept n-grams are counted exactly in a second pass, but an n-gram seen at most
+          max_errors[n] times in the corpus (at most (number of n-grams) / (max_distinct + 1)) may be missing
+        - n-grams seen less than min_count times are dropped, then only the top_k most frequent are kept (per order)
+        - groups: optional group label (e.g. restaurant_id) of each row of the store, negative labels are not grouped;
+          the kept n-grams are then also counted per group in a second pass
+
+    Raises:
+        ValueError: if max_n is too large for the vocabulary size
+    """
+
+    if not isinstance(max_n, int) or not isinstance(min_n, int) or min_n < 1 or max_n < min_n:
+        raise ValueError("min_n and max_n arguments must be integers with 1 <= min_n <= max_n")
+    if len(token_store.vocabulary) ** max_n >= 2 ** 63:
+        raise ValueError(f"max_n argument too large for a vocabulary of {len(token_store.vocabulary)} words")
+    if max_distinct is not None and (not isinstance(max_distinct, int) or max_distinct < 1):
+        raise ValueError("max_distinct argument must be strictly positive integer")
+
+    nb_rows = len(token_store)
+    chunks = [(start, min(start + chunk_size, nb_rows)) for start in range(0, nb_rows, chunk_size)]
+    orders = range(min_n, max_n + 1)
+    codes = {n: np.empty(0, dtype=np.int64) for n in orders}
+    counts = {n: np.empty(0, dtype=np.int64) for n in orders}
+    max_errors = {n: 0 for n in orders}
+
+    for start, end in chunks:
+        for n, chunk, valid in chunk_codes(token_store, start, end, max_n):
+            if n >= min_n:
+                chunk_unique, chunk_counts = np.unique(chunk[valid], return_counts=True)
+                codes[n], counts[n] = merge_counts(codes[n], counts[n], chunk_unique, chunk_counts)
+                if max_distinct is not None:
+                    codes[n], counts[n], subtracted = decrement(codes[n], counts[n], max_distinct)
+                    max_errors[n] += subtracted
+
+    # Counts of the n-grams kept by decrement are lower bounds : they are counted again exactly
+    if max_distinct is not None:
+        counts = {n: np.zeros(len(codes[n]), dtype=np.int64) for n in orders}
+        for start, end in chunks:
+            for n, chunk, valid in chunk_codes(token_store, start, end, max_n):
+                if n < min_n or len(codes[n]) == 0:
+                    continue
+                columns, found = lookup(codes[n], chunk)
+                counts[n] += np.bincount(columns[valid & found], minlength=len(codes[n]))
+
+    for n in orders:
+        codes[n], counts[n] = prune(codes[n], counts[n], min_count, top_k)
+
+    if groups is None:
+        return NgramCounts(token_store.vocabulary, codes, counts, max_errors=max_errors)
+
+    groups = np.asarray(groups, dtype=np.int64)
+    group_labels, group_rows = np.unique(groups[groups >= 0], return_inverse=True)
+    row_groups = np.full(nb_rows, -1, dtype=np.int64)
+    row_groups[groups >= 0] = group_rows
+    group_counts = {n: sparse.csr_matrix((len(group_labels), len(codes[n])), dtype=np.int64) for n in orders}
+
+    for start, end in chunks:
+        offsets = token_store.offsets[start:end + 1]
+        token_groups = np.repeat(row_groups[start:end], np.diff(offsets))
+        for n, chunk, valid in chunk_codes(token_store, start, end, max_n):
+            if n < min_n or len(codes[n]) == 0:
+                continue
+            columns, found = lookup(codes[n], chunk)
+            hit = valid & found & (token_groups[:len(chunk)] >= 0)
+            group_counts[n] = group_counts[n] + sparse.csr_matrix(
+                (np.ones(hit.sum(), dtype=np.int64), (token_groups[:len(chunk)][hit], columns[hit])), shape=group_counts[n].shape)
+
+    return NgramCounts(token_store.vocabulary, codes, counts, group_labels, group_counts, max_errors)
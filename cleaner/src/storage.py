@@ -0,0 +1,103 @@
+import os
+import json
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+
+OUTPUT_FORMATS = ['json', 'parquet']
+
+TOKENIZED_SCHEMA = None if pa is None else pa.schema([
+    ('review_id', pa.int64()),
+    ('restaurant_id', pa.int64()),
+    ('tokens', pa.list_(pa.string())),
+])
+
+
+def check_pyarrow():
+    if pa is None:
+        raise ImportError("pyarrow is required for the parquet output format")
+
+
+def tokenized_filename(filename, output_format):
+    """ Name of the tokenized output of a reviews file, e.g. tokenized_reviews_1.json or tokenized_reviews_1.parquet """
+
+    if output_format == 'json':
+        return 'tokenized_' + filename
+    return 'tokenized_' + os.path.splitext(filename)[0] + '.parquet'
+
+
+class TokenizedJsonWriter():
+    """ Writes tokenized reviews one by one as a single json object {review_id: tokens} """
+
+    def __init__(self, path):
+        self.file = open(path, 'w')
+        self.file.write('{')
+        self.separator = ''
+
+    def write(self, review_ids, restaurant_ids, tokenized_reviews):
+        for review_id, tokenized_review in zip(review_ids, tokenized_reviews):
+            self.file.write(f'{self.separator}{json.dumps(str(review_id))}: {json.dumps(tokenized_review)}')
+            self.separator = ', '
+
+    def close(self):
+        self.file.write('}')
+        self.file.close()
+
+
+class TokenizedParquetWriter():
+    """ Writes tokenized reviews as parquet rows (review_id, restaurant_id, tokens: list<string>), one row group per write """
+
+    def __init__(self, path):
+        check_pyarrow()
+        self.writer = pq.ParquetWriter(path, TOKENIZED_SCHEMA)
+
+    def write(self, review_ids, restaurant_ids, tokenized_reviews):
+        table = pa.table({'review_id': review_ids, 'restaurant_id': restaurant_ids, 'tokens': tokenized_reviews},
+                         schema=TOKENIZED_SCHEMA)
+        self.writer.write_table(table)
+
+    def close(self):
+        self.writer.close()
+
+
+def tokenized_writer(path, output_format):
+    if output_format == 'json':
+        return TokenizedJsonWriter(path)
+    if output_format == 'parquet':
+        return TokenizedParquetWriter(path)
+    raise ValueError(f"output_format argument must be one of {OUTPUT_FORMATS}")
+
+
+def tfidf_table(tfidf):
+    """ Long format table (review_id, term, weight) of the non-zeros of a SparseTfidf """
+
+    check_pyarrow()
+    coo = tfidf.matrix.tocoo()
+    review_ids = np.asarray(tfidf.review_ids, dtype=np.int64)
+    terms = pa.DictionaryArray.from_arrays(pa.array(coo.col, type=pa.int32()), pa.array(tfidf.vocabulary, type=pa.string()))
+    return pa.table({'review_id': review_ids[coo.row], 'term': terms, 'weight': coo.data})
+
+
+def write_tfidf_parquet(tfidf, path):
+    pq.write_table(tfidf_table(tfidf), path)
+
+
+def read_tokenized_parquet(path, restaurant_ids=None, columns=None):
+    """ Memory maps a tokenized parquet file, only the row groups of restaurant_ids (if given) are read """
+
+    check_pyarrow()
+    filters = None if restaurant_ids is None else [('restaurant_id', 'in', list(restaurant_ids))]
+    return pq.read_table(path, columns=columns, filters=filters, memory_map=True)
+
+
+def read_tfidf_parquet(directory, restaurant_ids=None, columns=None):
+    """ Memory maps the TF-IDF parquet dataset (partitioned by restaurant_id), only the partitions of restaurant_ids (if given) are read """
+
+    check_pyarrow()
+    filters = None if restaurant_ids is None else [('restaurant_id', 'in', list(restaurant_ids))]
+    return pq.read_table(directory, columns=columns, filters=filters, memory_map=True, partitioning='hive')
@@ -0,0 +1,120 @@
+import json
+import numpy as np
+import pandas as pd
+from collections import Counter
+
+from logzero import logger
+
+
+RATINGS = ['1', '2', '3', '4', '5']
+MONTHS = ['January', 'February', 'March', 'April', 'May', 'June', 'July', 'August', 'September', 'October', 'November', 'December']
+SYLLABLES = ['ba', 'ce', 'di', 'fo', 'gu', 'la', 'me', 'ni', 'po', 'ru', 'sa', 'te', 'vi', 'zo', 'qua', 'ren', 'tal', 'mon']
+
+
+class ReviewGenerator():
+    """
+    Generates reviews with the schema of the scraped reviews files, following the distributions of a sample reviews file
+        - comment lengths (in words) and title lengths follow a log-normal fitted on the sample
+        - words are drawn from the sample vocabulary with their frequencies (contractions, accents and punctuation included),
+          plus a Zipf tail of tail_size made-up words so that the vocabulary keeps growing with the corpus
+        - ratings follow the sample, restaurants get a log-normal number of reviews capped at max_reviews_per_restaurant
+        - the output only depends on seed
+    """
+
+    def __init__(self, sample_filepath, seed=0, tail_size=50000, tail_mass=0.03, max_reviews_per_restaurant=500):
+
+        sample = pd.read_json(sample_filepath, lines=True)
+        self.seed = seed
+
+        counts = Counter(word for comment in sample['comment'] for word in comment.split())
+        words, frequencies = zip(*counts.most_common())
+        tail_words = [self.made_up_word(rank) for rank in range(tail_size)]
+        tail_frequencies = 1 / np.arange(len(words) + 1, len(words) + tail_size + 1)
+        self.vocabulary = np.array(list(words) + tail_words, dtype=object)
+        self.probabilities = np.concatenate([np.array(frequencies) / sum(frequencies) * (1 - tail_mass),
+                                             tail_frequencies / tail_frequencies.sum() * tail_mass])
+
+        title_counts = Counter(word for title in sample['title'] for word in str(title).split())
+        title_words, title_frequencies = zip(*title_counts.most_common())
+        self.title_vocabulary = np.array(title_words, dtype=object)
+        self.title_probabilities = np.array(title_frequencies) / sum(title_frequencies)
+
+        self.comment_length = self.log_normal_fit(sample['comment'].str.split().str.len())
+        self.title_length = self.log_normal_fit(sample['title'].astype(str).str.split().str.len())
+        self.min_length = int(sample['comment'].str.split().str.len().min())
+
+        rating_frequencies = sample['rating'].astype(str).value_counts(normalize=True)
+        self.rating_probabilities = np.array([rating_frequencies.get(rating, 0) for rating in RATINGS])
+        self.rating_probabilities /= self.rating_probabilities.sum()
+
+        self.restaurant_size = self.log_normal_fit(sample.groupby('restaurant_id').size())
+        self.max_reviews_per_restaurant = max_reviews_per_restaurant
+
+    @staticmethod
+    def made_up_word(rank):
+        word = ''
+        rank += len(SYLLABLES)
+        while rank:
+            rank, syllable = divmod(rank, len(SYLLABLES))
+            word += SYLLABLES[syllable]
+        return word
+
+    @staticmethod
+    def log_normal_fit(values):
+        """ (mu, sigma) of the log of the values """
+
+        log_values = np.log(np.asarray(values, dtype=float))
+        return log_values.mean(), log_values.std()
+
+    def restaurant_ids(self, rng, nb_reviews):
+        """ Restaurant id of each review, reviews of a restaurant being contiguous as in a crawl """
+
+        restaurant_ids = []
+        restaurant_id = 0
+        while len(restaurant_ids) < nb_reviews:
+            restaurant_id += 1
+            size = int(np.clip(rng.lognormal(*self.restaurant_size), 1, self.max_reviews_per_restaurant))
+            restaurant_ids += [restaurant_id] * size
+        return restaurant_ids[:nb_reviews]
+
+    def reviews(self, nb_reviews, chunk_size=10000):
+        """ Yields DataFrames of at most chunk_size generated reviews """
+
+        rng = np.random.default_rng(self.seed)
+        restaurant_ids = self.restaurant_ids(rng, nb_reviews)
+
+        for start in range(0, nb_reviews, chunk_size):
+            size = min(chunk_size, nb_reviews - start)
+            lengths = np.maximum(self.min_length, rng.lognormal(*self.comment_length, size).astype(int))
+            title_lengths = np.maximum(1, rng.lognormal(*self.title_length, size).astype(int))
+
+            words = rng.choice(self.vocabulary, size=lengths.sum(), p=self.probabilities)
+            title_words = rng.choice(self.title_vocabulary, size=title_lengths.sum(), p=self.title_probabilities)
+            ends = np.cumsum(lengths)
+            title_ends = np.cumsum(title_lengths)
+
+            comments = [' '.join(words[end - length:end]) for end, length in zip(ends, lengths)]
+            titles = [' '.join(title_words[end - length:end]) for end, length in zip(title_ends, title_lengths)]
+            months = rng.integers(0, len(MONTHS), size)
+            years = rng.integers(2015, 2021, size)
+
+            yield pd.DataFrame({
+                'review_id': np.arange(start + 1, start + size + 1),
+                'restaurant_id': restaurant_ids[start:start + size],
+                'username': [f'user_{user}' for user in rng.integers(0, max(1, nb_reviews // 3), size)],
+                'date_of_visit': [f' {MONTHS[month]} {year}' for month, year in zip(months, years)],
+                'rating': rng.choice(RATINGS, size=size, p=self.rating_probabilities),
+                'title': titles,
+                'comment': comments,
+                'date_of_review': [f'{day} {MONTHS[month]} {year}' for day, month, year in zip(rng.integers(1, 29, size), months, years)],
+            })
+
+    def write(self, filepath, nb_reviews, chunk_size=10000):
+        """ Writes nb_reviews generated reviews as a JSON lines file, like the scraper does """
+
+        logger.warn(f' > GENERATING {nb_reviews} REVIEWS INTO {filepath}')
+        with open(filepath, 'w') as reviews_file:
+            for df_chunk in self.reviews(nb_reviews, chunk_size):
+                for review in df_chunk.to_dict(orient='records'):
+                    reviews_file.write(json.dumps({key: value.item() if isinstance(value, np.generic) else value
+                                                   for key, value in review.items()}) + '\n')
@@ -0,0 +1,86 @@
+import re
+import json
+import numpy as np
+import pandas as pd
+
+from functools import lru_cache
+from scipy import sparse
+from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
+
+
+# Default token_pattern of TfidfVectorizer : words of at least 2 characters
+TOKEN_PATTERN = re.compile(r"(?u)\b\w\w+\b")
+
+
+@lru_cache(maxsize=2**20)
+def token_terms(token):
+    """ Terms that TfidfVectorizer(stop_words='english') extracts from one token (lower case, 2 characters or more, no stop words) """
+
+    return tuple(term for term in TOKEN_PATTERN.findall(token.lower()) if term not in ENGLISH_STOP_WORDS)
+
+
+def passthrough_analyzer(tokenized_document):
+    """ 
+    TfidfVectorizer analyzer for documents that are already tokenized (no re-tokenization of the joined document)
+        - features are the same as TfidfVectorizer(stop_words='english') on the tokens joined by spaces, as in restaurant mode
+    """
+
+    return [term for token in tokenized_document for term in token_terms(token)]
+
+
+class SparseTfidf():
+    """ 
+    TF-IDF matrix of the reviews of a restaurant, memory scales with the non-zeros:
+        - self.matrix: scipy csr matrix (rows = reviews, columns = vocabulary)
+        - self.review_ids: list[int], review_id of each row
+        - self.vocabulary: list[str], word of each column
+    """
+
+    def __init__(self, matrix, review_ids, vocabulary):
+        self.matrix = sparse.csr_matrix(matrix)
+        self.review_ids = [int(review_id) for review_id in review_ids]
+        # A list is kept as is, so that row blocks of the same corpus share one vocabulary
+        self.vocabulary = vocabulary if isinstance(vocabulary, list) else [str(word) for word in vocabulary]
+
+
+    def to_dataframe(self):
+        """ Returns the dense DataFrame view (index = review_id, columns = vocabulary) """
+
+        df = pd.DataFrame(data=self.matrix.toarray(), index=self.review_ids, columns=self.vocabulary)
+        df.index.name = 'review_id'
+        return df
+
+
+    def term_means(self):
+        """ Returns the mean TF-IDF of each word over the reviews, sorted in decreasing order, without zeros """
+
+        means = np.asarray(self.matrix.mean(axis=0)).ravel()
+        order = np.argsort(-means, kind='stable')
+        return {self.vocabulary[column]: float(means[column]) for column in order if means[column] != 0}
+
+
+    def save(self, filename):
+        """ Saves the matrix in filename + '.npz' and the review ids and vocabulary in filename + '_vocab.json' """
+
+        sparse.save_npz(filename + '.npz', self.matrix, compressed=True)
+        with open(filename + '_vocab.json', 'w') as vocab_file:
+            json.dump({'review_ids': self.review_ids, 'vocabulary': self.vocabulary}, vocab_file)
+
+
+    @classmethod
+    def load(cls, filename):
+        """ Loads a matrix saved with SparseTfidf.save """
+
+        matrix = sparse.load_npz(filename + '.npz')
+        with open(filename + '_vocab.json') as vocab_file:
+            index = json.load(vocab_file)
+        return cls(matrix, index['review_ids'], index['vocabulary'])
+
+
+def load_tfidf(directory, restaurant_id, as_dataframe=False):
+    """ Loads the TF-IDF matrix of a restaurant saved by save_tfidf, as a SparseTfidf or as the dense DataFrame view """
+
+    tfidf = SparseTfidf.load(directory + str(restaurant_id) + "_word_freq")
+    if as_dataframe:
+        return tfidf.to_dataframe()
+    return tfidf
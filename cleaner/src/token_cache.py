@@ -0,0 +1,112 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+
+from logzero import logger
+
+
+# Bump when the cleaning or tokenizing code changes, so that entries computed by the previous code are invalidated
+CACHE_VERSION = 1
+
+
+def config_hash(stop_words, contractions):
+    """ Hash of the cleaner config the tokens depend on: stop words list and contractions mapping """
+
+    config = {'version': CACHE_VERSION, 'stop_words': sorted(stop_words), 'contractions': contractions}
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class TokenCache():
+    """ 
+    Persistent content-addressed cache of tokenized reviews (SQLite file in directory):
+        - key: hash of the cleaner config + review text, value: tokenized review (before ngrams)
+        - entries of another config (e.g. custom_stop_words.txt or contractions.json changed) are dropped on open
+        - entries are evicted by age (last access), number and total size, by evict() once per run after preprocessing
+    """
+
+    def __init__(self, directory, config, max_entries=1000000, max_bytes=2**30, max_age_days=30):
+
+        try:
+            os.mkdir(directory)
+        except OSError:
+            logger.warn("OSError: directory already exists")
+
+        self.config = config
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age_days = max_age_days
+        self.hits, self.misses = 0, 0
+
+        self.connection = sqlite3.connect(os.path.join(directory, 'token_cache.sqlite'))
+        with self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS tokens '
+                                    '(key TEXT PRIMARY KEY, config TEXT, tokens TEXT, size INTEGER, accessed REAL)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS tokens_accessed ON tokens (accessed)')
+            invalidated = self.connection.execute('DELETE FROM tokens WHERE config != ?', (config,)).rowcount
+        if invalidated:
+            logger.warn(f' > TOKEN CACHE: {invalidated} ENTRIES INVALIDATED BY CONFIG CHANGE')
+
+
+    def key(self, document):
+        return hashlib.sha256((self.config + document).encode('utf-8')).hexdigest()
+
+
+    def get_many(self, keys):
+        """ Returns dict{str: key, list[str]: tokenized review} for the keys found in the cache """
+
+        keys = list(keys)
+        found = {}
+        # SQLite caps the number of bound parameters per statement
+        for start in range(0, len(keys), 900):
+            batch = keys[start:start + 900]
+            rows = self.connection.execute(f'SELECT key, tokens FROM tokens WHERE key IN ({",".join("?" * len(batch))})', batch)
+            found.update((key, json.loads(tokens)) for key, tokens in rows)
+
+        now = time.time()
+        with self.connection:
+            self.connection.executemany('UPDATE tokens SET accessed = ? WHERE key = ?', [(now, key) for key in found])
+
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+
+    def put_many(self, entries):
+        """ Stores a list of (key, tokenized review) """
+
+        now = time.time()
+        rows = []
+        for key, tokens in entries:
+            value = json.dumps(tokens)
+            rows.append((key, self.config, value, len(value), now))
+        with self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO tokens VALUES (?, ?, ?, ?, ?)', rows)
+
+
+    def evict(self):
+        """ Drops entries older than max_age_days, then the least recently used ones above max_entries or max_bytes """
+
+        with self.connection:
+            evicted = self.connection.execute('DELETE FROM tokens WHERE accessed < ?',
+                                              (time.time() - self.max_age_days * 86400,)).rowcount
+            evicted += self.connection.execute('DELETE FROM tokens WHERE key IN '
+                                               '(SELECT key FROM tokens ORDER BY accessed DESC LIMIT -1 OFFSET ?)',
+                                               (self.max_entries,)).rowcount
+            evicted += self.connection.execute('DELETE FROM tokens WHERE key IN '
+                                               '(SELECT key FROM (SELECT key, SUM(size) OVER (ORDER BY accessed DESC, key) AS total FROM tokens) '
+                                               'WHERE total > ?)', (self.max_bytes,)).rowcount
+        if evicted:
+            logger.warn(f' > TOKEN CACHE: {evicted} ENTRIES EVICTED')
+
+
+    def stats(self):
+        """ Returns hits, misses and number of entries of the cache """
+
+        entries, size = self.connection.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM tokens').fetchone()
+        return {'hits': self.hits, 'misses': self.misses, 'entries': entries, 'bytes': size}
+
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,167 @@
+import os
+import json
+import numpy as np
+
+from array import array
+from collections import Counter
+from collections.abc import Mapping
+from scipy import sparse
+
+
+class TokenStoreBuilder():
+    """ Appends tokenized reviews one by one, interning each word once, then builds a TokenStore """
+
+    def __init__(self):
+        self.term_ids = {}
+        self.review_ids = array('q')
+        self.token_ids = array('i')
+        self.offsets = array('q', [0])
+
+    def append(self, review_id, tokens):
+        term_ids = self.term_ids
+        self.review_ids.append(int(review_id))
+        self.token_ids.extend([term_ids.setdefault(token, len(term_ids)) for token in tokens])
+        self.offsets.append(len(self.token_ids))
+
+    def __len__(self):
+        return len(self.review_ids)
+
+    def build(self):
+        return TokenStore(list(self.term_ids), np.array(self.review_ids, dtype=np.int64),
+                          np.array(self.token_ids, dtype=np.int32), np.array(self.offsets, dtype=np.int64))
+
+
+class TokenStore():
+    """
+    Tokenized reviews as integer arrays, memory scales with the number of tokens instead of Python objects:
+        - self.vocabulary: list[str], word of each term id
+        - self.review_ids: int64 array, review_id of each row
+        - self.token_ids: int32 array, term ids of all reviews one after the other
+        - self.offsets: int64 array of size nb_reviews + 1, tokens of row i are token_ids[offsets[i]:offsets[i + 1]] (CSR-style)
+        - self.counts: scipy csr matrix (rows = reviews, columns = term ids) of word counts, built on first access
+        - tokens(), word_counts() and ngrams(n) return dict-like views {review_id: ...} decoded on access
+    """
+
+    ARRAYS = ['review_ids', 'token_ids', 'offsets', 'order', 'counts_data', 'counts_indices', 'counts_indptr']
+
+    def __init__(self, vocabulary, review_ids, token_ids, offsets, counts=None, order=None):
+        self.vocabulary = vocabulary
+        self.review_ids = review_ids
+        self.token_ids = token_ids
+        self.offsets = offsets
+        self._counts = counts
+        self._words = np.array(vocabulary, dtype=object)
+        # Sorted review ids, so that a review is found by binary search without a dict of all review ids
+        self._order = np.argsort(review_ids, kind='stable') if order is None else order
+        self._sorted_review_ids = review_ids[self._order]
+
+
+    def __len__(self):
+        return len(self.review_ids)
+
+
+    @property
+    def counts(self):
+        if self._counts is None:
+            data = np.ones(len(self.token_ids), dtype=np.int32)
+            # Copied, as sum_duplicates sorts and merges the indices in place
+            counts = sparse.csr_matrix((data, self.token_ids, self.offsets), shape=(len(self.review_ids), len(self.vocabulary)), copy=True)
+            counts.sum_duplicates()
+            self._counts = counts
+        return self._counts
+
+
+    def row(self, review_id):
+        """ Row of a review, None if it is not in the store """
+
+        position = np.searchsorted(self._sorted_review_ids, review_id)
+        if position < len(self._sorted_review_ids) and self._sorted_review_ids[position] == review_id:
+            return int(self._order[position])
+        return None
+
+
+    def rows(self, review_ids):
+        """ Rows of reviews that are all in the store """
+
+        return self._order[np.searchsorted(self._sorted_review_ids, np.asarray(review_ids, dtype=np.int64))]
+
+
+    def row_tokens(self, row):
+        return self._words[self.token_ids[self.offsets[row]:self.offsets[row + 1]]].tolist()
+
+
+    def row_counts(self, row):
+        counts = self.counts
+        start, end = counts.indptr[row], counts.indptr[row + 1]
+        return Counter(dict(zip(self._words[counts.indices[start:end]].tolist(), counts.data[start:end].tolist())))
+
+
+    def term_counts(self, review_ids):
+        """ Counter of the words of several reviews, summed on the count matrix """
+
+        block = self.counts[self.rows(review_ids)]
+        total = sparse.csr_matrix((block.data, block.indices, [0, block.nnz]), shape=(1, len(self.vocabulary)))
+        total.sum_duplicates()
+        return Counter(dict(zip(self._words[total.indices].tolist(), total.data.tolist())))
+
+
+    def tokens(self):
+        return TokenStoreView(self, self.row_tokens)
+
+
+    def word_counts(self):
+        return TokenStoreView(self, self.row_counts)
+
+
+    def ngrams(self, n):
+        def row_ngrams(row):
+            tokens = self.row_tokens(row)
+            return list(zip(*[tokens[shift:] for shift in range(n)]))
+        return TokenStoreView(self, row_ngrams)
+
+
+    def save(self, directory):
+        """ Saves the arrays as .npy files and the vocabulary as vocabulary.json in directory """
+
+        os.makedirs(directory, exist_ok=True)
+        counts = self.counts
+        arrays = [self.review_ids, self.token_ids, self.offsets, self._order, counts.data, counts.indices, counts.indptr]
+        for name, values in zip(self.ARRAYS, arrays):
+            np.save(os.path.join(directory, name + '.npy'), values)
+        with open(os.path.join(directory, 'vocabulary.json'), 'w') as vocabulary_file:
+            json.dump(self.vocabulary, vocabulary_file)
+
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        """ Loads a store saved with TokenStore.save, arrays are memory-mapped (read-only) unless mmap is False """
+
+        arrays = {name: np.load(os.path.join(directory, name + '.npy'), mmap_mode='r' if mmap else None) for name in cls.ARRAYS}
+        with open(os.path.join(directory, 'vocabulary.json')) as vocabulary_file:
+            vocabulary = json.load(vocabulary_file)
+        counts = sparse.csr_matrix((arrays['counts_data'], arrays['counts_indices'], arrays['counts_indptr']),
+                                   shape=(len(arrays['review_ids']), len(vocabulary)), copy=False)
+        return cls(vocabulary, arrays['review_ids'], arrays['token_ids'], arrays['offsets'], counts, arrays['order'])
+
+
+class TokenStoreView(Mapping):
+    """ Read-only dict-like view {review_id: value} of a TokenStore, values are decoded from the arrays on access """
+
+    def __init__(self, store, decode):
+        self.store = store
+        self.decode = decode
+
+    def __getitem__(self, review_id):
+        row = self.store.row(review_id)
+        if row is None:
+            raise KeyError(review_id)
+        return self.decode(row)
+
+    def __contains__(self, review_id):
+        return self.store.row(review_id) is not None
+
+    def __iter__(self):
+        return iter(self.store.review_ids.tolist())
+
+    def __len__(self):
+        return len(self.store)
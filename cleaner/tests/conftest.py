@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The tests import the flat modules of src/, as main.py does when run from this directory
+CLEANER_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(CLEANER_DIRECTORY, 'src'))
+
+ASSETS = os.path.join(CLEANER_DIRECTORY, 'assets')
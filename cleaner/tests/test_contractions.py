@@ -0,0 +1,43 @@
+import os
+
+from conftest import ASSETS
+from helpers import ContractionExpander, load_contractions
+
+
+CONTRACTIONS = {"can't": "cannot", "can't've": "cannot have", "don't": "do not", "'cause": "because", "Y'all": "you all"}
+
+
+def test_expands_contractions_in_one_pass():
+
+    expander = ContractionExpander(CONTRACTIONS)
+    assert expander.expand("we don't know, can't say") == "we do not know, cannot say"
+    # Keys are lower cased, documents are lower cased before expansion by TextNormalizer
+    assert expander.expand("y'all came 'cause it's good") == "you all came because it's good"
+
+
+def test_longest_contraction_wins():
+
+    expander = ContractionExpander(CONTRACTIONS)
+    assert expander.expand("i can't've") == "i cannot have"
+
+
+def test_curly_apostrophes_are_accepted():
+
+    expander = ContractionExpander(CONTRACTIONS)
+    assert expander.expand("we don’t know") == "we do not know"
+    assert expander.expand("i can’t’ve") == "i cannot have"
+
+
+def test_contractions_inside_words_are_left_unchanged():
+
+    expander = ContractionExpander(CONTRACTIONS)
+    assert expander.expand("idon't xcan't don'ts") == "idon't xcan't don'ts"
+    assert expander.expand("no apostrophe here") == "no apostrophe here"
+
+
+def test_loads_the_assets_mapping_once():
+
+    filename = os.path.join(ASSETS, 'contractions.json')
+    expander = load_contractions(filename)
+    assert load_contractions(filename) is expander
+    assert expander.expand("i couldn't've") == "i could not have"
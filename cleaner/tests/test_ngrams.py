@@ -0,0 +1,100 @@
+import random
+from collections import Counter
+
+import numpy as np
+import pytest
+
+from ngrams import count_ngrams
+from token_store import TokenStore, TokenStoreBuilder
+
+
+def build_store(reviews):
+    builder = TokenStoreBuilder()
+    for review_id, tokens in enumerate(reviews):
+        builder.append(review_id, tokens)
+    return builder.build()
+
+
+def exact_counts(reviews, n):
+    """ Counts of the n-grams of each review, never crossing two reviews, as phrases """
+
+    return Counter(' '.join(review[start:start + n]) for review in reviews for start in range(len(review) - n + 1))
+
+
+REVIEWS = [['bottomless', 'brunch', 'was', 'great'], ['great', 'bottomless', 'brunch'], ['bottomless', 'brunch'], ['wine']]
+
+
+def test_counts_ngrams_within_reviews():
+
+    counts = count_ngrams(build_store(REVIEWS), max_n=3, chunk_size=2)
+    for n in (1, 2, 3):
+        assert counts.frequencies(n) == exact_counts(REVIEWS, n)
+    # 'brunch great' and 'great great' would cross two reviews
+    assert 'brunch great' not in counts.frequencies(2)
+    assert counts.max_errors == {1: 0, 2: 0, 3: 0}
+
+
+def test_prunes_by_min_count_then_top_k():
+
+    store = build_store(REVIEWS)
+    assert count_ngrams(store, max_n=2, min_n=2, min_count=2).frequencies(2) == {'bottomless brunch': 3}
+    assert count_ngrams(store, max_n=1, top_k=2).most_common(1) == [('bottomless', 3), ('brunch', 3)]
+
+
+def test_counts_per_group():
+
+    # Reviews 0 and 1 belong to restaurant 7, review 2 to restaurant 3, review 3 to none
+    counts = count_ngrams(build_store(REVIEWS), max_n=2, min_n=2, groups=[7, 7, 3, -1])
+    assert counts.group_labels.tolist() == [3, 7]
+    assert counts.group_frequencies(7, 2) == exact_counts(REVIEWS[:2], 2)
+    assert counts.group_frequencies(3, 2, k=1) == {'bottomless brunch': 1}
+    with pytest.raises(KeyError):
+        counts.group_frequencies(5, 2)
+
+
+def test_max_distinct_keeps_every_ngram_above_its_error_bound():
+
+    # Zipf-like reviews : a few frequent words and a long tail
+    generator = random.Random(0)
+    words = [f'w{rank}' for rank in range(200)]
+    weights = [1 / (rank + 1) for rank in range(200)]
+    reviews = [generator.choices(words, weights, k=generator.randint(1, 20)) for _ in range(500)]
+    store = build_store(reviews)
+
+    max_distinct = 50
+    counts = count_ngrams(store, max_n=2, chunk_size=20, max_distinct=max_distinct)
+    for n in (1, 2):
+        expected = exact_counts(reviews, n)
+        kept = counts.frequencies(n)
+        assert len(kept) <= max_distinct
+        assert 0 < counts.max_errors[n] <= sum(expected.values()) / (max_distinct + 1)
+        # Kept n-grams are counted exactly, and none above the bound is missing
+        assert all(kept[phrase] == expected[phrase] for phrase in kept)
+        assert all(phrase in kept for phrase, count in expected.items() if count > counts.max_errors[n])
+
+
+def test_max_distinct_larger_than_the_ngrams_is_exact():
+
+    counts = count_ngrams(build_store(REVIEWS), max_n=2, chunk_size=1, max_distinct=100)
+    assert counts.frequencies(2) == exact_counts(REVIEWS, 2)
+    assert counts.max_errors == {1: 0, 2: 0}
+
+
+def test_rejects_orders_whose_codes_overflow_int64():
+
+    # 2**16 words : 3-grams fit in 48 bits, 4-grams would need 64
+    vocabulary = [f'w{word_id}' for word_id in range(2 ** 16)]
+    store = TokenStore(vocabulary, np.array([0], dtype=np.int64), np.array([0, 65535, 1, 2], dtype=np.int32),
+                       np.array([0, 4], dtype=np.int64))
+    assert count_ngrams(store, max_n=3, min_n=3).frequencies(3) == {'w0 w65535 w1': 1, 'w65535 w1 w2': 1}
+    with pytest.raises(ValueError):
+        count_ngrams(store, max_n=4)
+
+
+def test_rejects_invalid_arguments():
+
+    store = build_store(REVIEWS)
+    with pytest.raises(ValueError):
+        count_ngrams(store, max_n=1, min_n=2)
+    with pytest.raises(ValueError):
+        count_ngrams(store, max_distinct=0)
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+from scipy import sparse
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from tfidf import SparseTfidf, load_tfidf, passthrough_analyzer
+
+
+def test_save_and_load_round_trip(tmp_path):
+
+    matrix = sparse.csr_matrix(np.array([[0.5, 0, 0.25], [0, 0.75, 0]]))
+    tfidf = SparseTfidf(matrix, np.array([12, 7]), np.array(['food', 'service', 'wine']))
+    tfidf.save(str(tmp_path / '3_word_freq'))
+
+    loaded = load_tfidf(str(tmp_path) + '/', 3)
+    assert isinstance(loaded, SparseTfidf)
+    assert loaded.review_ids == [12, 7]
+    assert loaded.vocabulary == ['food', 'service', 'wine']
+    assert (loaded.matrix != matrix).nnz == 0
+
+
+def test_dataframe_view_and_term_means(tmp_path):
+
+    matrix = sparse.csr_matrix(np.array([[0.5, 0, 0.25], [0, 0.75, 0]]))
+    SparseTfidf(matrix, [12, 7], ['food', 'service', 'wine']).save(str(tmp_path / '3_word_freq'))
+
+    df = load_tfidf(str(tmp_path) + '/', 3, as_dataframe=True)
+    assert df.index.name == 'review_id'
+    assert df.index.tolist() == [12, 7]
+    assert df.loc[7, 'service'] == 0.75
+
+    means = load_tfidf(str(tmp_path) + '/', 3).term_means()
+    assert list(means) == ['service', 'food', 'wine']
+    assert means['wine'] == pytest.approx(0.125)
+
+
+def test_passthrough_analyzer_matches_the_english_vectorizer():
+
+    documents = [['the', 'Food', 'was', 'great', 'a', 'x', 'wine-bar'], ['great', 'service', 'and', 'great', 'food']]
+    vectorizer = TfidfVectorizer(stop_words='english').fit([' '.join(document) for document in documents])
+    passthrough = TfidfVectorizer(analyzer=passthrough_analyzer).fit(documents)
+    assert passthrough.get_feature_names_out().tolist() == vectorizer.get_feature_names_out().tolist()
@@ -0,0 +1,105 @@
+import pytest
+
+import token_cache
+from token_cache import TokenCache, config_hash
+
+
+class Clock(object):
+    """ Replaces time.time in token_cache, advanced by hand """
+
+    def __init__(self):
+        self.now = 1700000000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(token_cache.time, 'time', clock)
+    return clock
+
+
+def cached(cache, documents):
+    found = cache.get_many(cache.key(document) for document in documents)
+    return sorted(document for document in documents if cache.key(document) in found)
+
+
+def test_config_hash_depends_on_stop_words_and_contractions():
+
+    config = config_hash(['the', 'a'], {"don't": "do not"})
+    assert config_hash(['a', 'the'], {"don't": "do not"}) == config
+    assert config_hash(['the', 'a', 'an'], {"don't": "do not"}) != config
+    assert config_hash(['the', 'a'], {"don't": "dont"}) != config
+
+
+def test_entries_of_another_config_are_invalidated_on_open(tmp_path):
+
+    config = config_hash(['the'], {})
+    cache = TokenCache(str(tmp_path), config)
+    cache.put_many([(cache.key('great food'), ['great', 'food'])])
+    assert cache.get_many([cache.key('great food')]) == {cache.key('great food'): ['great', 'food']}
+    cache.close()
+
+    # Same config : entries are kept across runs
+    cache = TokenCache(str(tmp_path), config)
+    assert cached(cache, ['great food']) == ['great food']
+    cache.close()
+
+    # Stop words changed : the tokens may differ, entries are dropped
+    cache = TokenCache(str(tmp_path), config_hash(['the', 'food'], {}))
+    assert cached(cache, ['great food']) == []
+    assert cache.stats()['entries'] == 0
+    cache.close()
+
+
+def test_evicts_entries_unused_for_max_age_days(tmp_path, clock):
+
+    cache = TokenCache(str(tmp_path), 'config', max_age_days=30)
+    cache.put_many([(cache.key('old'), ['old']), (cache.key('recent'), ['recent'])])
+
+    clock.now += 20 * 86400
+    cached(cache, ['recent'])
+    clock.now += 20 * 86400
+    cache.evict()
+    assert cached(cache, ['old', 'recent']) == ['recent']
+    cache.close()
+
+
+def test_evicts_least_recently_used_entries_above_max_entries(tmp_path, clock):
+
+    cache = TokenCache(str(tmp_path), 'config', max_entries=2)
+    for document in ['a', 'b', 'c']:
+        cache.put_many([(cache.key(document), [document])])
+        clock.now += 1
+    cached(cache, ['a'])
+    clock.now += 1
+
+    cache.evict()
+    assert cache.stats()['entries'] == 2
+    assert cached(cache, ['a', 'b', 'c']) == ['a', 'c']
+    cache.close()
+
+
+def test_evicts_least_recently_used_entries_above_max_bytes(tmp_path, clock):
+
+    cache = TokenCache(str(tmp_path), 'config', max_bytes=32)
+    # Each value is the JSON list of tokens, 16 bytes here
+    for document in ['aaaa', 'bbbb', 'cccc']:
+        cache.put_many([(cache.key(document), [document, document])])
+        clock.now += 1
+
+    cache.evict()
+    assert cache.stats()['bytes'] == 32
+    assert cached(cache, ['aaaa', 'bbbb', 'cccc']) == ['bbbb', 'cccc']
+    cache.close()
+
+
+def test_stats_count_hits_and_misses(tmp_path):
+
+    cache = TokenCache(str(tmp_path), 'config')
+    cache.put_many([(cache.key('seen'), ['seen'])])
+    cached(cache, ['seen', 'unseen', 'other'])
+    assert cache.stats() == {'hits': 1, 'misses': 2, 'entries': 1, 'bytes': len('["seen"]')}
+    cache.close()
@@ -0,0 +1,71 @@
+from collections import Counter
+
+import numpy as np
+import pytest
+
+from token_store import TokenStore, TokenStoreBuilder
+
+
+REVIEWS = [(30, ['great', 'food', 'great', 'wine']), (10, []), (20, ['food', 'service'])]
+
+
+def build_store():
+    builder = TokenStoreBuilder()
+    for review_id, tokens in REVIEWS:
+        builder.append(review_id, tokens)
+    assert len(builder) == len(REVIEWS)
+    return builder.build()
+
+
+def test_builder_interns_each_word_once():
+
+    store = build_store()
+    assert store.vocabulary == ['great', 'food', 'wine', 'service']
+    assert store.token_ids.tolist() == [0, 1, 0, 2, 1, 3]
+    assert store.offsets.tolist() == [0, 4, 4, 6]
+    assert store.review_ids.tolist() == [30, 10, 20]
+
+
+def test_views_decode_reviews_by_review_id():
+
+    store = build_store()
+    tokens = store.tokens()
+    assert dict(tokens) == dict(REVIEWS)
+    assert list(tokens) == [30, 10, 20]
+    assert len(tokens) == 3
+    assert 10 in tokens and 40 not in tokens
+    with pytest.raises(KeyError):
+        tokens[40]
+
+    word_counts = store.word_counts()
+    assert word_counts[30] == Counter(great=2, food=1, wine=1)
+    assert word_counts[10] == Counter()
+
+    bigrams = store.ngrams(2)
+    assert bigrams[30] == [('great', 'food'), ('food', 'great'), ('great', 'wine')]
+    assert bigrams[20] == [('food', 'service')]
+    assert bigrams[10] == []
+
+
+def test_term_counts_sum_several_reviews():
+
+    store = build_store()
+    assert store.term_counts([30, 20]) == Counter(great=2, food=2, wine=1, service=1)
+    assert store.term_counts([10]) == Counter()
+
+
+def test_save_and_load_memory_mapped(tmp_path):
+
+    store = build_store()
+    store.save(str(tmp_path / 'token_store'))
+    loaded = TokenStore.load(str(tmp_path / 'token_store'))
+
+    assert isinstance(loaded.token_ids, np.memmap)
+    assert loaded.vocabulary == store.vocabulary
+    assert dict(loaded.tokens()) == dict(REVIEWS)
+    assert dict(loaded.word_counts()) == dict(store.word_counts())
+    assert loaded.term_counts([30, 20]) == store.term_counts([30, 20])
+
+    in_memory = TokenStore.load(str(tmp_path / 'token_store'), mmap=False)
+    assert not isinstance(in_memory.token_ids, np.memmap)
+    assert dict(in_memory.ngrams(2)) == dict(store.ngrams(2))
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+# Pool of headless Chrome sessions used to render the pages whose content is generated by JS (websites and menus)
+
+import os
+import queue
+import threading
+
+from logzero import logger
+
+from selenium import webdriver
+from selenium.common.exceptions import WebDriverException
+from selenium.webdriver.chrome.service import Service
+from webdriver_manager.chrome import ChromeDriverManager
+
+
+def chrome_options():
+    options = webdriver.ChromeOptions()
+    options.add_argument('--headless')
+    options.add_argument('--no-sandbox')
+    options.add_argument('--disable-dev-shm-usage')
+    return options
+
+
+class BrowserPool(object):
+    """
+    Bounded pool of reusable headless Chrome sessions, meant to be used from worker threads (never from the reactor thread)
+        - the driver binary is resolved and checked once by resolve_driver(), called when the crawl starts
+        - at most size sessions are alive, render() blocks until one is free
+        - a session that fails or times out is quit and replaced by a new one on next use
+    """
+
+    def __init__(self, size=2, page_timeout=30):
+
+        if size <= 0:
+            raise ValueError("size argument must be strictly positive integer")
+
+        self.size = size
+        self.page_timeout = page_timeout
+        self.driver_path = None
+        self.idle = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(size)
+        self.lock = threading.Lock()
+        self.drivers = set()
+        self.closed = False
+
+    def resolve_driver(self):
+        """ Resolves the driver binary (downloaded if needed) and checks that it can be run, raises RuntimeError otherwise """
+
+        with self.lock:
+            if self.driver_path is None:
+                try:
+                    driver_path = ChromeDriverManager().install()
+                except Exception as error:
+                    raise RuntimeError(f'Chrome driver could not be resolved: {error!r}') from error
+                if not (os.path.isfile(driver_path) and os.access(driver_path, os.X_OK)):
+                    raise RuntimeError(f'Chrome driver is not an executable file: {driver_path}')
+                self.driver_path = driver_path
+        return self.driver_path
+
+    def start_driver(self):
+
+        driver_path = self.resolve_driver()
+        with self.lock:
+            if self.closed:
+                raise RuntimeError('Browser pool is closed')
+            driver = webdriver.Chrome(service=Service(driver_path), options=chrome_options())
+            driver.set_page_load_timeout(self.page_timeout)
+            self.drivers.add(driver)
+        return driver
+
+    def quit_driver(self, driver):
+
+        with self.lock:
+            self.drivers.discard(driver)
+        try:
+            driver.quit()
+        except WebDriverException as e:
+            logger.warn(f' > FAILED TO QUIT BROWSER: {e!r}')
+
+    def render(self, url):
+        """ Loads the url in a free session and returns the rendered HTML (blocking) """
+
+        with self.slots:
+            try:
+                driver = self.idle.get_nowait()
+            except queue.Empty:
+                driver = self.start_driver()
+            try:
+                driver.get(url)
+                html = driver.page_source
+            except WebDriverException:
+                self.quit_driver(driver)
+                raise
+            if self.closed:
+                self.quit_driver(driver)
+            else:
+                self.idle.put(driver)
+        return html
+
+    def close(self):
+        """ Quits every session, including the ones still rendering a page """
+
+        with self.lock:
+            self.closed = True
+            drivers = list(self.drivers)
+        for driver in drivers:
+            self.quit_driver(driver)
+        logger.info(f' > BROWSER POOL CLOSED ({len(drivers)} SESSIONS)')
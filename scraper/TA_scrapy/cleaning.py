@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+
+# Worker side of the CleaningPipeline : Cleaner instances of the cleaner project (../cleaner/src), one per worker process
+#
+# The cleaner modules use flat imports and a relative assets/ folder, so each worker adds cleaner/src
+# to its path and runs from the cleaner folder. The crawling process only imports storage.py (in
+# CleaningPipeline.open_spider), to write the tokens returned by the workers.
+
+import os
+import sys
+
+
+def _init_cleaning_worker(cleaner_directory, stop_words_filename, lemma_cache_size):
+    """ Loads stop words, tagger and lemmatizer once per worker process """
+
+    sys.path.insert(0, os.path.join(cleaner_directory, 'src'))
+    os.chdir(cleaner_directory)
+
+    import cleaner
+    cleaner._init_worker(stop_words_filename, False, lemma_cache_size)
+
+
+def _clean_chunk(chunk):
+    """ Cleans and tokenizes a chunk of (review_id, comment) pairs, returns the (review_id, tokens) pairs """
+
+    import cleaner
+    return cleaner.tokenize_chunk(chunk)
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+
+# Persistent crawl state shared by the spider and the pipeline
+#
+# Keeps the already scraped restaurant urls, review urls and usernames in a local SQLite file
+# so that an interrupted or repeated crawl does not download them again
+
+import os
+import time
+import sqlite3
+from urllib.parse import urlsplit
+
+
+def url_path(url):
+    """ Returns the path (and query) of a TripAdvisor url, absolute or relative """
+
+    split_url = urlsplit(url)
+    if split_url.query:
+        return split_url.path + '?' + split_url.query
+    return split_url.path
+
+
+class CrawlState(object):
+    """ 
+    Set of scraped keys per kind with their scraping time, opened lazily and queried through the primary key:
+        - 'restaurant': restaurants whose review pages were all handled and saved (skipped by the spider)
+        - 'restaurant_item': restaurants whose RestoItem is saved (not saved again when a partly scraped restaurant is resumed)
+        - 'review', 'user': saved reviews (by url) and user profiles (by username)
+    """
+
+    def __init__(self, path):
+
+        self.path = path
+        self.is_new = not os.path.exists(path)
+        self._connection = None
+
+    @property
+    def connection(self):
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path)
+            with self._connection:
+                self._connection.execute('CREATE TABLE IF NOT EXISTS seen '
+                                         '(kind TEXT, key TEXT, scraped_at REAL, PRIMARY KEY (kind, key)) WITHOUT ROWID')
+                # States created before scraping times were recorded
+                columns = [column[1] for column in self._connection.execute('PRAGMA table_info(seen)')]
+                if 'scraped_at' not in columns:
+                    self._connection.execute('ALTER TABLE seen ADD COLUMN scraped_at REAL')
+        return self._connection
+
+    def contains(self, kind, key):
+        row = self.connection.execute('SELECT 1 FROM seen WHERE kind = ? AND key = ?', (kind, key)).fetchone()
+        return row is not None
+
+    def scraped_at(self, kind, key):
+        """ Returns the time (epoch seconds) the key was scraped at, None if it was never scraped """
+
+        row = self.connection.execute('SELECT scraped_at FROM seen WHERE kind = ? AND key = ?', (kind, key)).fetchone()
+        return None if row is None else row[0]
+
+    def add(self, kind, key, scraped_at=None):
+        """ Records one key (or refreshes its scraping time) in its own transaction """
+
+        scraped_at = time.time() if scraped_at is None else scraped_at
+        with self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO seen VALUES (?, ?, ?)', (kind, key, scraped_at))
+
+    def add_many(self, kind, keys, scraped_at=None):
+        scraped_at = time.time() if scraped_at is None else scraped_at
+        with self.connection:
+            self.connection.executemany('INSERT OR IGNORE INTO seen VALUES (?, ?, ?)', [(kind, key, scraped_at) for key in keys])
+
+    def count(self, kind):
+        return self.connection.execute('SELECT COUNT(*) FROM seen WHERE kind = ?', (kind,)).fetchone()[0]
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+class UserProfiles(object):
+    """ 
+    Decides which user profiles to fetch, so that each profile is fetched at most once per refresh window:
+        - usernames already requested in this run (in flight) are not requested again
+        - usernames saved in the crawl state are fetched again only when older than ttl_days (never if ttl_days is None)
+    """
+
+    def __init__(self, crawl_state, ttl_days=None):
+
+        self.crawl_state = crawl_state
+        self.ttl = None if ttl_days is None else float(ttl_days) * 86400
+        self.in_flight = set()
+
+    def should_fetch(self, username):
+        """ Returns True if the profile must be fetched, and marks it in flight """
+
+        if username in self.in_flight:
+            return False
+        scraped_at = self.crawl_state.scraped_at('user', username)
+        if scraped_at is not None and (self.ttl is None or time.time() - scraped_at < self.ttl):
+            return False
+        self.in_flight.add(username)
+        return True
+
+    def saved(self, username):
+        """ Records a profile written by the pipeline """
+
+        self.crawl_state.add('user', username)
+        self.in_flight.discard(username)
+
+    def failed(self, username):
+        """ Releases a profile whose request failed, so that it can be requested again """
+
+        self.in_flight.discard(username)
+
+
+class RestaurantProgress(object):
+    """ 
+    Records a restaurant as scraped only once all its pages are handled and saved, so that an interrupted crawl resumes it:
+        - the spider counts the requests of each restaurant in flight (review pages, single review pages, rendered page)
+        - when the last one is handled, the restaurant is complete, and its key waits in self.completed for the pipeline,
+          which records it once every line written before is published (see TaScrapyPipeline.record_published)
+        - a request that fails or is filtered never completes its restaurant, which is then scraped again on resume
+          (reviews already saved are skipped by their own keys)
+    """
+
+    def __init__(self):
+
+        self.keys = {}
+        self.in_flight = {}
+        self.completed = []
+
+    def start(self, restaurant_id, key):
+        """ Starts a restaurant, whose first review page is requested """
+
+        self.keys[restaurant_id] = key
+        self.in_flight[restaurant_id] = 1
+
+    def request(self, restaurant_id):
+        """ Counts one more request of the restaurant in flight """
+
+        self.in_flight[restaurant_id] = self.in_flight.get(restaurant_id, 0) + 1
+
+    def handled(self, restaurant_id):
+        """ Counts a request of the restaurant handled by its callback, the restaurant is complete when none is left """
+
+        self.in_flight[restaurant_id] -= 1
+        if self.in_flight[restaurant_id] == 0:
+            del self.in_flight[restaurant_id]
+            if restaurant_id in self.keys:
+                self.completed.append(self.keys.pop(restaurant_id))
+
+    def pop_completed(self):
+        """ Returns (and forgets) the keys of the restaurants completed since the last call """
+
+        completed = self.completed
+        self.completed = []
+        return completed
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+
+# Crawl performance stats : parse latency per callback, request, response and item rates, bytes downloaded
+# per page type, pipeline write time and reactor lag, logged periodically and saved as JSON
+#
+# See documentation in:
+# https://docs.scrapy.org/en/latest/topics/extensions.html
+
+import os
+import json
+import time
+import bisect
+
+from logzero import logger
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from twisted.internet import task
+
+from TA_scrapy.shard_writer import new_shard_id
+
+
+# Sent by CallbackTimingMiddleware once the output of a callback is consumed (callback, seconds, spider)
+callback_timed = object()
+
+
+class LatencyHistogram(object):
+    """ Histogram of durations in seconds, with log-spaced buckets (doubling from 0.1 ms to about 7 minutes) """
+
+    BOUNDS = [0.0001 * 2 ** i for i in range(23)]
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.counts[bisect.bisect_left(self.BOUNDS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, q):
+        """ Upper bound of the bucket holding the q quantile (the maximum for the last bucket) """
+
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        seen = 0
+        for position, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return self.BOUNDS[position] if position < len(self.BOUNDS) else self.max
+        return self.max
+
+    def summary(self, buckets=False):
+        summary = dict(count=self.count, seconds=round(self.total, 6),
+                       mean=round(self.total / self.count, 6) if self.count else None, max=round(self.max, 6),
+                       p50=self.percentile(0.5), p90=self.percentile(0.9), p99=self.percentile(0.99))
+        if buckets:
+            bounds = [f'{bound:g}' for bound in self.BOUNDS] + ['inf']
+            summary['buckets'] = {bound: count for bound, count in zip(bounds, self.counts) if count}
+        return summary
+
+
+class CrawlStatsExtension(object):
+    """ Collects the performance stats of a crawl, to tune concurrency from data
+        - latency histogram of each spider callback (parse, parse_review_page, parse_review, parse_resto_website_menu, parse_user),
+          timed by CallbackTimingMiddleware on the reactor thread
+        - requests, responses and items (per item type) with their rates, bytes downloaded per callback
+        - pipeline write time, from the pipeline/write_seconds/* values of the stats collector
+        - reactor lag : delay of a LoopingCall every CRAWL_STATS_LAG_INTERVAL, i.e. how long the reactor was kept busy
+        - a snapshot every CRAWL_STATS_INTERVAL seconds is logged and appended to <CRAWL_STATS_DIR>/crawl_stats_<shard>.jsonl,
+          the final report (with histogram buckets) is saved to <CRAWL_STATS_DIR>/crawl_stats_<shard>.json
+    """
+
+    def __init__(self, crawler, interval=60, lag_interval=0.1, directory=None):
+
+        self.crawler = crawler
+        self.interval = interval
+        self.lag_interval = lag_interval
+        self.directory = directory
+        self.callbacks = {}
+        self.reactor_lag = LatencyHistogram()
+        self.counters = {'requests': 0, 'responses': 0, 'items': 0}
+        self.items = {}
+        self.response_bytes = {}
+        self.responses = {}
+        self.callback_errors = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('CRAWL_STATS_ENABLED', True):
+            raise NotConfigured
+        s = cls(crawler, settings.getfloat('CRAWL_STATS_INTERVAL', 60), settings.getfloat('CRAWL_STATS_LAG_INTERVAL', 0.1),
+                settings.get('CRAWL_STATS_DIR'))
+        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(s.request_scheduled, signal=signals.request_scheduled)
+        crawler.signals.connect(s.response_received, signal=signals.response_received)
+        crawler.signals.connect(s.item_scraped, signal=signals.item_scraped)
+        crawler.signals.connect(s.spider_error, signal=signals.spider_error)
+        crawler.signals.connect(s.callback_timed, signal=callback_timed)
+        return s
+
+    def spider_opened(self, spider):
+
+        directory = self.directory or getattr(spider, 'directory', './') + 'crawl_stats/'
+        os.makedirs(directory, exist_ok=True)
+        shard_id = new_shard_id()
+        self.snapshots_path = os.path.join(directory, f'crawl_stats_{shard_id}.jsonl')
+        self.report_path = os.path.join(directory, f'crawl_stats_{shard_id}.json')
+
+        self.start = time.time()
+        self.previous_snapshot = (self.start, dict(self.counters))
+        self.snapshot_loop = task.LoopingCall(self.snapshot)
+        self.snapshot_loop.start(self.interval, now=False)
+
+        self.lag_last = time.monotonic()
+        self.lag_loop = task.LoopingCall(self.measure_lag)
+        self.lag_loop.start(self.lag_interval, now=False)
+
+    @staticmethod
+    def callback_name(request):
+        return getattr(request.callback, '__name__', 'parse')
+
+    def request_scheduled(self, request, spider):
+        self.counters['requests'] += 1
+
+    def response_received(self, response, request, spider):
+        name = self.callback_name(request)
+        self.counters['responses'] += 1
+        self.responses[name] = self.responses.get(name, 0) + 1
+        self.response_bytes[name] = self.response_bytes.get(name, 0) + len(response.body)
+
+    def item_scraped(self, item, response, spider):
+        name = type(item).__name__
+        self.counters['items'] += 1
+        self.items[name] = self.items.get(name, 0) + 1
+
+    def spider_error(self, failure, response, spider):
+        name = self.callback_name(response.request)
+        self.callback_errors[name] = self.callback_errors.get(name, 0) + 1
+
+    def callback_timed(self, callback, seconds, spider):
+        if callback not in self.callbacks:
+            self.callbacks[callback] = LatencyHistogram()
+        self.callbacks[callback].add(seconds)
+
+    def measure_lag(self):
+        now = time.monotonic()
+        self.reactor_lag.add(max(0.0, now - self.lag_last - self.lag_interval))
+        self.lag_last = now
+
+    def pipeline_stats(self):
+        """ Write seconds and calls per item kind, recorded by the pipelines in the stats collector """
+
+        pipeline = {}
+        for key, value in self.crawler.stats.get_stats().items():
+            if key.startswith('pipeline/write_seconds/'):
+                pipeline.setdefault(key.split('/')[-1], {})['seconds'] = round(value, 6)
+            elif key.startswith('pipeline/write_calls/'):
+                pipeline.setdefault(key.split('/')[-1], {})['calls'] = value
+        return pipeline
+
+    def report(self, final=False):
+
+        now = time.time()
+        elapsed = now - self.start
+        previous_time, previous_counters = self.previous_snapshot
+        interval = max(now - previous_time, 1e-9)
+        pipeline = self.pipeline_stats()
+        callbacks_seconds = sum(histogram.total for histogram in self.callbacks.values())
+        pipeline_seconds = sum(stats.get('seconds', 0) for stats in pipeline.values())
+
+        report = dict(
+            time=round(now, 3),
+            elapsed_seconds=round(elapsed, 3),
+            counters=dict(self.counters),
+            rates={name: round((value - previous_counters[name]) / interval, 3) for name, value in self.counters.items()},
+            average_rates={name: round(value / max(elapsed, 1e-9), 3) for name, value in self.counters.items()},
+            items=dict(self.items),
+            responses=dict(self.responses),
+            response_bytes=dict(self.response_bytes),
+            callbacks={name: histogram.summary(buckets=final) for name, histogram in sorted(self.callbacks.items())},
+            callback_errors=dict(self.callback_errors),
+            pipeline=pipeline,
+            reactor=dict(lag=self.reactor_lag.summary(buckets=final),
+                         busy_share=dict(callbacks=round(callbacks_seconds / max(elapsed, 1e-9), 4),
+                                         pipeline=round(pipeline_seconds / max(elapsed, 1e-9), 4))),
+        )
+        self.previous_snapshot = (now, dict(self.counters))
+        return report
+
+    def snapshot(self):
+
+        report = self.report()
+        with open(self.snapshots_path, 'a') as snapshots_file:
+            snapshots_file.write(json.dumps(report) + '\n')
+        logger.info(f' > CRAWL STATS: {report["rates"]} PER SECOND, REACTOR LAG P90 {report["reactor"]["lag"]["p90"]}s, '
+                    f'CALLBACK P90 {({name: callback["p90"] for name, callback in report["callbacks"].items()})}')
+
+    def spider_closed(self, spider, reason):
+
+        for loop in (self.snapshot_loop, self.lag_loop):
+            if loop.running:
+                loop.stop()
+
+        report = self.report(final=True)
+        report['reason'] = reason
+        with open(self.report_path, 'w') as report_file:
+            json.dump(report, report_file, indent=2)
+        logger.warn(f' > CRAWL STATS SAVED TO {self.report_path}')
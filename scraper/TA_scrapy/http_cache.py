@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+# On-disk HTTP response cache used to record a live crawl and replay it offline
+#
+# Bodies are stored once per content (gzip files named by their SHA-256), and a SQLite index maps
+# each request fingerprint to the status, headers and body hash of its response
+
+import os
+import gzip
+import json
+import time
+import sqlite3
+import hashlib
+
+from scrapy.http import Headers
+from scrapy.responsetypes import responsetypes
+
+
+class HttpCache(object):
+    """ Content-addressed response cache in directory : index.sqlite and objects/<2 first hex>/<sha256>.gz """
+
+    def __init__(self, directory):
+
+        self.directory = directory
+        self.objects_directory = os.path.join(directory, 'objects')
+        os.makedirs(self.objects_directory, exist_ok=True)
+        self.connection = sqlite3.connect(os.path.join(directory, 'index.sqlite'))
+        with self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS responses (fingerprint TEXT PRIMARY KEY, url TEXT, '
+                                    'status INTEGER, headers TEXT, body_hash TEXT, recorded_at REAL) WITHOUT ROWID')
+
+    def object_path(self, body_hash):
+        return os.path.join(self.objects_directory, body_hash[:2], body_hash + '.gz')
+
+    def store(self, fingerprint, response):
+        """ Saves the response under the request fingerprint (the body is written only if its content is new) """
+
+        body_hash = hashlib.sha256(response.body).hexdigest()
+        path = self.object_path(body_hash)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = path + '.tmp'
+            with gzip.open(temp_path, 'wb') as body_file:
+                body_file.write(response.body)
+            os.replace(temp_path, path)
+
+        headers = [(key.decode('latin1'), [value.decode('latin1') for value in values])
+                   for key, values in response.headers.items()]
+        with self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)',
+                                    (fingerprint, response.url, response.status, json.dumps(headers), body_hash, time.time()))
+
+    def retrieve(self, fingerprint, request):
+        """ Returns the cached response of the request, None if it was not recorded """
+
+        row = self.connection.execute('SELECT url, status, headers, body_hash FROM responses WHERE fingerprint = ?',
+                                      (fingerprint,)).fetchone()
+        if row is None:
+            return None
+
+        url, status, headers, body_hash = row
+        with gzip.open(self.object_path(body_hash), 'rb') as body_file:
+            body = body_file.read()
+        headers = Headers(dict(json.loads(headers)))
+        response_class = responsetypes.from_args(headers=headers, url=url, body=body)
+        return response_class(url=url, status=status, headers=headers, body=body, request=request)
+
+    def count(self):
+        return self.connection.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+
+    def close(self):
+        self.connection.close()
@@ -13,6 +13,7 @@ class ReviewRestoItem(scrapy.Item):
         
     review_id = scrapy.Field()
     restaurant_id = scrapy.Field()
+    review_TA_url = scrapy.Field()
     username = scrapy.Field()
     date_of_visit = scrapy.Field()
     date_of_review = scrapy.Field()
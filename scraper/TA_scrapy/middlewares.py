@@ -5,7 +5,19 @@
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 
+import time
+
+from logzero import logger
+
 from scrapy import signals
+from scrapy.exceptions import IgnoreRequest, NotConfigured
+from scrapy.http import HtmlResponse
+from scrapy.utils.defer import maybe_deferred_to_future
+from twisted.internet.threads import deferToThread
+
+from TA_scrapy.browser import BrowserPool
+from TA_scrapy.http_cache import HttpCache
+from TA_scrapy.extensions import callback_timed
 
 
 class TascrapySpiderMiddleware(object):
@@ -56,48 +68,343 @@ class TascrapySpiderMiddleware(object):
         spider.logger.info('Spider opened: %s' % spider.name)
 
 
-class TascrapyDownloaderMiddleware(object):
-    # Not all methods need to be defined. If a method is not defined,
-    # scrapy acts as if the downloader middleware does not modify the
-    # passed objects.
+class CallbackTimingMiddleware(object):
+    """ Times the spider callbacks for CrawlStatsExtension (closest to the spider, see SPIDER_MIDDLEWARES)
+        - only the time spent producing the outputs is counted, not the pipelines run in between
+        - the total time of each callback call is sent with the callback_timed signal
+    """
+
+    def __init__(self, crawler):
+        self.crawler = crawler
 
     @classmethod
     def from_crawler(cls, crawler):
-        # This method is used by Scrapy to create your spiders.
-        s = cls()
-        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        if not crawler.settings.getbool('CRAWL_STATS_ENABLED', True):
+            raise NotConfigured
+        return cls(crawler)
+
+    def send(self, response, seconds, spider):
+        callback = getattr(response.request.callback, '__name__', 'parse')
+        self.crawler.signals.send_catch_log(callback_timed, callback=callback, seconds=seconds, spider=spider)
+
+    def process_spider_output(self, response, result, spider):
+
+        seconds = 0.0
+        iterator = iter(result)
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    output = next(iterator)
+                except StopIteration:
+                    break
+                finally:
+                    seconds += time.perf_counter() - start
+                yield output
+        finally:
+            self.send(response, seconds, spider)
+
+    async def process_spider_output_async(self, response, result, spider):
+
+        seconds = 0.0
+        iterator = result.__aiter__()
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    output = await iterator.__anext__()
+                except StopAsyncIteration:
+                    break
+                finally:
+                    seconds += time.perf_counter() - start
+                yield output
+        finally:
+            self.send(response, seconds, spider)
+
+
+class ReplayCacheMiddleware(object):
+    """ Records responses to an HttpCache during a live crawl, or replays a recorded crawl without network (HTTP_CACHE_MODE)
+        - 'record' : successful responses (including rendered pages) are saved in HTTP_CACHE_DIR, keyed by request fingerprint
+        - 'replay' : responses are read from HTTP_CACHE_DIR, requests that were not recorded are dropped
+        - 'off'    : disabled
+    """
+
+    def __init__(self, crawler, mode, directory):
+
+        if mode not in ('off', 'record', 'replay'):
+            raise ValueError("HTTP_CACHE_MODE setting must be 'off', 'record' or 'replay'")
+
+        self.crawler = crawler
+        self.mode = mode
+        self.cache = HttpCache(directory)
+        logger.warn(f' > HTTP CACHE {mode.upper()} ({directory}, {self.cache.count()} RESPONSES)')
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        mode = crawler.settings.get('HTTP_CACHE_MODE', 'off')
+        if mode == 'off':
+            raise NotConfigured
+        s = cls(crawler, mode, crawler.settings.get('HTTP_CACHE_DIR', './http_cache/'))
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
         return s
 
+    def fingerprint(self, request):
+        # Rendered pages have the url of the raw page
+        suffix = ':browser' if request.meta.get('browser') else ''
+        return self.crawler.request_fingerprinter.fingerprint(request).hex() + suffix
+
     def process_request(self, request, spider):
-        # Called for each request that goes through the downloader
-        # middleware.
-
-        # Must either:
-        # - return None: continue processing this request
-        # - or return a Response object
-        # - or return a Request object
-        # - or raise IgnoreRequest: process_exception() methods of
-        #   installed downloader middleware will be called
+
+        if self.mode != 'replay':
+            return None
+
+        response = self.cache.retrieve(self.fingerprint(request), request)
+        if response is None:
+            self.crawler.stats.inc_value('http_cache/miss')
+            raise IgnoreRequest(f'Not recorded: {request.url}')
+        self.crawler.stats.inc_value('http_cache/hit')
+        response.flags.append('cached')
+        return response
+
+    def process_response(self, request, response, spider):
+
+        if self.mode != 'record' or response.status != 200 or 'cached' in response.flags:
+            return response
+
+        self.cache.store(self.fingerprint(request), response)
+        # Redirected requests are replayed from their first url
+        for url in request.meta.get('redirect_urls', []):
+            self.cache.store(self.fingerprint(request.replace(url=url)), response)
+        self.crawler.stats.inc_value('http_cache/stored')
+        return response
+
+    def spider_closed(self, spider):
+        self.cache.close()
+
+
+class EndpointState(object):
+    """ Latency, error rate, concurrency and delay of one endpoint class, adapted with AIMD
+        - successes under the target latency add about one request of concurrency per window and shrink the delay
+        - bans (429, 403, captcha) and errors halve the concurrency and double the delay, at most once per window
+    """
+
+    def __init__(self, concurrency, max_concurrency, min_delay, max_delay, target_latency, smoothing=0.2):
+
+        self.concurrency = float(concurrency)
+        self.max_concurrency = max_concurrency
+        self.delay = min_delay
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.target_latency = target_latency
+        self.smoothing = smoothing
+        self.latency = None
+        self.error_rate = 0.0
+        self.responses = 0
+        self.bans = 0
+        self.errors = 0
+        self.last_decrease = float('-inf')
+
+    def success(self, latency):
+
+        self.responses += 1
+        self.latency = latency if self.latency is None else (1 - self.smoothing) * self.latency + self.smoothing * latency
+        self.error_rate *= (1 - self.smoothing)
+        if self.latency <= self.target_latency:
+            self.concurrency = min(self.max_concurrency, self.concurrency + 1 / self.concurrency)
+            self.delay = max(self.min_delay, self.delay * 0.9)
+        else:
+            self.delay = min(self.max_delay, max(self.delay, self.latency - self.target_latency))
+
+    def failure(self, ban):
+
+        self.responses += 1
+        if ban:
+            self.bans += 1
+        else:
+            self.errors += 1
+        self.error_rate = (1 - self.smoothing) * self.error_rate + self.smoothing
+
+        # Only one decrease per window : the failures of requests already in flight are the same congestion event
+        now = time.monotonic()
+        if now - self.last_decrease < max(self.delay, self.latency or 0, 1.0):
+            return
+        self.last_decrease = now
+        self.concurrency = max(1.0, self.concurrency / 2)
+        self.delay = min(self.max_delay, max(2 * self.delay, 1.0))
+
+    def hold(self, seconds):
+        """ Delays the next requests of the class by seconds at least (backoff of a retry), until successes shrink the delay again """
+
+        self.delay = min(self.max_delay, max(self.delay, seconds))
+
+    def summary(self):
+        return dict(responses=self.responses, bans=self.bans, errors=self.errors, concurrency=int(self.concurrency),
+                    delay=round(self.delay, 3), latency=None if self.latency is None else round(self.latency, 3),
+                    error_rate=round(self.error_rate, 3))
+
+
+class AdaptiveDownloaderMiddleware(object):
+    """ Adapts concurrency and delay per endpoint class (listing, review and profile pages) and retries failed requests
+        - each class gets its own download slot, whose concurrency and delay follow its EndpointState
+        - bans and server errors are retried ADAPTIVE_MAX_RETRIES times, the exponential backoff (or Retry-After) is applied as
+          the delay of the class slot : retries wait in the scheduler and the slot, never holding a request of another class
+        - a ban page still served after the last retry is dropped (IgnoreRequest), so that the spider never parses it
+        - retried requests lose priority, and profile requests have a lower priority than reviews (set by the spider)
+        - replaces Scrapy's RetryMiddleware, disabled in settings.py
+    """
+
+    # URL part -> endpoint class
+    ENDPOINTS = [('/Profile/', 'profile'), ('/ShowUserReviews-', 'review'), ('/Restaurant_Review-', 'listing'), ('/Restaurants-', 'listing')]
+    BAN_STATUSES = {403, 429}
+    RETRY_STATUSES = {403, 429, 500, 502, 503, 504, 522, 524, 408}
+
+    def __init__(self, crawler):
+
+        settings = crawler.settings
+        self.crawler = crawler
+        self.start_concurrency = settings.getint('ADAPTIVE_START_CONCURRENCY', 4)
+        self.max_concurrency = settings.getint('ADAPTIVE_MAX_CONCURRENCY', 16)
+        self.min_delay = settings.getfloat('ADAPTIVE_MIN_DELAY', 0)
+        self.max_delay = settings.getfloat('ADAPTIVE_MAX_DELAY', 60)
+        self.target_latency = settings.getfloat('ADAPTIVE_TARGET_LATENCY', 2)
+        self.max_retries = settings.getint('ADAPTIVE_MAX_RETRIES', 5)
+        self.backoff_base = settings.getfloat('ADAPTIVE_BACKOFF_BASE', 1)
+        self.backoff_max = settings.getfloat('ADAPTIVE_BACKOFF_MAX', 120)
+        self.ban_markers = [marker.encode() for marker in settings.getlist('ADAPTIVE_BAN_MARKERS', ['captcha-delivery', 'g-recaptcha'])]
+        self.states = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        s = cls(crawler)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        return s
+
+    def endpoint(self, request):
+        if request.meta.get('browser'):
+            return None
+        for url_part, endpoint in self.ENDPOINTS:
+            if url_part in request.url:
+                return endpoint
+        return None
+
+    def state(self, endpoint):
+        if endpoint not in self.states:
+            self.states[endpoint] = EndpointState(self.start_concurrency, self.max_concurrency, self.min_delay,
+                                                  self.max_delay, self.target_latency)
+        return self.states[endpoint]
+
+    def update_slot(self, endpoint):
+        """ Applies the state of the endpoint class to its download slot """
+
+        slot = self.crawler.engine.downloader.slots.get('endpoint_' + endpoint)
+        if slot is not None:
+            state = self.states[endpoint]
+            slot.concurrency = int(state.concurrency)
+            slot.delay = state.delay
+
+    def backoff(self, retries, retry_after=None):
+        """ Seconds to wait before retry number retries : exponential backoff, at least Retry-After (the slot adds its jitter) """
+
+        delay = min(self.backoff_max, self.backoff_base * 2 ** retries)
+        if retry_after is not None:
+            try:
+                delay = max(delay, min(self.backoff_max, float(retry_after)))
+            except ValueError:
+                pass
+        return delay
+
+    def retry(self, request, reason, spider, retry_after=None):
+        """ Returns the retry of request, or None after ADAPTIVE_MAX_RETRIES, and holds its endpoint class for the backoff """
+
+        retries = request.meta.get('adaptive_retries', 0) + 1
+        if retries > self.max_retries:
+            logger.warn(f' > GAVE UP {request.url} AFTER {self.max_retries} RETRIES ({reason})')
+            self.crawler.stats.inc_value('adaptive/gave_up')
+            return None
+
+        retry_request = request.replace(dont_filter=True, priority=request.priority - 1)
+        retry_request.meta['adaptive_retries'] = retries
+        backoff = self.backoff(retries, retry_after)
+        endpoint = self.endpoint(request)
+        if endpoint is not None:
+            self.state(endpoint).hold(backoff)
+            self.update_slot(endpoint)
+        self.crawler.stats.inc_value(f'adaptive/retry/{reason}')
+        logger.debug(f' > RETRY {retries} OF {request.url} IN {backoff:.1f}s ({reason})')
+        return retry_request
+
+    def process_request(self, request, spider):
+
+        endpoint = self.endpoint(request)
+        if endpoint is not None:
+            request.meta.setdefault('download_slot', 'endpoint_' + endpoint)
         return None
 
     def process_response(self, request, response, spider):
-        # Called with the response returned from the downloader.
 
-        # Must either;
-        # - return a Response object
-        # - return a Request object
-        # - or raise IgnoreRequest
+        endpoint = self.endpoint(request)
+        ban = response.status in self.BAN_STATUSES or any(marker in response.body for marker in self.ban_markers)
+
+        if endpoint is not None:
+            state = self.state(endpoint)
+            if ban or response.status >= 500:
+                state.failure(ban)
+            else:
+                state.success(request.meta.get('download_latency', 0))
+            self.update_slot(endpoint)
+
+        if ban or response.status in self.RETRY_STATUSES:
+            reason = 'ban' if ban else str(response.status)
+            retry_request = self.retry(request, reason, spider, response.headers.get('Retry-After', b'').decode() or None)
+            if retry_request is not None:
+                return retry_request
+            # A captcha page may come with a 200 status, it must not reach the spider as a success
+            if ban:
+                raise IgnoreRequest(f'Banned after {self.max_retries} retries: {request.url}')
         return response
 
     def process_exception(self, request, exception, spider):
-        # Called when a download handler or a process_request()
-        # (from other downloader middleware) raises an exception.
 
-        # Must either:
-        # - return None: continue processing this exception
-        # - return a Response object: stops process_exception() chain
-        # - return a Request object: stops process_exception() chain
-        pass
+        # Requests dropped on purpose (e.g. by the replay cache) say nothing about the health of the endpoint
+        if isinstance(exception, IgnoreRequest):
+            return None
 
-    def spider_opened(self, spider):
-        spider.logger.info('Spider opened: %s' % spider.name)
+        endpoint = self.endpoint(request)
+        if endpoint is not None:
+            self.state(endpoint).failure(ban=False)
+            self.update_slot(endpoint)
+        return self.retry(request, type(exception).__name__, spider)
+
+    def spider_closed(self, spider):
+        for endpoint, state in self.states.items():
+            logger.warn(f' > ENDPOINT {endpoint}: {state.summary()}')
+
+
+class BrowserDownloaderMiddleware(object):
+    """ Downloads the requests with meta['browser'] in a pooled headless browser, off the reactor thread
+        - BROWSER_POOL_SIZE sessions at most, each page load limited to BROWSER_PAGE_TIMEOUT seconds
+        - sessions are started on first use and quit when the spider closes
+        - when the spider renders pages (scrap_website_menu), the driver is resolved when the crawl starts, so that a missing
+          driver stops the crawl at once instead of failing every restaurant mid-crawl
+    """
+
+    def __init__(self, pool_size, page_timeout):
+        self.pool = BrowserPool(pool_size, page_timeout)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        s = cls(crawler.settings.getint('BROWSER_POOL_SIZE', 2), crawler.settings.getfloat('BROWSER_PAGE_TIMEOUT', 30))
+        if int(getattr(crawler.spider, 'scrap_website_menu', 0)):
+            logger.info(f' > BROWSER DRIVER: {s.pool.resolve_driver()}')
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        return s
+
+    async def process_request(self, request, spider):
+        if not request.meta.get('browser'):
+            return None
+
+        html = await maybe_deferred_to_future(deferToThread(self.pool.render, request.url))
+        return HtmlResponse(url=request.url, body=html, encoding='utf-8', request=request)
+
+    def spider_closed(self, spider):
+        self.pool.close()
@@ -14,69 +14,247 @@ import logging
 import logzero
 from logzero import logger
 
+import os
+import sys
 import json
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from twisted.internet import task
+from twisted.internet.threads import deferToThread
+from scrapy.exceptions import NotConfigured
 from TA_scrapy.items import RestoItem, ReviewRestoItem, UserItem
+from TA_scrapy.crawl_state import url_path
+from TA_scrapy.shard_writer import ShardWriter, new_shard_id
+from TA_scrapy.cleaning import _init_cleaning_worker, _clean_chunk
 from itemadapter import ItemAdapter
 
 class TaScrapyPipeline(object):
+    """ Writes each item type to its folder through a ShardWriter (batched, rotated, atomically published files)
+        - the crawl state is updated once the part holding an item is published, so that a crash never marks an unsaved item as scraped
+        - a restaurant completed by the spider (see RestaurantProgress) is recorded once all the lines written before are published
+    """
 
-    def __init__(self):
+    # Kind of the crawl state keys of the items of each writer
+    CRAWL_STATE_KINDS = {'restaurant': 'restaurant_item', 'review': 'review'}
+
+    def __init__(self, batch_size=100, flush_seconds=5, rotate_bytes=64 * 2**20, rotate_seconds=300, fsync=True, stats=None):
         
         self.restaurants_folder = 'restaurants/'
         self.reviews_folder = 'reviews/'
         self.users_folder = 'users/'
+        self.writer_settings = dict(batch_size=batch_size, flush_seconds=flush_seconds, rotate_bytes=rotate_bytes,
+                                    rotate_seconds=rotate_seconds, fsync=fsync)
+        # Write time per item kind, reported by CrawlStatsExtension
+        self.stats = stats
         
         logger.info(' > Init TaScrapyPipeline')
 
-    def open_spider(self, spider):
-
-        self.file_reviews = open(spider.directory +  self.reviews_folder + 'reviews_' + str(spider.next_file_id) + '.json', 'w+')
-        logger.info(' Open file reviews.json')
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        return cls(settings.getint('PIPELINE_BATCH_SIZE', 100), settings.getfloat('PIPELINE_FLUSH_SECONDS', 5),
+                   settings.getint('PIPELINE_ROTATE_BYTES', 64 * 2**20), settings.getfloat('PIPELINE_ROTATE_SECONDS', 300),
+                   settings.getbool('PIPELINE_FSYNC', True), crawler.stats)
 
-        self.file_restaurants = open(spider.directory + self.restaurants_folder + 'restaurants_' + str(spider.next_file_id) + '.json', 'w+')
-        logger.info('Open file restaurants.json')
+    def open_spider(self, spider):
 
+        self.shard_id = new_shard_id()
+        self.writers = {
+            'review': ShardWriter(spider.directory + self.reviews_folder, 'reviews', self.shard_id, **self.writer_settings),
+            'restaurant': ShardWriter(spider.directory + self.restaurants_folder, 'restaurants', self.shard_id, **self.writer_settings),
+        }
         if spider.scrap_user != 0:
-            self.file_users = open(spider.directory + self.users_folder + 'users_' + str(spider.next_file_id) + '.json', 'w+')
-            logger.info('Open file users.json')
+            self.writers['user'] = ShardWriter(spider.directory + self.users_folder, 'users', self.shard_id, **self.writer_settings)
+        logger.info(f' Open writers of shard {self.shard_id}')
+        self.completed_restaurants = []
+
+        # Time thresholds also apply when no item comes in
+        self.flush_loop = task.LoopingCall(self.flush_writers, spider)
+        self.flush_loop.start(self.writer_settings['flush_seconds'], now=False)
 
     def close_spider(self, spider):
 
-        self.file_reviews.close()
-        logger.info('Close file reviews.json')
+        if self.flush_loop.running:
+            self.flush_loop.stop()
+        for kind, writer in self.writers.items():
+            start = time.perf_counter()
+            writer.close()
+            self.record_write_time(kind, time.perf_counter() - start)
+        self.record_published(spider)
+        logger.info(f' Close writers of shard {self.shard_id}')
 
-        self.file_restaurants.close()
-        logger.info('Close file restaurants.json')
+    def flush_writers(self, spider):
+        for kind, writer in self.writers.items():
+            start = time.perf_counter()
+            writer.write_batch()
+            self.record_write_time(kind, time.perf_counter() - start)
+        self.record_published(spider)
 
-        if spider.scrap_user != 0:
-            self.file_users.close()
-            logger.info('Close file users.json')
+    def record_write_time(self, kind, seconds):
+        if self.stats is not None:
+            self.stats.inc_value(f'pipeline/write_seconds/{kind}', seconds)
+            self.stats.inc_value(f'pipeline/write_calls/{kind}')
+
+    def record_published(self, spider):
+        """ Marks the items of the published parts, and the restaurants whose items are all published, as scraped in the crawl state """
+
+        for kind, writer in self.writers.items():
+            keys = writer.pop_published_keys()
+            if not keys:
+                continue
+            if kind == 'user':
+                for username in keys:
+                    spider.user_profiles.saved(username)
+            else:
+                spider.crawl_state.add_many(self.CRAWL_STATE_KINDS[kind], keys)
+
+        # Lines written so far by each writer when the restaurant is seen complete, its items are all among them
+        for key in spider.restaurant_progress.pop_completed():
+            self.completed_restaurants.append((key, {kind: writer.lines_written for kind, writer in self.writers.items()}))
+        published = 0
+        for key, lines_written in self.completed_restaurants:
+            if any(self.writers[kind].lines_published < lines for kind, lines in lines_written.items()):
+                break
+            published += 1
+        if published:
+            spider.crawl_state.add_many('restaurant', [key for key, _ in self.completed_restaurants[:published]])
+            self.completed_restaurants = self.completed_restaurants[published:]
 
     def process_item(self, item, spider):
 
         if isinstance(item, RestoItem):
-            return self.handle_resto_item(item, spider)
+            return self.handle_item('restaurant', item, url_path(item['resto_TA_url']), spider)
 
         if isinstance(item, ReviewRestoItem):
-            return self.handle_review_item(item, spider)
+            return self.handle_item('review', item, url_path(item['review_TA_url']), spider)
 
         if isinstance(item, UserItem):
-            return self.handle_user_item(item, spider)
+            return self.handle_item('user', item, item['username'], spider)
 
 
-    def handle_resto_item(self, item, spider):
+    def handle_item(self, kind, item, key, spider):
+        start = time.perf_counter()
         line = json.dumps(ItemAdapter(item).asdict()) + "\n"
-        self.file_restaurants.write(line)
+        self.writers[kind].write(line, key)
+        self.record_write_time(kind, time.perf_counter() - start)
+        self.record_published(spider)
         return item
 
 
-    def handle_review_item(self, item, spider):
-        line = json.dumps(ItemAdapter(item).asdict()) + "\n"
-        self.file_reviews.write(line)
+class CleaningPipeline(object):
+    """ Cleans and tokenizes reviews while the crawl goes on, with the Cleaner of ../cleaner on a pool of worker processes
+        - comments are sent to the pool by chunks of CLEANER_CHUNK_SIZE (or every CLEANER_FLUSH_SECONDS)
+        - tokens are written to <directory>/tokenized/tokenized_reviews_<shard>.json (or .parquet), published when the crawl ends
+        - disabled unless CLEANER_ENABLED, items are passed on unchanged
+    """
+
+    def __init__(self, cleaner_directory, workers=2, chunk_size=200, flush_seconds=10, output_format='json',
+                 stop_words_filename='custom_stop_words.txt', lemma_cache_size=100000, stats=None):
+
+        if workers <= 0:
+            raise ValueError("workers argument must be strictly positive integer")
+        if chunk_size <= 0:
+            raise ValueError("chunk_size argument must be strictly positive integer")
+
+        self.cleaner_directory = os.path.abspath(cleaner_directory)
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.flush_seconds = flush_seconds
+        self.output_format = output_format
+        self.stop_words_filename = stop_words_filename
+        self.lemma_cache_size = lemma_cache_size
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('CLEANER_ENABLED', False):
+            raise NotConfigured
+        return cls(settings.get('CLEANER_DIRECTORY', '../cleaner/'), settings.getint('CLEANER_WORKERS', 2),
+                   settings.getint('CLEANER_CHUNK_SIZE', 200), settings.getfloat('CLEANER_FLUSH_SECONDS', 10),
+                   settings.get('CLEANER_OUTPUT_FORMAT', 'json'), stats=crawler.stats)
+
+    def open_spider(self, spider):
+
+        # Output writers of the cleaner project (storage.py)
+        sys.path.insert(0, os.path.join(self.cleaner_directory, 'src'))
+        from storage import tokenized_writer, tokenized_filename
+
+        folder = spider.directory + 'tokenized/'
+        os.makedirs(folder, exist_ok=True)
+        filename = tokenized_filename(f'reviews_{new_shard_id()}.json', self.output_format)
+        self.path = folder + filename
+        self.temp_path = folder + '.' + filename + '.tmp'
+        self.writer = tokenized_writer(self.temp_path, self.output_format)
+
+        # Spawned workers : a forked copy of the running reactor is never used
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'),
+                                            initializer=_init_cleaning_worker,
+                                            initargs=(self.cleaner_directory, self.stop_words_filename, self.lemma_cache_size))
+        self.chunk = []
+        self.restaurant_ids = {}
+        self.pending = []
+        self.nb_tokenized = 0
+        self.nb_failed = 0
+
+        self.submit_loop = task.LoopingCall(self.submit_chunk)
+        self.submit_loop.start(self.flush_seconds, now=False)
+        logger.info(f' > CLEANING REVIEWS ON {self.workers} WORKERS INTO {self.path}')
+
+    def process_item(self, item, spider):
+
+        if isinstance(item, ReviewRestoItem):
+            self.chunk.append((item['review_id'], item['comment'] or ''))
+            self.restaurant_ids[item['review_id']] = item['restaurant_id']
+            if len(self.chunk) >= self.chunk_size:
+                self.submit_chunk()
+            self.write_done()
         return item
 
-    
-    def handle_user_item(self, item, spider):
-        line = json.dumps(ItemAdapter(item).asdict()) + "\n"
-        self.file_users.write(line)
-        return item
\ No newline at end of file
+    def submit_chunk(self):
+        if self.chunk:
+            self.pending.append((self.executor.submit(_clean_chunk, self.chunk), len(self.chunk)))
+            self.chunk = []
+
+    def write_done(self):
+        """ Writes the tokens of the chunks already processed by the pool (on the reactor thread, never waiting) """
+
+        still_pending = []
+        for future, size in self.pending:
+            if not future.done():
+                still_pending.append((future, size))
+                continue
+            try:
+                chunk_tokens = future.result()
+            except Exception as error:
+                logger.warn(f' > FAILED TO CLEAN {size} REVIEWS: {type(error).__name__}: {error}')
+                self.nb_failed += size
+                continue
+            start = time.perf_counter()
+            review_ids = [review_id for review_id, _ in chunk_tokens]
+            self.writer.write(review_ids, [self.restaurant_ids.pop(review_id) for review_id in review_ids],
+                              [tokens for _, tokens in chunk_tokens])
+            if self.stats is not None:
+                self.stats.inc_value('pipeline/write_seconds/tokenized', time.perf_counter() - start)
+                self.stats.inc_value('pipeline/write_calls/tokenized')
+            self.nb_tokenized += len(chunk_tokens)
+        self.pending = still_pending
+
+    def close_spider(self, spider):
+
+        if self.submit_loop.running:
+            self.submit_loop.stop()
+        self.submit_chunk()
+
+        # Waits for the pool out of the reactor thread, then writes the last chunks
+        deferred = deferToThread(self.executor.shutdown, wait=True)
+        deferred.addCallback(lambda _: self.finish())
+        return deferred
+
+    def finish(self):
+
+        self.write_done()
+        self.writer.close()
+        os.replace(self.temp_path, self.path)
+        logger.warn(f' > {self.nb_tokenized} REVIEWS TOKENIZED INTO {self.path}, {self.nb_failed} FAILED')
@@ -48,28 +48,75 @@ CONCURRENT_REQUESTS = 16
 
 # Enable or disable spider middlewares
 # See https://docs.scrapy.org/en/latest/topics/spider-middleware.html
-#SPIDER_MIDDLEWARES = {
-#    'TA_scrapy.middlewares.TascrapySpiderMiddleware': 543,
-#}
+SPIDER_MIDDLEWARES = {
+    'TA_scrapy.middlewares.CallbackTimingMiddleware': 950,
+}
 
 # Enable or disable downloader middlewares
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
-#DOWNLOADER_MIDDLEWARES = {
-#    'TA_scrapy.middlewares.TascrapyDownloaderMiddleware': 543,
-#}
+DOWNLOADER_MIDDLEWARES = {
+    'scrapy.downloadermiddlewares.retry.RetryMiddleware': None,
+    'TA_scrapy.middlewares.ReplayCacheMiddleware': 500,
+    'TA_scrapy.middlewares.AdaptiveDownloaderMiddleware': 540,
+    'TA_scrapy.middlewares.BrowserDownloaderMiddleware': 543,
+}
+
+# Record a live crawl ('record') or replay it without network ('replay'), e.g. -s HTTP_CACHE_MODE=replay
+HTTP_CACHE_MODE = 'off'
+HTTP_CACHE_DIR = './http_cache/'
+
+# Concurrency and delay adapted per endpoint class (listing, review and profile pages), within CONCURRENT_REQUESTS
+ADAPTIVE_START_CONCURRENCY = 4
+ADAPTIVE_MAX_CONCURRENCY = 16
+ADAPTIVE_MIN_DELAY = 0
+ADAPTIVE_MAX_DELAY = 60
+ADAPTIVE_TARGET_LATENCY = 2
+# Retries of bans and server errors, the exponential backoff (or Retry-After) delays the slot of the endpoint class
+ADAPTIVE_MAX_RETRIES = 5
+ADAPTIVE_BACKOFF_BASE = 1
+ADAPTIVE_BACKOFF_MAX = 120
+ADAPTIVE_BAN_MARKERS = ['captcha-delivery', 'g-recaptcha']
+
+# Headless browser sessions used for websites and menus (scrap_website_menu=1)
+BROWSER_POOL_SIZE = 2
+BROWSER_PAGE_TIMEOUT = 30
 
 # Enable or disable extensions
 # See https://docs.scrapy.org/en/latest/topics/extensions.html
-#EXTENSIONS = {
-#    'scrapy.extensions.telnet.TelnetConsole': None,
-#}
+EXTENSIONS = {
+    'TA_scrapy.extensions.CrawlStatsExtension': 500,
+}
+
+# Per-callback latency histograms, rates, bytes per page type, pipeline write time and reactor lag,
+# snapshot every CRAWL_STATS_INTERVAL seconds and final report in CRAWL_STATS_DIR (default: <directory>/crawl_stats/)
+CRAWL_STATS_ENABLED = True
+CRAWL_STATS_INTERVAL = 60
+CRAWL_STATS_LAG_INTERVAL = 0.1
+CRAWL_STATS_DIR = None
 
 # Configure item pipelines
 # See https://docs.scrapy.org/en/latest/topics/item-pipeline.html
 ITEM_PIPELINES = {
    'TA_scrapy.pipelines.TaScrapyPipeline': 300,
+   'TA_scrapy.pipelines.CleaningPipeline': 400,
 }
 
+# Pipeline output : items written by batches of PIPELINE_BATCH_SIZE (or every PIPELINE_FLUSH_SECONDS),
+# files published every PIPELINE_ROTATE_BYTES written (or every PIPELINE_ROTATE_SECONDS)
+PIPELINE_BATCH_SIZE = 100
+PIPELINE_FLUSH_SECONDS = 5
+PIPELINE_ROTATE_BYTES = 64 * 2**20
+PIPELINE_ROTATE_SECONDS = 300
+PIPELINE_FSYNC = True
+
+# Reviews cleaned and tokenized during the crawl by the Cleaner of CLEANER_DIRECTORY (e.g. -s CLEANER_ENABLED=1)
+CLEANER_ENABLED = False
+CLEANER_DIRECTORY = '../cleaner/'
+CLEANER_WORKERS = 2
+CLEANER_CHUNK_SIZE = 200
+CLEANER_FLUSH_SECONDS = 10
+CLEANER_OUTPUT_FORMAT = 'json'
+
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/autothrottle.html
 #AUTOTHROTTLE_ENABLED = True
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+
+# Buffered JSON lines writer rotating its output into shards, published atomically
+
+import os
+import time
+import uuid
+import socket
+
+
+def new_shard_id():
+    """ Unique name part of the shards of one crawl : start time, host, process and random suffix (concurrent crawls never collide) """
+    return f"{time.strftime('%Y%m%d%H%M%S')}_{socket.gethostname()}_{os.getpid()}_{uuid.uuid4().hex[:8]}"
+
+
+class ShardWriter(object):
+    """
+    Writes JSON lines to <folder>/<prefix>_<shard_id>_<part>.json
+        - lines are buffered in memory and written in batches (batch_size lines or flush_seconds elapsed), fsynced if fsync
+        - a part is written to a hidden .tmp file and renamed once complete (rotate_bytes written, rotate_seconds elapsed or close)
+          so readers only ever see complete files
+        - each line comes with a key : pop_published_keys() returns the keys of the parts published since the last call,
+          so that the crawl state only records items that are safely on disk
+        - lines_written and lines_published count the lines since the start, parts being published in order, a line is on disk
+          once lines_published reaches the value lines_written had when it was written
+    """
+
+    def __init__(self, folder, prefix, shard_id, batch_size=100, flush_seconds=5, rotate_bytes=64 * 2**20,
+                 rotate_seconds=300, fsync=True):
+
+        if batch_size <= 0:
+            raise ValueError("batch_size argument must be strictly positive integer")
+
+        self.folder = folder
+        self.prefix = prefix
+        self.shard_id = shard_id
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.rotate_bytes = rotate_bytes
+        self.rotate_seconds = rotate_seconds
+        self.fsync = fsync
+
+        self.part = 0
+        self.file = None
+        self.part_bytes = 0
+        self.part_started = None
+        self.part_keys = []
+        self.buffer = []
+        self.buffer_keys = []
+        self.last_flush = time.monotonic()
+        self.published_keys = []
+        self.published_files = []
+        self.lines_written = 0
+        self.lines_published = 0
+
+    def filename(self, part):
+        return os.path.join(self.folder, f'{self.prefix}_{self.shard_id}_{part:05d}.json')
+
+    def temp_filename(self, part):
+        return os.path.join(self.folder, f'.{self.prefix}_{self.shard_id}_{part:05d}.json.tmp')
+
+    def write(self, line, key=None):
+        """ Buffers one line, writes the batch and rotates the part when their thresholds are reached """
+
+        self.buffer.append(line)
+        self.buffer_keys.append(key)
+        self.lines_written += 1
+        if len(self.buffer) >= self.batch_size or time.monotonic() - self.last_flush >= self.flush_seconds:
+            self.write_batch()
+
+    def write_batch(self):
+
+        self.last_flush = time.monotonic()
+        if not self.buffer:
+            # A part that receives no new line is still published once rotate_seconds old (periodic flush of a quiet crawl)
+            if self.file is not None and time.monotonic() - self.part_started >= self.rotate_seconds:
+                self.publish()
+            return
+
+        if self.file is None:
+            self.part += 1
+            self.file = open(self.temp_filename(self.part), 'w')
+            self.part_bytes = 0
+            self.part_started = time.monotonic()
+
+        data = ''.join(self.buffer)
+        self.file.write(data)
+        self.file.flush()
+        if self.fsync:
+            os.fsync(self.file.fileno())
+        self.part_bytes += len(data.encode('utf-8'))
+        self.part_keys.extend(self.buffer_keys)
+        self.buffer = []
+        self.buffer_keys = []
+
+        if self.part_bytes >= self.rotate_bytes or time.monotonic() - self.part_started >= self.rotate_seconds:
+            self.publish()
+
+    def publish(self):
+        """ Closes the current part and renames it to its final name """
+
+        if self.file is None:
+            return
+        self.file.close()
+        self.file = None
+        os.replace(self.temp_filename(self.part), self.filename(self.part))
+        self.published_files.append(self.filename(self.part))
+        self.published_keys.extend(key for key in self.part_keys if key is not None)
+        self.lines_published += len(self.part_keys)
+        self.part_keys = []
+
+    def pop_published_keys(self):
+        """ Returns (and forgets) the keys of the lines published since the last call """
+
+        keys = self.published_keys
+        self.published_keys = []
+        return keys
+
+    def close(self):
+        """ Writes the remaining lines and publishes the last part """
+
+        self.write_batch()
+        self.publish()
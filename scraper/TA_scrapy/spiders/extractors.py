@@ -0,0 +1,137 @@
+################################################################################################
+################################################################################################
+#                                       EXTRACTORS
+################################################################################################
+################################################################################################
+
+# Every field read by the spider is a precompiled lxml XPath with an ordered fallback chain, evaluated once per response
+
+from collections import Counter
+
+from lxml import etree
+
+
+class Field(object):
+    """ One field and its fallback XPaths, tried in order until one matches
+        - kind : 'first' (first string or None), 'all' (list of strings), 'nodes' (list of elements) or 'exists' (bool)
+    """
+
+    def __init__(self, name, *xpaths, kind='first'):
+
+        if kind not in ('first', 'all', 'nodes', 'exists'):
+            raise ValueError("kind argument must be 'first', 'all', 'nodes' or 'exists'")
+
+        self.name = name
+        self.xpaths = xpaths
+        self.compiled = [etree.XPath(xpath) for xpath in xpaths]
+        self.kind = kind
+
+    def evaluate(self, root):
+        """ Returns the value of the field and the index of the fallback that matched (None if none did) """
+
+        for index, xpath in enumerate(self.compiled):
+            result = xpath(root)
+            if result:
+                if self.kind == 'first':
+                    return str(result[0]), index
+                if self.kind == 'all':
+                    return [str(value) for value in result], index
+                if self.kind == 'nodes':
+                    return result, index
+                return True, index
+
+        return (None if self.kind == 'first' else False if self.kind == 'exists' else []), None
+
+
+class Extractor(object):
+    """ Set of fields of one kind of page (or of one block of a page)
+        - extract() evaluates each field exactly once and counts which fallback matched (index, or None if missing)
+    """
+
+    def __init__(self, name, fields):
+
+        self.name = name
+        self.fields = fields
+        self.flags = {field.name for field in fields if field.kind == 'exists'}
+        self.matches = Counter()
+
+    def extract(self, root):
+        """ Returns a dict field -> value from a lxml element (response.selector.root or a block of it) """
+
+        values = {}
+        for field in self.fields:
+            values[field.name], index = field.evaluate(root)
+            self.matches[(field.name, index)] += 1
+        return values
+
+    def extract_response(self, response):
+        return self.extract(response.selector.root)
+
+    def fallback_report(self):
+        """ Fields that needed a fallback or were missing : {field: {fallback index or 'missing': count}} (absent flags are not missing) """
+
+        report = {}
+        for (name, index), count in sorted(self.matches.items(), key=lambda match: (match[0][0], str(match[0][1]))):
+            if index != 0 and not (index is None and name in self.flags):
+                report.setdefault(name, {})['missing' if index is None else index] = count
+        return report
+
+
+EXTRACTORS = {
+    'main_search_page': Extractor('main_search_page', [
+        Field('resto_urls', '//a[@class="_15_ydu6b"]/@href', kind='all'),
+        Field('next_links', '//*[@id="EATERY_LIST_CONTENTS"]/div/div/a', kind='nodes'),
+    ]),
+    'review_page_urls': Extractor('review_page_urls', [
+        Field('review_urls', '//div[@class="quote"]/a/@href', kind='all'),
+    ]),
+    'review_page': Extractor('review_page', [
+        Field('review_blocks', '//div[contains(@class, "review-container")]', kind='nodes'),
+        Field('next_page', '//*[@id="taplc_location_reviews_list_resp_rr_resp_0"]/div/div/div/div/a[2]/@href'),
+        Field('next_page_number', '//*[@id="taplc_location_reviews_list_resp_rr_resp_0"]/div/div/div/div/a[2]/@data-page-number'),
+    ]),
+    'review_block': Extractor('review_block', [
+        Field('url', './/div[@class="quote"]/a/@href'),
+        Field('username', './/div[contains(@class, "info_text")]/div/text()'),
+        Field('date_of_visit', './/div[@class="prw_rup prw_reviews_stay_date_hsx"]/text()'),
+        Field('date_of_review', './/span[contains(@class, "ratingDate")]/@title'),
+        Field('rating', './/span[contains(@class, "ui_bubble_rating")]/@class'),
+        Field('title', './/div[@class="quote"]/a/span/text()'),
+        Field('comment', '(.//p[@class="partial_entry"])[1]/text()', kind='all'),
+        Field('truncated', '(.//p[@class="partial_entry"])[1]/span[contains(@class, "ulBlueLinks")]', kind='exists'),
+    ]),
+    'single_review_page': Extractor('single_review_page', [
+        Field('username', '//div[@class="username mo"]/span/text()'),
+        Field('date_of_visit', '//div[@class="prw_rup prw_reviews_stay_date_hsx"]/text()'),
+        Field('date_of_review', '//span[@class="ratingDate relativeDate"]/@title', '//span[@class="ratingDate"]/@title'),
+        Field('rating', '//div[@class="rating reviewItemInline"]/span[1]/@class'),
+        Field('title', '//div[@class="quote"]/a/span/text()'),
+        Field('comment', '(//p[@class="partial_entry"])[1]/text()', kind='all'),
+    ]),
+    'resto_page': Extractor('resto_page', [
+        Field('name', '//h1[@class="_3a1XQ88S"]/text()'),
+        Field('nb_reviews', '//div[@class="_1ud-0ITN"]/span/a/span/text()'),
+        Field('price_cuisine', '//span[@class="_13OzAOXO _34GKdBMV"]//a/text()', kind='all'),
+        Field('phone_number', '//div[@class="_1ud-0ITN"]/span/span/span/a/text()'),
+        Field('ranking', '//*[@id="component_44"]/div/div[2]/span[2]/a/span/b/span/text()'),
+        Field('ranking_out_of', '//span[@class="_13OzAOXO _2VxaSjVD"]/a/span/text()'),
+        Field('rating', '//div[@class="_1ud-0ITN"]/span/a/svg/@title'),
+        Field('address', '//span[@class="_13OzAOXO _2VxaSjVD"]/span[1]/a/text()'),
+    ]),
+    'resto_rendered_page': Extractor('resto_rendered_page', [
+        Field('website', '//a[contains(@class, "_2wKz--mA")]/@href'),
+        Field('menu', '//span[@class="_13OzAOXO _2VxaSjVD ly1Ix1xT"]/a/@href'),
+    ]),
+    'user_page': Extractor('user_page', [
+        Field('fullname', '//span[@class="_2wpJPTNc _345JQp5A"]/text()'),
+        Field('date_joined', '//span[@class="_1CdMKu4t"]/text()'),
+        Field('location', '//span[@class="_2VknwlEe _3J15flPT default"]/text()'),
+        Field('all_infos', '//a[@class="_1q4H5LOk"]/text()', kind='all'),
+        Field('nb_followers', '//div[@class="_1aVEDY08"][2]/span[@class="iX3IT_XP"]/text()'),
+    ]),
+}
+
+
+def fallback_reports():
+    """ Fallback report of every extractor that was used """
+    return {name: extractor.fallback_report() for name, extractor in EXTRACTORS.items() if extractor.matches}
@@ -1,25 +1,28 @@
+from TA_scrapy.spiders.extractors import EXTRACTORS
+
 ################################################################################################
 ################################################################################################
 #                                       TA NAVIGATION 
 ################################################################################################
 ################################################################################################
 
-def get_urls_resto_in_main_search_page(response):
-    return response.xpath('//a[@class="_15_ydu6b"]/@href').getall()
+# The functions below read pages already extracted once by extractors.EXTRACTORS (dicts field -> value)
+
+def get_urls_resto_in_main_search_page(page):
+    return page['resto_urls']
     
-def get_urls_reviews_in_review_page(response):
-    return response.xpath('//div[@class="quote"]/a/@href').getall()
+def get_urls_reviews_in_review_page(page):
+    return page['review_urls']
     
-def get_urls_next_list_of_restos(response):
-    xpath = '//*[@id="EATERY_LIST_CONTENTS"]/div/div/a'
-    next_page = response.xpath(xpath).css('::attr(href)').extract()[-1]
-    next_page_number = response.xpath(xpath).css('::attr(data-page-number)').extract_first()
+def get_urls_next_list_of_restos(page):
+    links = page['next_links']
+    hrefs = [link.get('href') for link in links if link.get('href') is not None]
+    next_page = hrefs[-1] if hrefs else None
+    next_page_number = next((link.get('data-page-number') for link in links if link.get('data-page-number') is not None), None)
     return next_page, next_page_number
 
-def get_urls_next_list_of_reviews(response):
-    next_page = response.xpath('//*[@id="taplc_location_reviews_list_resp_rr_resp_0"]/div/div/div/div/a[2]/@href').get()
-    next_page_number = response.xpath('//*[@id="taplc_location_reviews_list_resp_rr_resp_0"]/div/div/div/div/a[2]/@data-page-number').get()
-    return next_page, next_page_number
+def get_urls_next_list_of_reviews(page):
+    return page['next_page'], page['next_page_number']
 
 def go_to_next_page(next_page, next_page_number=None, max_page=10, printing=False):
     """ According to next_page, and number of pages to scrap, tells if we should go on or stop.
@@ -60,3 +63,39 @@ def go_to_next_page(next_page, next_page_number=None, max_page=10, printing=Fals
 #                                       REVIEW INFORMATION 
 ################################################################################################
 ################################################################################################
+
+# Fields needed to build a review item, from the listing page or from the single review page
+REVIEW_FIELDS = ['username', 'date_of_visit', 'date_of_review', 'rating', 'title', 'comment']
+
+def get_reviews_in_review_page(page):
+    """ Returns the review blocks (lxml elements) of a review listing page (usually 10 per page) """
+    return page['review_blocks']
+
+def get_review_in_review_page(review, response):
+    """ Extracts the review fields from one review block of a listing page.
+    returns the url of the single review page, the fields (None if not found) and whether the comment is truncated
+
+    - review (Element)      : block returned by get_reviews_in_review_page
+    - response (Response)   : listing page, used to make the review url absolute
+    """
+
+    block = EXTRACTORS['review_block'].extract(review)
+    fields = {field: block[field] for field in REVIEW_FIELDS}
+    fields['rating'] = None if block['rating'] is None else block['rating'][-2]
+    fields['comment'] = ' '.join(block['comment']) if block['comment'] else None
+
+    # Long comments end with a "More" link expanding them with JS : the full text is only on the review page
+    url = block['url']
+    return (None if url is None else response.urljoin(url)), fields, block['truncated']
+
+def get_review_in_single_review_page(response):
+    """ Extracts the review fields from a single review page """
+
+    fields = EXTRACTORS['single_review_page'].extract_response(response)
+    fields['rating'] = None if fields['rating'] is None else fields['rating'][-2]
+    fields['comment'] = ' '.join(fields['comment'])
+    return fields
+
+def is_review_complete(fields, truncated):
+    """ Tells if a review of a listing page can be saved without opening its single review page """
+    return not truncated and all(fields[field] is not None for field in REVIEW_FIELDS)
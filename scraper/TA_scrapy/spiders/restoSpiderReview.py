@@ -1,8 +1,9 @@
 
 from logzero import logger
 import logzero
+import logging
 import glob
-import pandas as pd
+import json
 
 # Scrapy packages
 import scrapy
@@ -10,14 +11,9 @@ import requests
 from scrapy.selector import Selector
 from TA_scrapy.items import ReviewRestoItem, RestoItem, UserItem
 from TA_scrapy.spiders import get_info
-
-# Chromedriver package and options
-from selenium import webdriver
-from webdriver_manager.chrome import ChromeDriverManager
-chrome_options = webdriver.ChromeOptions()
-chrome_options.add_argument('--headless')
-chrome_options.add_argument('--no-sandbox')
-chrome_options.add_argument('--disable-dev-shm-usage')
+from TA_scrapy.spiders.extractors import EXTRACTORS, fallback_reports
+from TA_scrapy.crawl_state import CrawlState, UserProfiles, RestaurantProgress, url_path
+import os
 
 class RestoReviewSpider(scrapy.Spider):
     name = "RestoReviewSpider"
@@ -25,7 +21,7 @@ class RestoReviewSpider(scrapy.Spider):
     def __init__(self, directory='./scraped_data/', 
                 root_url='https://www.tripadvisor.co.uk/Restaurants-g191259-Greater_London_England.html', 
                 debug=0, nb_resto=100, maxpage_reviews=50, 
-                scrap_user=1, scrap_website_menu=0, *args, **kwargs):
+                scrap_user=1, scrap_website_menu=0, user_ttl_days=None, listing_reviews=1, *args, **kwargs):
         
         super(RestoReviewSpider, self).__init__(*args, **kwargs)
 
@@ -35,16 +31,12 @@ class RestoReviewSpider(scrapy.Spider):
             logging.disable(logging.DEBUG)
 
 
-        # Setting the list of already scraped restaurants
-        existing_jsons = glob.glob("./scraped_data/restaurants/*.json")
-        logger.warn(f' > FINDING EXISTING JSONS {existing_jsons}')
-        self.already_scraped_restaurants = []
-        self.next_file_id = len(existing_jsons) + 1
-        for json in existing_jsons:
-            json_df = pd.read_json(json, lines=True)
-            restaurants = json_df['resto_TA_url'].to_list()
-            restaurants = [resto.split("https://www.tripadvisor.co.uk")[1] for resto in restaurants]
-            self.already_scraped_restaurants += restaurants
+        # Setting the store of already scraped restaurants, reviews and users
+        self.crawl_state = CrawlState(directory + 'crawl_state.sqlite')
+        if self.crawl_state.is_new:
+            self.import_existing_jsons(directory)
+        self.user_profiles = UserProfiles(self.crawl_state, user_ttl_days)
+        self.restaurant_progress = RestaurantProgress()
 
         # User defined parameters
         self.directory = directory
@@ -53,13 +45,33 @@ class RestoReviewSpider(scrapy.Spider):
         self.scrap_user = int(scrap_user)
         self.scrap_website_menu = int(scrap_website_menu)
         self.nb_resto = int(nb_resto)
+        self.listing_reviews = int(listing_reviews)
 
         # To track the evolution of scrapping
         self.main_nb = 0
         self.resto_nb = 0
         self.review_nb = 0
+        self.review_pages_nb = 0
         self.restaurants_ids = []
 
+    def import_existing_jsons(self, directory):
+        """ Fills a new crawl state with the restaurants and users of the JSON files of previous crawls (done once) """
+
+        logger.warn(f' > IMPORTING EXISTING JSONS INTO {self.crawl_state.path}')
+        for kind, pattern, field in [('restaurant', 'restaurants/*.json', 'resto_TA_url'), ('user', 'users/*.json', 'username')]:
+            for filename in glob.glob(directory + pattern):
+                with open(filename) as json_file:
+                    keys = [json.loads(line)[field] for line in json_file if line.strip()]
+                if kind == 'restaurant':
+                    keys = [url_path(key) for key in keys]
+                    self.crawl_state.add_many('restaurant_item', keys, scraped_at=os.path.getmtime(filename))
+                self.crawl_state.add_many(kind, keys, scraped_at=os.path.getmtime(filename))
+
+    def closed(self, reason):
+        logger.warn(f' > {self.review_nb} REVIEWS SCRAPED, {self.review_pages_nb} FROM SINGLE REVIEW PAGES')
+        logger.warn(f' > FIELDS FOUND WITH A FALLBACK XPATH OR MISSING: {fallback_reports()}')
+        self.crawl_state.close()
+
     def start_requests(self):
         """ Give the urls to follow to scrapy
         - function automatically called when using "scrapy crawl my_spider"
@@ -77,9 +89,10 @@ class RestoReviewSpider(scrapy.Spider):
         self.main_nb += 1
 
         # Get the list of the 35 restaurants of the page
-        restaurant_urls = get_info.get_urls_resto_in_main_search_page(response)
+        page = EXTRACTORS['main_search_page'].extract_response(response)
+        restaurant_urls = get_info.get_urls_resto_in_main_search_page(page)
         
-        restaurant_new_urls = set(restaurant_urls) - set(self.already_scraped_restaurants)
+        restaurant_new_urls = [url for url in dict.fromkeys(restaurant_urls) if not self.crawl_state.contains('restaurant', url_path(url))]
         logger.warn(f'> FINDING : {len(restaurant_urls) - len(restaurant_new_urls)} RESTAURANTS ALREADY SCRAPED IN THIS PAGE')
 
         # For each url : follow restaurant url to get the reviews
@@ -88,11 +101,12 @@ class RestoReviewSpider(scrapy.Spider):
             self.resto_nb += 1
             if self.resto_nb > self.nb_resto:
                 return None
+            self.restaurant_progress.start(self.resto_nb, url_path(restaurant_url))
             yield response.follow(url=restaurant_url, callback=self.parse_review_page, 
                                   cb_kwargs=dict(restaurant_id=self.resto_nb))
 
         # Get next page information
-        next_page, next_page_number = get_info.get_urls_next_list_of_restos(response)
+        next_page, next_page_number = get_info.get_urls_next_list_of_restos(page)
         
         # Follow the page if we decide to
         if get_info.go_to_next_page(next_page, next_page_number, max_page=None):
@@ -102,52 +116,83 @@ class RestoReviewSpider(scrapy.Spider):
     def parse_review_page(self, response, restaurant_id):
         """ SECOND PARSING : Given a review page, gets each review url and get to parse it
             - Usually there are 10 reviews per page
+            - With listing_reviews, reviews are read on the page, and only opened when truncated or incomplete
         """
 
         logger.info(' > PARSING NEW REVIEW PAGE')
 
-        # Parse the restaurant if it has not been parsed yet
-        if restaurant_id not in self.restaurants_ids:
-            yield self.parse_resto(response, restaurant_id)
+        # Parse the restaurant if it has not been parsed yet (website and menu need the page rendered by a browser),
+        # nor saved by an interrupted crawl of the same restaurant
+        if restaurant_id not in self.restaurants_ids and not self.crawl_state.contains('restaurant_item', url_path(response.url)):
+            resto_item = self.parse_resto(response, restaurant_id)
+            if self.scrap_website_menu:
+                self.restaurant_progress.request(restaurant_id)
+                yield scrapy.Request(url=response.url, callback=self.parse_resto_website_menu, 
+                                     errback=self.parse_resto_website_menu_failure, dont_filter=True,
+                                     meta=dict(browser=True), cb_kwargs=dict(resto_item=resto_item))
+            else:
+                yield resto_item
             self.restaurants_ids.append(restaurant_id)
 
-        # Get the list of reviews on the page
-        urls_review = get_info.get_urls_reviews_in_review_page(response)
+        page = EXTRACTORS['review_page'].extract_response(response)
+        if self.listing_reviews:
+            yield from self.parse_reviews_in_review_page(response, page, restaurant_id)
+        else:
+            # Get the list of reviews on the page
+            urls_review = get_info.get_urls_reviews_in_review_page(EXTRACTORS['review_page_urls'].extract_response(response))
 
-        # For each review open the link and parse it into the parse_review method
-        for url_review in urls_review:
-             yield response.follow(url=url_review, callback=self.parse_review, 
-                                   cb_kwargs=dict(restaurant_id=restaurant_id))
+            # For each review open the link and parse it into the parse_review method
+            for url_review in urls_review:
+                if self.crawl_state.contains('review', url_path(url_review)):
+                    continue
+                self.restaurant_progress.request(restaurant_id)
+                yield response.follow(url=url_review, callback=self.parse_review, 
+                                      cb_kwargs=dict(restaurant_id=restaurant_id))
 
         # Get next page information
-        next_page, next_page_number = get_info.get_urls_next_list_of_reviews(response)
+        next_page, next_page_number = get_info.get_urls_next_list_of_reviews(page)
         
         # Follow the page if we decide to
         if get_info.go_to_next_page(next_page, next_page_number, max_page=self.maxpage_reviews):
+            self.restaurant_progress.request(restaurant_id)
             yield response.follow(next_page, callback=self.parse_review_page, 
                                   cb_kwargs=dict(restaurant_id=restaurant_id))
 
+        # Once its requests are all yielded, so that the restaurant is not completed before its next pages
+        self.restaurant_progress.handled(restaurant_id)
+
+    def parse_reviews_in_review_page(self, response, page, restaurant_id):
+        """ Builds the review items from the review blocks of the page
+            - Opens the single review page only if the comment is truncated or a field is missing
+        """
+
+        for review in get_info.get_reviews_in_review_page(page):
+            url_review, fields, truncated = get_info.get_review_in_review_page(review, response)
+            if url_review is None:
+                logger.debug(' > REVIEW WITHOUT URL SKIPPED')
+                continue
+            if self.crawl_state.contains('review', url_path(url_review)):
+                continue
+            if get_info.is_review_complete(fields, truncated):
+                yield from self.build_review(fields, restaurant_id, url_review)
+            else:
+                self.restaurant_progress.request(restaurant_id)
+                yield response.follow(url=url_review, callback=self.parse_review, 
+                                      cb_kwargs=dict(restaurant_id=restaurant_id))
+
     def parse_resto(self, response, restaurant_id):
         """ Create Restaurant Item saved in specific JSON file """
 
         logger.info(' > PARSING NEW RESTO ({})'.format(restaurant_id - 1))
         
-        xpath_name = '//h1[@class="_3a1XQ88S"]/text()'
-        xpath_nb_reviews = '//div[@class="_1ud-0ITN"]/span/a/span/text()'
-        xpath_price_cuisine = '//span[@class="_13OzAOXO _34GKdBMV"]//a/text()'
-        xpath_phone_number = '//div[@class="_1ud-0ITN"]/span/span/span/a/text()'
-        xpath_website = '//a[@class="_2wKz--mA _15QfMZ2L"]/@data-encoded-url'
-        xpath_ranking = '//*[@id="component_44"]/div/div[2]/span[2]/a/span/b/span/text()'
-        xpath_ranking_out_of = '//span[@class="_13OzAOXO _2VxaSjVD"]/a/span/text()'
-        xpath_rating = '//div[@class="_1ud-0ITN"]/span/a/svg/@title'
-        xpath_address = '//span[@class="_13OzAOXO _2VxaSjVD"]/span[1]/a/text()'
-        
+        page = EXTRACTORS['resto_page'].extract_response(response)
+
         resto_item = RestoItem()
         resto_item['restaurant_id'] = restaurant_id
-        resto_item['name'] = response.xpath(xpath_name).get()
+        resto_item['name'] = page['name']
         resto_item['resto_TA_url'] = response.url
-        resto_item['nb_reviews'] = response.xpath(xpath_nb_reviews).get()
-        price_cuisine = response.xpath(xpath_price_cuisine).getall()
+        resto_item['nb_reviews'] = page['nb_reviews']
+        price_cuisine = page['price_cuisine']
 
         # Retrieve price in the right format
         raw_price = price_cuisine[0]
@@ -159,103 +204,101 @@ class RestoReviewSpider(scrapy.Spider):
         resto_item['min_price'] = len(min_price)
         resto_item['max_price'] = len(max_price)
         resto_item['cuisine'] = price_cuisine[1:]
-        resto_item['address'] = response.xpath(xpath_address).get()
-        resto_item['phone_number'] = response.xpath(xpath_phone_number).get()
-
-        # Scrap websites and menus depending on user input
-        if self.scrap_website_menu:
-            driver = webdriver.Chrome(ChromeDriverManager().install(), chrome_options=chrome_options)
-            driver.get(response.url)
-
-            # Catch website (use Selenium as URL is generated by JS)
-            website = driver.find_element_by_class_name('_2wKz--mA')
-            website_url = website.get_attribute('href') 
-            if website_url is None:
-                resto_item['website'] = 'Website not found'
-            else:
-                resto_item['website'] = website_url
-
-            # Catch menu
-            menu = driver.find_elements_by_xpath('//span[@class="_13OzAOXO _2VxaSjVD ly1Ix1xT"]/a')
-            try:
-                resto_item['menu'] = menu[0].get_attribute('href')
-            except IndexError:
-                resto_item['menu'] = 'Menu not found'
-        else:
-            resto_item['website'] = 'Website not scraped'
-            resto_item['menu'] = 'Menu not scraped'
+        resto_item['address'] = page['address']
+        resto_item['phone_number'] = page['phone_number']
+
+        # Websites and menus are filled by parse_resto_website_menu when scraped
+        resto_item['website'] = 'Website not scraped'
+        resto_item['menu'] = 'Menu not scraped'
             
-        if response.xpath(xpath_ranking).get() is not None and response.xpath(xpath_ranking_out_of).get() is not None:
-            resto_item['ranking'] = response.xpath(xpath_ranking).get() + response.xpath(xpath_ranking_out_of).get()
+        if page['ranking'] is not None and page['ranking_out_of'] is not None:
+            resto_item['ranking'] = page['ranking'] + page['ranking_out_of']
         else:
             resto_item['ranking'] = 'Ranking not found'
 
-        resto_item['rating'] = response.xpath(xpath_rating).get().split()[0]
+        resto_item['rating'] = page['rating'].split()[0]
 
         return resto_item
 
 
+    def parse_resto_website_menu(self, response, resto_item):
+        """ Complete Restaurant Item with website and menu, read on the page rendered by the browser pool (URLs generated by JS) """
+
+        page = EXTRACTORS['resto_rendered_page'].extract_response(response)
+        website_url = page['website']
+        resto_item['website'] = 'Website not found' if website_url is None else website_url
+
+        menu_url = page['menu']
+        resto_item['menu'] = 'Menu not found' if menu_url is None else response.urljoin(menu_url)
+
+        yield resto_item
+        self.restaurant_progress.handled(resto_item['restaurant_id'])
+
+    def parse_resto_website_menu_failure(self, failure):
+        """ Saves the restaurant without website and menu when the browser failed or timed out """
+
+        resto_item = failure.request.cb_kwargs['resto_item']
+        logger.warn(f' > FAILED TO RENDER RESTO PAGE ({resto_item["restaurant_id"]}): {failure.value!r}')
+        yield resto_item
+        self.restaurant_progress.handled(resto_item['restaurant_id'])
+
     def parse_review(self, response, restaurant_id):
         """ FINAL PARSING : Open a specific page with review and client opinion
             - Read these data and store them
             - Get all the data you can find and that you believe interesting
         """
+
+        self.review_pages_nb += 1
+        fields = get_info.get_review_in_single_review_page(response)
+        yield from self.build_review(fields, restaurant_id, response.url)
+        self.restaurant_progress.handled(restaurant_id)
+
+    def build_review(self, fields, restaurant_id, review_url):
+        """ Create Review Item from its fields (read on the listing page or on the single review page) and follow its user """
         
         logger.debug(' > PARSING NEW REVIEW ({})'.format(self.review_nb))
         if self.review_nb % 100 == 0:
             logger.info(' > PARSING NEW REVIEW ({})'.format(self.review_nb))
         self.review_nb += 1
 
-        xpath_username = '//div[@class="username mo"]/span/text()'
-        xpath_date_of_visit = '//div[@class="prw_rup prw_reviews_stay_date_hsx"]/text()'
-        xpath_date_of_review = '//span[@class="ratingDate relativeDate"]/@title'
-        xpath_rating = '//div[@class="rating reviewItemInline"]/span[1]/@class'
-        xpath_title = '//div[@class="quote"]/a/span/text()'
-        xpath_comment = '(//p[@class="partial_entry"])[1]/text()'
-
-        date_of_review = response.xpath(xpath_date_of_review).get()
-        if date_of_review is None:
-            xpath_date_of_review = '//span[@class="ratingDate"]/@title'
-            date_of_review = response.xpath(xpath_date_of_review).get()
-           
-        
         review_item = ReviewRestoItem()
         review_item['review_id'] = self.review_nb
         review_item['restaurant_id'] = restaurant_id
-        username = response.xpath(xpath_username).get()
-        review_item['username'] = username
-        review_item['date_of_visit'] = response.xpath(xpath_date_of_visit).get()
-        review_item['rating'] = response.xpath(xpath_rating).get()[-2]
-        review_item['title'] = response.xpath(xpath_title).get()
-        review_item['comment'] = ' '.join(response.xpath(xpath_comment).getall())
-        review_item['date_of_review'] = date_of_review
+        review_item['review_TA_url'] = review_url
+        for field in get_info.REVIEW_FIELDS:
+            review_item[field] = fields[field]
              
         yield review_item
 
-        # Scrap user if wanted and username in correct format (no spaces)
-        if (self.scrap_user != 0) and (" " not in username):
-            yield response.follow(url="https://www.tripadvisor.co.uk/Profile/" + username, 
-                                  callback=self.parse_user, cb_kwargs=dict(username=username))
+        # Scrap user if wanted, username in correct format (no spaces) and profile not fetched in the refresh window
+        # (profiles after reviews : lower priority)
+        username = fields['username']
+        if (self.scrap_user != 0) and (username is not None) and (" " not in username) and self.user_profiles.should_fetch(username):
+            yield scrapy.Request(url="https://www.tripadvisor.co.uk/Profile/" + username, priority=-10,
+                                 callback=self.parse_user, errback=self.parse_user_failure,
+                                 cb_kwargs=dict(username=username))
+
+    def parse_user_failure(self, failure):
+        """ Releases the username of a failed profile request """
+
+        username = failure.request.cb_kwargs['username']
+        logger.warn(f' > FAILED TO FETCH PROFILE ({username}): {failure.value!r}')
+        self.user_profiles.failed(username)
 
 
     def parse_user(self, response, username):
         """ Create User Item saved in specific JSON file """
         
-        xpath_fullname = '//span[@class="_2wpJPTNc _345JQp5A"]/text()'
-        xpath_date_joined = '//span[@class="_1CdMKu4t"]/text()'
-        xpath_all = '//a[@class="_1q4H5LOk"]/text()'
-        xpath_nb_followers = '//div[@class="_1aVEDY08"][2]/span[@class="iX3IT_XP"]/text()'
-        xpath_nb_following = '//div[@class="_1aVEDY08"][3]/span[@class="iX3IT_XP"]/text()'
-        xpath_location = '//span[@class="_2VknwlEe _3J15flPT default"]/text()'
+        page = EXTRACTORS['user_page'].extract_response(response)
 
         user_item = UserItem()
         user_item['username'] = username
-        user_item['fullname'] = response.xpath(xpath_fullname).get()
-        user_item['date_joined'] = response.xpath(xpath_date_joined).get()
-        user_item['location'] = response.xpath(xpath_location).get()
+        user_item['fullname'] = page['fullname']
+        user_item['date_joined'] = page['date_joined']
+        user_item['location'] = page['location']
 
         # Retrieve info about nb of contributions, nb of followers and nb of following
-        all_infos = response.xpath(xpath_all).getall()
+        all_infos = page['all_infos']
         
         # Assign info to correct field
         if len(all_infos) == 3:
@@ -264,7 +307,7 @@ class RestoReviewSpider(scrapy.Spider):
             user_item['nb_following'] = int(all_infos[2].replace(',',''))
         elif len(all_infos) == 2:
             user_item['nb_contributions'] = int(all_infos[0].replace(',',''))
-            nb_followers = response.xpath(xpath_nb_followers).get()
+            nb_followers = page['nb_followers']
             if nb_followers is None:
                 user_item['nb_followers'] = int(all_infos[1].replace(',',''))
                 user_item['nb_following'] = 0
@@ -0,0 +1,184 @@
+import argparse
+import glob
+import time
+
+from scrapy.http import HtmlResponse
+
+from TA_scrapy.http_cache import HttpCache
+from TA_scrapy.spiders.extractors import EXTRACTORS
+
+
+def legacy_main_search_page(response):
+    """ Main search page parsing before the extractor registry (next page XPath evaluated twice) """
+
+    xpath = '//*[@id="EATERY_LIST_CONTENTS"]/div/div/a'
+    resto_urls = response.xpath('//a[@class="_15_ydu6b"]/@href').getall()
+    next_pages = response.xpath(xpath).css('::attr(href)').extract()
+    next_page_number = response.xpath(xpath).css('::attr(data-page-number)').extract_first()
+    return resto_urls, next_pages[-1] if next_pages else None, next_page_number
+
+
+def legacy_review_page(response):
+    """ Review listing page parsing before the extractor registry (string XPaths evaluated by parsel on each block) """
+
+    reviews = []
+    for review in response.xpath('//div[contains(@class, "review-container")]'):
+        comment = review.xpath('(.//p[@class="partial_entry"])[1]/text()').getall()
+        reviews.append([
+            review.xpath('.//div[@class="quote"]/a/@href').get(),
+            review.xpath('.//div[contains(@class, "info_text")]/div/text()').get(),
+            review.xpath('.//div[@class="prw_rup prw_reviews_stay_date_hsx"]/text()').get(),
+            review.xpath('.//span[contains(@class, "ratingDate")]/@title').get(),
+            review.xpath('.//span[contains(@class, "ui_bubble_rating")]/@class').get(),
+            review.xpath('.//div[@class="quote"]/a/span/text()').get(),
+            comment,
+            review.xpath('(.//p[@class="partial_entry"])[1]/span[contains(@class, "ulBlueLinks")]').get() is not None,
+        ])
+    next_page = response.xpath('//*[@id="taplc_location_reviews_list_resp_rr_resp_0"]/div/div/div/div/a[2]/@href').get()
+    next_page_number = response.xpath('//*[@id="taplc_location_reviews_list_resp_rr_resp_0"]/div/div/div/div/a[2]/@data-page-number').get()
+    return reviews, next_page, next_page_number
+
+
+def legacy_single_review_page(response):
+    """ Single review page parsing before the extractor registry (date of review fallback evaluated inline) """
+
+    date_of_review = response.xpath('//span[@class="ratingDate relativeDate"]/@title').get()
+    if date_of_review is None:
+        date_of_review = response.xpath('//span[@class="ratingDate"]/@title').get()
+    return [
+        response.xpath('//div[@class="username mo"]/span/text()').get(),
+        response.xpath('//div[@class="prw_rup prw_reviews_stay_date_hsx"]/text()').get(),
+        date_of_review,
+        response.xpath('//div[@class="rating reviewItemInline"]/span[1]/@class').get(),
+        response.xpath('//div[@class="quote"]/a/span/text()').get(),
+        response.xpath('(//p[@class="partial_entry"])[1]/text()').getall(),
+    ]
+
+
+def legacy_resto_page(response):
+    """ Restaurant page parsing before the extractor registry (ranking XPaths evaluated twice) """
+
+    xpath_ranking = '//*[@id="component_44"]/div/div[2]/span[2]/a/span/b/span/text()'
+    xpath_ranking_out_of = '//span[@class="_13OzAOXO _2VxaSjVD"]/a/span/text()'
+    values = [
+        response.xpath('//h1[@class="_3a1XQ88S"]/text()').get(),
+        response.xpath('//div[@class="_1ud-0ITN"]/span/a/span/text()').get(),
+        response.xpath('//span[@class="_13OzAOXO _34GKdBMV"]//a/text()').getall(),
+        response.xpath('//span[@class="_13OzAOXO _2VxaSjVD"]/span[1]/a/text()').get(),
+        response.xpath('//div[@class="_1ud-0ITN"]/span/span/span/a/text()').get(),
+        response.xpath('//div[@class="_1ud-0ITN"]/span/a/svg/@title').get(),
+    ]
+    if response.xpath(xpath_ranking).get() is not None and response.xpath(xpath_ranking_out_of).get() is not None:
+        values.append(response.xpath(xpath_ranking).get() + response.xpath(xpath_ranking_out_of).get())
+    return values
+
+
+def legacy_user_page(response):
+    """ User page parsing before the extractor registry """
+
+    values = [
+        response.xpath('//span[@class="_2wpJPTNc _345JQp5A"]/text()').get(),
+        response.xpath('//span[@class="_1CdMKu4t"]/text()').get(),
+        response.xpath('//span[@class="_2VknwlEe _3J15flPT default"]/text()').get(),
+    ]
+    all_infos = response.xpath('//a[@class="_1q4H5LOk"]/text()').getall()
+    if len(all_infos) == 2:
+        values.append(response.xpath('//div[@class="_1aVEDY08"][2]/span[@class="iX3IT_XP"]/text()').get())
+    return values + all_infos
+
+
+def registry_review_page(response):
+    page = EXTRACTORS['review_page'].extract_response(response)
+    return [EXTRACTORS['review_block'].extract(review) for review in page['review_blocks']], page
+
+
+LEGACY_PARSERS = {
+    'main_search_page': legacy_main_search_page,
+    'review_page': legacy_review_page,
+    'single_review_page': legacy_single_review_page,
+    'resto_page': legacy_resto_page,
+    'user_page': legacy_user_page,
+}
+
+REGISTRY_PARSERS = {
+    'main_search_page': EXTRACTORS['main_search_page'].extract_response,
+    'review_page': registry_review_page,
+    'single_review_page': EXTRACTORS['single_review_page'].extract_response,
+    'resto_page': EXTRACTORS['resto_page'].extract_response,
+    'user_page': EXTRACTORS['user_page'].extract_response,
+}
+
+
+def load_pages(pattern):
+    """ Loads saved HTML pages as responses, parsed once beforehand so that only field extraction is timed """
+
+    responses = []
+    for filename in sorted(glob.glob(pattern)):
+        with open(filename, 'rb') as html_file:
+            response = HtmlResponse(url='https://www.tripadvisor.co.uk/' + filename, body=html_file.read(), encoding='utf-8')
+        response.selector
+        responses.append(response)
+    return responses
+
+
+def load_cached_pages(directory, url_part):
+    """ Loads the responses of a recorded crawl (HTTP_CACHE_MODE=record) whose url contains url_part """
+
+    cache = HttpCache(directory)
+    fingerprints = [row[0] for row in cache.connection.execute('SELECT fingerprint FROM responses WHERE url LIKE ?', (f'%{url_part}%',))]
+    responses = []
+    for fingerprint in fingerprints:
+        response = cache.retrieve(fingerprint, None)
+        if isinstance(response, HtmlResponse):
+            response.selector
+            responses.append(response)
+    cache.close()
+    return responses
+
+
+def bench_parsing(pattern, kind, repeat=10, cache_directory=None, url_part=''):
+    """ Compares per-response extraction CPU time of the inline XPaths and the precompiled extractor registry
+        - pages are saved HTML files (pattern) or responses of a recorded crawl (cache_directory)
+    """
+
+    responses = load_pages(pattern) if cache_directory is None else load_cached_pages(cache_directory, url_part)
+    if not responses:
+        raise ValueError('no saved page found')
+
+    start = time.process_time()
+    for _ in range(repeat):
+        for response in responses:
+            LEGACY_PARSERS[kind](response)
+    legacy_elapsed = time.process_time() - start
+
+    start = time.process_time()
+    for _ in range(repeat):
+        for response in responses:
+            REGISTRY_PARSERS[kind](response)
+    elapsed = time.process_time() - start
+
+    nb_responses = len(responses) * repeat
+    print(f'pages={len(responses)} repeat={repeat}')
+    print(f'inline xpaths : {legacy_elapsed / nb_responses * 1e6:10.1f} us/response')
+    print(f'registry      : {elapsed / nb_responses * 1e6:10.1f} us/response  speedup=x{legacy_elapsed / elapsed:.1f}')
+    print(f'fallbacks     : {EXTRACTORS[kind].fallback_report()}')
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Benchmarks of the scraper")
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    parser_parsing = subparsers.add_parser('parsing', help='per-response CPU time of field extraction on saved pages')
+    parser_parsing.add_argument('-p', '--pages', type=str, default=None, help='glob pattern of the saved HTML pages')
+    parser_parsing.add_argument('-c', '--cache', type=str, default=None, help='HTTP_CACHE_DIR of a recorded crawl, instead of --pages')
+    parser_parsing.add_argument('-u', '--url_part', type=str, default='', help='with --cache, only pages whose url contains it (e.g. /Restaurant_Review-)')
+    parser_parsing.add_argument('-k', '--kind', type=str, required=True, choices=list(LEGACY_PARSERS), help='kind of the saved pages')
+    parser_parsing.add_argument('-r', '--repeat', type=int, default=10, help='number of passes over the pages')
+
+    args = parser.parse_args()
+
+    if args.benchmark == 'parsing':
+        if (args.pages is None) == (args.cache is None):
+            parser.error('parsing needs either --pages or --cache')
+        bench_parsing(args.pages, args.kind, args.repeat, args.cache, args.url_part)
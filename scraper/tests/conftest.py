@@ -0,0 +1,36 @@
+import os
+import sys
+
+import pytest
+
+from scrapy.http import HtmlResponse
+
+# The tests import the TA_scrapy package of this directory, as scrapy does when run from it
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def load_response(filename, url):
+    """ HtmlResponse of a saved page of the fixtures directory """
+
+    with open(os.path.join(FIXTURES, filename), 'rb') as page_file:
+        return HtmlResponse(url=url, body=page_file.read(), encoding='utf-8')
+
+
+@pytest.fixture
+def spider_factory(tmp_path):
+    """ Builds RestoReviewSpider instances whose crawl state lives in a temporary directory """
+
+    from TA_scrapy.spiders.restoSpiderReview import RestoReviewSpider
+
+    spiders = []
+
+    def build(**kwargs):
+        spider = RestoReviewSpider(directory=str(tmp_path) + '/', **kwargs)
+        spiders.append(spider)
+        return spider
+
+    yield build
+    for spider in spiders:
+        spider.crawl_state.close()
@@ -0,0 +1,163 @@
+from types import SimpleNamespace
+
+import pytest
+
+from scrapy.exceptions import IgnoreRequest
+from scrapy.http import HtmlResponse, Request
+from scrapy.utils.test import get_crawler
+from twisted.internet.error import TimeoutError
+
+from TA_scrapy import middlewares
+from TA_scrapy.middlewares import AdaptiveDownloaderMiddleware, EndpointState
+
+
+REVIEW_URL = 'https://www.tripadvisor.co.uk/ShowUserReviews-g186338-d1234567-r700000001-The_Test_Kitchen-London_England.html'
+
+
+class Clock(object):
+    """ Replaces time.monotonic in middlewares, advanced by hand """
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(middlewares.time, 'monotonic', clock)
+    return clock
+
+
+def test_success_increases_concurrency_additively():
+
+    state = EndpointState(4, 16, 0, 60, target_latency=2)
+    state.success(0.5)
+    assert state.concurrency == pytest.approx(4.25)
+
+    for _ in range(200):
+        state.success(0.5)
+    assert state.concurrency == 16
+    assert state.delay == 0
+
+
+def test_slow_responses_raise_delay_without_more_concurrency():
+
+    state = EndpointState(4, 16, 0, 60, target_latency=2, smoothing=1)
+    state.success(5)
+    assert state.concurrency == 4
+    assert state.delay == pytest.approx(3)
+
+
+def test_failures_decrease_multiplicatively_once_per_window(clock):
+
+    state = EndpointState(8, 16, 0, 60, target_latency=2)
+    state.failure(ban=True)
+    assert (state.concurrency, state.delay) == (4, 1.0)
+
+    # Failures of requests already in flight belong to the same congestion event
+    state.failure(ban=True)
+    state.failure(ban=False)
+    assert (state.concurrency, state.delay) == (4, 1.0)
+    assert (state.bans, state.errors) == (2, 1)
+
+    clock.now += 1
+    state.failure(ban=True)
+    assert (state.concurrency, state.delay) == (2, 2.0)
+
+    clock.now += 2
+    for _ in range(3):
+        state.failure(ban=True)
+        clock.now += 60
+    assert state.concurrency == 1
+    assert state.delay == 16.0
+
+
+def test_delay_is_capped(clock):
+
+    state = EndpointState(4, 16, 0, 5, target_latency=2)
+    for _ in range(10):
+        state.failure(ban=True)
+        clock.now += 60
+    assert state.delay == 5
+
+
+def middleware(**settings):
+    crawler = get_crawler(settings_dict=dict(ADAPTIVE_BACKOFF_BASE=0, **settings))
+    slot = SimpleNamespace(concurrency=4, delay=0)
+    crawler.engine = SimpleNamespace(downloader=SimpleNamespace(slots={'endpoint_review': slot}))
+    return AdaptiveDownloaderMiddleware(crawler), slot
+
+
+def response(request, status=200, body=b'<html></html>', headers=None):
+    return HtmlResponse(url=request.url, status=status, body=body, headers=headers, request=request)
+
+
+def test_middleware_adapts_slot_to_bans_and_successes(clock):
+
+    adaptive, slot = middleware()
+    request = Request(REVIEW_URL, meta={'download_latency': 0.1})
+
+    # 429 : retried, slot halved and delayed by its Retry-After
+    retry = adaptive.process_response(request, response(request, 429, headers={'Retry-After': '7'}), None)
+    assert isinstance(retry, Request)
+    assert retry.meta['adaptive_retries'] == 1
+    assert retry.priority == request.priority - 1
+    assert (slot.concurrency, slot.delay) == (2, 7)
+
+    # Captcha page served with a 200 is a ban too
+    clock.now += 8
+    retry = adaptive.process_response(request, response(request, body=b'<div class="g-recaptcha"></div>'), None)
+    assert isinstance(retry, Request)
+    assert (slot.concurrency, slot.delay) == (1, 14)
+
+    # Fast 200 responses grow the concurrency back and shrink the delay
+    ok = response(request)
+    for _ in range(20):
+        assert adaptive.process_response(request, ok, None) is ok
+    assert slot.concurrency > 1
+    assert slot.delay < 14
+    assert adaptive.states['review'].bans == 2
+
+
+def test_middleware_gives_up_after_max_retries(clock):
+
+    adaptive, slot = middleware(ADAPTIVE_MAX_RETRIES=1)
+    request = Request(REVIEW_URL, meta={'adaptive_retries': 1})
+
+    # Server errors are passed on (and filtered by HttpErrorMiddleware), ban pages never reach the spider
+    failed = response(request, 503)
+    assert adaptive.process_response(request, failed, None) is failed
+    with pytest.raises(IgnoreRequest):
+        adaptive.process_response(request, response(request, 429), None)
+    with pytest.raises(IgnoreRequest):
+        adaptive.process_response(request, response(request, body=b'<div class="g-recaptcha"></div>'), None)
+
+
+def test_review_pages_and_listings_get_their_own_slots():
+
+    adaptive, slot = middleware()
+    listing = Request('https://www.tripadvisor.co.uk/Restaurant_Review-g186338-d1234567-Reviews-or10-The_Test_Kitchen.html')
+    review = Request(REVIEW_URL)
+    adaptive.process_request(listing, None)
+    adaptive.process_request(review, None)
+    assert listing.meta['download_slot'] == 'endpoint_listing'
+    assert review.meta['download_slot'] == 'endpoint_review'
+
+
+def test_ignored_requests_leave_endpoint_state_unchanged(clock):
+
+    adaptive, slot = middleware()
+    request = Request(REVIEW_URL)
+
+    assert adaptive.process_exception(request, IgnoreRequest(), None) is None
+    assert adaptive.states == {}
+    assert (slot.concurrency, slot.delay) == (4, 0)
+
+    # Download errors do count, and are retried
+    retry = adaptive.process_exception(request, TimeoutError(), None)
+    assert retry.meta['adaptive_retries'] == 1
+    assert adaptive.states['review'].errors == 1
+    assert (slot.concurrency, slot.delay) == (2, 1.0)
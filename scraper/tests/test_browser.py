@@ -0,0 +1,66 @@
+from types import SimpleNamespace
+
+import pytest
+
+from scrapy.utils.test import get_crawler
+
+from TA_scrapy import browser
+from TA_scrapy.middlewares import BrowserDownloaderMiddleware
+
+
+class DriverManager(object):
+    """ Replaces ChromeDriverManager, install() returns path or raises error """
+
+    def __init__(self, path=None, error=None):
+        self.path = path
+        self.error = error
+        self.installs = 0
+
+    def __call__(self):
+        return self
+
+    def install(self):
+        self.installs += 1
+        if self.error is not None:
+            raise self.error
+        return self.path
+
+
+def crawler(scrap_website_menu):
+    crawler = get_crawler()
+    crawler.spider = SimpleNamespace(scrap_website_menu=scrap_website_menu)
+    return crawler
+
+
+def test_driver_resolved_at_startup(monkeypatch, tmp_path):
+
+    driver_path = tmp_path / 'chromedriver'
+    driver_path.write_text('#!/bin/sh\n')
+    driver_path.chmod(0o755)
+    manager = DriverManager(path=str(driver_path))
+    monkeypatch.setattr(browser, 'ChromeDriverManager', manager)
+
+    middleware = BrowserDownloaderMiddleware.from_crawler(crawler(1))
+    assert middleware.pool.driver_path == str(driver_path)
+    middleware.pool.resolve_driver()
+    assert manager.installs == 1
+
+
+def test_missing_driver_stops_the_crawl_at_startup(monkeypatch, tmp_path):
+
+    monkeypatch.setattr(browser, 'ChromeDriverManager', DriverManager(error=ValueError('no network')))
+    with pytest.raises(RuntimeError, match='could not be resolved'):
+        BrowserDownloaderMiddleware.from_crawler(crawler(1))
+
+    monkeypatch.setattr(browser, 'ChromeDriverManager', DriverManager(path=str(tmp_path / 'missing')))
+    with pytest.raises(RuntimeError, match='not an executable file'):
+        BrowserDownloaderMiddleware.from_crawler(crawler(1))
+
+
+def test_driver_not_resolved_without_rendering(monkeypatch):
+
+    manager = DriverManager(error=ValueError('no network'))
+    monkeypatch.setattr(browser, 'ChromeDriverManager', manager)
+    middleware = BrowserDownloaderMiddleware.from_crawler(crawler(0))
+    assert middleware.pool.driver_path is None
+    assert manager.installs == 0
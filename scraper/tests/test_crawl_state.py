@@ -0,0 +1,79 @@
+import os
+
+import scrapy
+
+from conftest import load_response
+
+from TA_scrapy.crawl_state import RestaurantProgress
+from TA_scrapy.items import RestoItem, ReviewRestoItem
+from TA_scrapy.pipelines import TaScrapyPipeline
+
+
+LISTING_URL = 'https://www.tripadvisor.co.uk/Restaurant_Review-g186338-d1234567-Reviews-The_Test_Kitchen-London_England.html'
+RESTAURANT_KEY = '/Restaurant_Review-g186338-d1234567-Reviews-The_Test_Kitchen-London_England.html'
+
+
+def test_restaurant_progress():
+
+    progress = RestaurantProgress()
+    progress.start(1, '/a')
+    progress.request(1)
+    progress.handled(1)
+    assert progress.pop_completed() == []
+
+    progress.handled(1)
+    assert progress.pop_completed() == ['/a']
+    assert progress.pop_completed() == []
+    assert progress.in_flight == {}
+
+
+def test_restaurant_completed_after_its_last_page(spider_factory):
+
+    spider = spider_factory(scrap_user=0)
+    spider.restaurant_progress.start(7, RESTAURANT_KEY)
+    spider.restaurants_ids.append(7)
+
+    # First review page : one review saved, two opened on their page, next page followed
+    outputs = list(spider.parse_review_page(load_response('review_listing_page.html', LISTING_URL), restaurant_id=7))
+    requests = [output for output in outputs if isinstance(output, scrapy.Request)]
+    assert [request.callback for request in requests] == [spider.parse_review, spider.parse_review, spider.parse_review_page]
+    assert spider.restaurant_progress.in_flight == {7: 3}
+
+    for request in requests[:2]:
+        list(spider.parse_review(load_response('single_review_page.html', request.url), **request.cb_kwargs))
+    assert spider.restaurant_progress.pop_completed() == []
+
+    # Last review page (no next page), nothing left in flight
+    spider.maxpage_reviews = 1
+    list(spider.parse_review_page(load_response('review_listing_page.html', requests[2].url), restaurant_id=7))
+    assert spider.restaurant_progress.in_flight == {7: 2}
+    for request in requests[:2]:
+        list(spider.parse_review(load_response('single_review_page.html', request.url), **request.cb_kwargs))
+    assert spider.restaurant_progress.pop_completed() == [RESTAURANT_KEY]
+
+
+def test_restaurant_recorded_once_its_items_are_published(spider_factory, tmp_path):
+
+    spider = spider_factory(scrap_user=0)
+    for folder in ('reviews', 'restaurants'):
+        os.makedirs(os.path.join(str(tmp_path), folder))
+    pipeline = TaScrapyPipeline(batch_size=100, fsync=False)
+    pipeline.open_spider(spider)
+
+    spider.restaurant_progress.start(7, RESTAURANT_KEY)
+    pipeline.process_item(RestoItem(restaurant_id=7, resto_TA_url=LISTING_URL), spider)
+    pipeline.process_item(ReviewRestoItem(review_id=1, restaurant_id=7, review_TA_url=LISTING_URL + '#review'), spider)
+    spider.restaurant_progress.handled(7)
+
+    # Complete in the spider, but its items are still buffered
+    pipeline.record_published(spider)
+    assert not spider.crawl_state.contains('restaurant', RESTAURANT_KEY)
+    assert not spider.crawl_state.contains('restaurant_item', RESTAURANT_KEY)
+
+    # A restaurant with requests in flight is not recorded when the crawl stops
+    spider.restaurant_progress.start(8, '/Restaurant_Review-unfinished')
+    pipeline.close_spider(spider)
+
+    assert spider.crawl_state.contains('restaurant', RESTAURANT_KEY)
+    assert spider.crawl_state.contains('restaurant_item', RESTAURANT_KEY)
+    assert not spider.crawl_state.contains('restaurant', '/Restaurant_Review-unfinished')
@@ -0,0 +1,110 @@
+import scrapy
+
+from conftest import load_response
+
+from TA_scrapy.crawl_state import url_path
+from TA_scrapy.items import ReviewRestoItem
+from TA_scrapy.spiders import get_info
+from TA_scrapy.spiders.extractors import EXTRACTORS
+
+
+LISTING_URL = 'https://www.tripadvisor.co.uk/Restaurant_Review-g186338-d1234567-Reviews-The_Test_Kitchen-London_England.html'
+REVIEW_URL = 'https://www.tripadvisor.co.uk/ShowUserReviews-g186338-d1234567-r70000000{}-The_Test_Kitchen-London_England.html'
+
+
+def listing_page():
+    response = load_response('review_listing_page.html', LISTING_URL)
+    return response, EXTRACTORS['review_page'].extract_response(response)
+
+
+def test_review_blocks_of_listing_page():
+
+    response, page = listing_page()
+    reviews = [get_info.get_review_in_review_page(review, response) for review in get_info.get_reviews_in_review_page(page)]
+
+    assert len(reviews) == 4
+    url, fields, truncated = reviews[0]
+    assert url == REVIEW_URL.format(1)
+    assert fields == {'username': 'FoodLover42', 'date_of_visit': 'March 2020', 'date_of_review': '12 March 2020',
+                      'rating': '5', 'title': 'Lovely Sunday roast',
+                      'comment': 'The beef was perfectly cooked and the staff were friendly.'}
+    assert not truncated
+
+    # "More" link : the comment stops before the link
+    url, fields, truncated = reviews[1]
+    assert truncated
+    assert fields['comment'] == 'We waited forty minutes for the starters, the food itself was good but...'
+
+    # Text nodes of a comment split by <br/> are joined with a space
+    url, fields, truncated = reviews[2]
+    assert fields['date_of_visit'] is None
+    assert fields['comment'] == 'Great cocktails, average desserts.'
+
+    url, fields, truncated = reviews[3]
+    assert url is None
+
+    assert get_info.get_urls_next_list_of_reviews(page) == (
+        '/Restaurant_Review-g186338-d1234567-Reviews-or10-The_Test_Kitchen-London_England.html', '2')
+
+
+def test_is_review_complete():
+
+    response, page = listing_page()
+    reviews = [get_info.get_review_in_review_page(review, response) for review in get_info.get_reviews_in_review_page(page)]
+
+    assert [get_info.is_review_complete(fields, truncated) for url, fields, truncated in reviews] == [True, False, False, False]
+
+
+def test_single_review_page():
+
+    response = load_response('single_review_page.html', REVIEW_URL.format(2))
+    fields = get_info.get_review_in_single_review_page(response)
+
+    assert fields == {'username': 'CityDiner', 'date_of_visit': 'February 2020', 'date_of_review': '10 March 2020',
+                      'rating': '3', 'title': 'Good but slow',
+                      'comment': 'We waited forty minutes for the starters, the food itself was good but the service needs work.'}
+    assert get_info.is_review_complete(fields, False)
+
+
+def test_parse_reviews_in_review_page(spider_factory):
+
+    spider = spider_factory(scrap_user=0)
+    response, page = listing_page()
+    outputs = list(spider.parse_reviews_in_review_page(response, page, restaurant_id=7))
+
+    # The complete review is saved from the listing page, the truncated and incomplete ones are opened, the one without url is skipped
+    items = [output for output in outputs if isinstance(output, ReviewRestoItem)]
+    requests = [output for output in outputs if isinstance(output, scrapy.Request)]
+    assert len(outputs) == 3
+
+    assert len(items) == 1
+    assert dict(items[0]) == {'review_id': 1, 'restaurant_id': 7, 'review_TA_url': REVIEW_URL.format(1),
+                              'username': 'FoodLover42', 'date_of_visit': 'March 2020', 'date_of_review': '12 March 2020',
+                              'rating': '5', 'title': 'Lovely Sunday roast',
+                              'comment': 'The beef was perfectly cooked and the staff were friendly.'}
+
+    assert [request.url for request in requests] == [REVIEW_URL.format(2), REVIEW_URL.format(3)]
+    assert all(request.callback == spider.parse_review for request in requests)
+    assert all(request.cb_kwargs == {'restaurant_id': 7} for request in requests)
+
+
+def test_parse_reviews_in_review_page_follows_users(spider_factory):
+
+    spider = spider_factory(scrap_user=1)
+    response, page = listing_page()
+    outputs = list(spider.parse_reviews_in_review_page(response, page, restaurant_id=7))
+
+    user_requests = [output for output in outputs if isinstance(output, scrapy.Request) and output.callback == spider.parse_user]
+    assert [request.url for request in user_requests] == ['https://www.tripadvisor.co.uk/Profile/FoodLover42']
+    assert user_requests[0].priority == -10
+
+
+def test_parse_reviews_in_review_page_skips_scraped_reviews(spider_factory):
+
+    spider = spider_factory(scrap_user=0)
+    spider.crawl_state.add('review', url_path(REVIEW_URL.format(1)))
+    spider.crawl_state.add('review', url_path(REVIEW_URL.format(2)))
+    response, page = listing_page()
+    outputs = list(spider.parse_reviews_in_review_page(response, page, restaurant_id=7))
+
+    assert [output.url for output in outputs] == [REVIEW_URL.format(3)]
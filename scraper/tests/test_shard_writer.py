@@ -0,0 +1,71 @@
+import os
+
+from TA_scrapy import shard_writer
+from TA_scrapy.shard_writer import ShardWriter
+
+
+class Clock(object):
+    """ Replaces time.monotonic in shard_writer, advanced by hand """
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def writer(tmp_path, monkeypatch, **kwargs):
+    clock = Clock()
+    monkeypatch.setattr(shard_writer.time, 'monotonic', clock)
+    return ShardWriter(str(tmp_path), 'reviews', 'test', fsync=False, **kwargs), clock
+
+
+def listing(tmp_path):
+    return sorted(os.listdir(tmp_path))
+
+
+def test_batches_and_rotation_by_size(tmp_path, monkeypatch):
+
+    shards, clock = writer(tmp_path, monkeypatch, batch_size=2, rotate_bytes=10)
+    shards.write('{"a": 1}\n', key='a')
+    assert listing(tmp_path) == []
+
+    # Batch of 2 lines written past rotate_bytes : published at once
+    shards.write('{"b": 2}\n', key='b')
+    assert listing(tmp_path) == ['reviews_test_00001.json']
+    assert shards.pop_published_keys() == ['a', 'b']
+    assert shards.pop_published_keys() == []
+
+
+def test_close_publishes_buffered_lines(tmp_path, monkeypatch):
+
+    shards, clock = writer(tmp_path, monkeypatch, batch_size=100)
+    shards.write('{"a": 1}\n', key='a')
+    shards.close()
+
+    assert listing(tmp_path) == ['reviews_test_00001.json']
+    with open(shards.filename(1)) as part_file:
+        assert part_file.read() == '{"a": 1}\n'
+    assert shards.pop_published_keys() == ['a']
+
+
+def test_periodic_flush_publishes_idle_part(tmp_path, monkeypatch):
+
+    shards, clock = writer(tmp_path, monkeypatch, batch_size=1, rotate_seconds=300)
+    shards.write('{"a": 1}\n', key='a')
+    assert listing(tmp_path) == ['.reviews_test_00001.json.tmp']
+
+    # No new line : the part is kept open until it is rotate_seconds old
+    clock.now += 299
+    shards.write_batch()
+    assert listing(tmp_path) == ['.reviews_test_00001.json.tmp']
+    assert shards.pop_published_keys() == []
+
+    clock.now += 1
+    shards.write_batch()
+    assert listing(tmp_path) == ['reviews_test_00001.json']
+    assert shards.pop_published_keys() == ['a']
+
+    # Nothing open any more : the next flushes are no-ops
+    shards.write_batch()
+    assert listing(tmp_path) == ['reviews_test_00001.json']